@@ -25,6 +25,9 @@ def create_app(config_class=Config):
     with app.app_context():
 
         db.create_all()
+        # sui database esistenti crea anche gli indici aggiunti ai modelli dopo la creazione delle tabelle
+        from app.functions.schema_indexes import create_missing_indexes
+        create_missing_indexes()
         app.logger.info("Database created")
        
         if app.config['DEMO_DATA'] and not app.config['TEST_DATA']: 
@@ -68,6 +71,15 @@ def create_app(config_class=Config):
     from app.routes import bp as routes_bp
     app.register_blueprint(routes_bp)
     app.logger.info(app.url_map)
+
+    # avvio dell'invio in background delle mail accodate nella tabella mail_outbox alla prima richiesta:
+    # il dispatcher viene avviato solo dal server web e non dagli script di manutenzione che usano create_app,
+    # e con server che creano i processi dopo il caricamento dell'app viene avviato in ogni processo
+    from app.functions.mail_outbox import start_mail_outbox_dispatcher
+
+    @app.before_request
+    def start_mail_outbox():
+        start_mail_outbox_dispatcher(app)
     
     # Refresh automatico del token JWT
     @app.after_request
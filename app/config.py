@@ -39,5 +39,39 @@ class Config:
     MAIL_USERNAME = None
     MAIL_PASSWORD =  None
     MAIL_DEFAULT_SENDER = "noreply@localhost"
+    # invio in background delle mail accodate nella tabella mail_outbox: thread di invio (0 disabilita l'invio in background),
+    # intervallo di controllo e numero di mail prese in carico per volta, tentativi massimi, attesa prima del secondo tentativo
+    # (raddoppiata ad ogni errore) e durata della presa in carico oltre la quale una mail non inviata torna disponibile
+    MAIL_OUTBOX_WORKERS = 2
+    MAIL_OUTBOX_POLL_SECONDS = 5
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 5
+    MAIL_OUTBOX_RETRY_SECONDS = 30
+    MAIL_OUTBOX_LEASE_SECONDS = 300
+    # motore di generazione degli slot: "python" (default), "numpy" per generazioni molto ampie
+    # "table" per leggere gli slot dalla tabella materializzata (ricostruibile con rebuild_slot_table.py, la tabella è aggiornata
+    # dalle scritture solo con questo motore: va ricostruita quando il motore viene attivato)
+    # oppure "sql" per espandere gli slot direttamente in PostgreSQL con generate_series
+    SLOT_ENGINE = "python"
+    # generazione parallela degli slot del motore python: numero di processi (0 o 1 disabilita)
+    # e numero minimo di disponibilità sotto il quale la generazione resta seriale
+    SLOT_GENERATION_WORKERS = 0
+    SLOT_GENERATION_PARALLEL_THRESHOLD = 200
+    # cache per processo dei risultati dei generatori: numero massimo di risultati (0 disabilita), numero massimo di slot
+    # salvati in totale (0 senza limite, i risultati più grandi non vengono salvati) e durata in secondi
+    SLOT_CACHE_SIZE = 256
+    SLOT_CACHE_MAX_SLOTS = 200000
+    SLOT_CACHE_TTL_SECONDS = 30
+    # prenotazioni temporanee degli slot: durata in secondi e numero massimo di hold attivi per account
+    SLOT_HOLD_SECONDS = 120
+    SLOT_HOLD_MAX_PER_ACCOUNT = 5
+    # durata in secondi dell'indice di ricerca degli esami: viene ricostruito prima se gli esami vengono modificati nel processo
+    SERVICE_SEARCH_INDEX_TTL_SECONDS = 300
+    # durata massima in secondi degli ETag del catalogo e degli slot. Limite: i contatori di versione sono in memoria del processo
+    # - le scritture confermate da altri processi (altri worker, script di manutenzione) non cambiano l'ETag: un client può
+    #   ricevere 304 con dati non aggiornati fino a ETAG_TTL_SECONDS dopo la scrittura
+    # - l'ETag contiene l'identificativo del processo: con più worker una richiesta servita da un altro worker riceve sempre 200
+    # 0 disattiva la scadenza (ETag validi fino alla prossima scrittura nel processo): da usare solo con un unico processo
+    ETAG_TTL_SECONDS = 30
 
   
\ No newline at end of file
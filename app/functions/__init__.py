@@ -1 +1,3 @@
-from .generate_available_slots import generate_available_slots
\ No newline at end of file
+from .generate_available_slots import generate_available_slots, iter_available_slots, count_available_slots, find_next_available_slots
+from .slot_table import rebuild_slot_table
+from .slot_cache import get_slot_cache_stats
\ No newline at end of file
@@ -0,0 +1,30 @@
+# rappresentazione compatta di uno slot libero restituita dai generatori
+# ogni slot contiene solo il riferimento all'intestazione condivisa della disponibilità (vedi get_slot_header),
+# la data e gli orari in isoformat già condivisi tra gli slot: il dizionario pubblico viene costruito con to_dict
+# solo al momento della serializzazione e solo per gli slot effettivamente restituiti
+class AvailableSlot:
+    __slots__ = ("availability", "appointment_date", "appointment_time_start", "appointment_time_end")
+
+    def __init__(self, availability, appointment_date, appointment_time_start, appointment_time_end):
+        self.availability = availability
+        self.appointment_date = appointment_date
+        self.appointment_time_start = appointment_time_start
+        self.appointment_time_end = appointment_time_end
+
+    @property
+    def availability_id(self):
+        return self.availability[0]
+
+    def to_dict(self):
+        availability_id, service_name, location_name, location_address, location_tel_number, operator_name = self.availability
+        return {
+            "availability_id": availability_id,
+            "service_name": service_name,
+            "location_name": location_name,
+            "location_address": location_address,
+            "location_tel_number": location_tel_number,
+            "operator_name": operator_name,
+            "appointment_date": self.appointment_date,
+            "appointment_time_start": self.appointment_time_start,
+            "appointment_time_end": self.appointment_time_end
+        }
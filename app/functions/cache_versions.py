@@ -0,0 +1,65 @@
+from threading import Lock
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# contatori di versione condivisi dalle cache per processo (risultati degli slot, filtri, indice di ricerca, ETag):
+# ogni cache registra una funzione che durante il flush restituisce le chiavi toccate dalle scritture (di solito gli esami)
+# e le versioni di quelle chiavi vengono incrementate solo quando le scritture sono confermate con commit
+# una voce in cache salvata con la versione letta prima del calcolo diventa obsoleta appena la versione cambia
+
+# chiave speciale restituita durante il flush per rendere obsolete tutte le voci della cache
+ALL_CACHE_KEYS = object()
+
+class CacheVersions:
+
+    # name è la chiave delle modifiche raccolte in session.info, collect_changes(session) restituisce le chiavi modificate nel flush
+    def __init__(self, name, collect_changes = None):
+        self.name = name
+        self.collect_changes = collect_changes
+        self.lock = Lock()
+        # versione generale (incrementata da clear e da ALL_CACHE_KEYS) e versioni per chiave,
+        # la chiave None è incrementata ad ogni modifica ed è usata dalle voci non legate a una chiave
+        self.global_version = 0
+        self.versions = {}
+        event.listen(Session, "after_flush", self.on_flush)
+        event.listen(Session, "after_commit", self.on_commit)
+        event.listen(Session, "after_rollback", self.on_rollback)
+
+    def get_version(self, key = None):
+        return self.global_version, self.versions.get(key, 0)
+
+    # incrementa la versione delle chiavi indicate e quella della chiave None
+    def bump(self, keys):
+        with self.lock:
+            for key in set(keys) | {None}:
+                if key is ALL_CACHE_KEYS:
+                    self.global_version += 1
+                else:
+                    self.versions[key] = self.versions.get(key, 0) + 1
+
+    # rende obsolete tutte le voci (necessario dopo scritture massive che non passano dalla sessione)
+    def clear(self):
+        with self.lock:
+            self.global_version += 1
+
+    # registra nella sessione chiavi toccate da scritture che non passano dal flush (inserimenti massivi con Core)
+    def add_changes(self, session, keys):
+        session.info.setdefault(self.name, set()).update(keys)
+
+    # verifica se la sessione ha scritture raccolte ma non ancora confermate
+    def has_pending_changes(self, session):
+        return bool(session.info.get(self.name))
+
+    def on_flush(self, session, flush_context):
+        if self.collect_changes is not None:
+            keys = self.collect_changes(session)
+            if keys:
+                self.add_changes(session, keys)
+
+    def on_commit(self, session):
+        keys = session.info.pop(self.name, None)
+        if keys:
+            self.bump(keys)
+
+    def on_rollback(self, session):
+        session.info.pop(self.name, None)
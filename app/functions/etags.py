@@ -0,0 +1,66 @@
+import hashlib
+import time
+from uuid import uuid4
+from flask import current_app, request
+from app.models.model import Service, Availability
+from app.functions.model_changes import get_attribute_values, has_attribute_changes
+from app.functions.slot_cache import to_uuid, get_slot_cache_version
+from app.functions.slot_holds import get_slot_holds_version
+from app.functions.cache_versions import CacheVersions
+
+# ETag per le richieste condizionali (If-None-Match) del catalogo e degli slot: l'ETag è calcolato dai contatori di versione
+# incrementati dalle scritture confermate, così una pagina non modificata riceve 304 prima di eseguire query e generazione
+# degli slot (per gli slot l'unica lettura è il conteggio degli hold attivi nella tabella slot_hold)
+# i contatori sono per processo: l'ETag contiene un identificativo del processo (un ETag di un altro processo non corrisponde mai)
+# e cambia almeno ogni ETAG_TTL_SECONDS, in modo che le scritture confermate da altri processi siano viste entro quel tempo
+
+# colonne degli esami e delle disponibilità mostrate nel catalogo (nome, descrizione e numero di disponibilità attive)
+SERVICE_CATALOGUE_FIELDS = ("name", "description")
+AVAILABILITY_CATALOGUE_FIELDS = ("service_id", "enabled")
+
+etag_epoch = uuid4().hex
+
+# versione del catalogo dell'esame, senza esame la versione della lista degli esami
+def get_catalogue_version(service_id = None):
+    return catalogue_versions.get_version(service_id)
+
+# versione degli slot dell'esame: scritture che influenzano gli slot, hold attivi e primo giorno prenotabile
+def get_slots_version(service_id, min_reservation_datetime):
+    return get_slot_cache_version(service_id), get_slot_holds_version(), min_reservation_datetime.date().isoformat()
+
+# calcola un ETag forte dalle versioni indicate, dall'identificativo del processo e dall'intervallo di ETAG_TTL_SECONDS corrente
+def make_etag(*versions):
+    etag_ttl_seconds = current_app.config.get("ETAG_TTL_SECONDS", 0)
+    time_bucket = int(time.time() // etag_ttl_seconds) if etag_ttl_seconds > 0 else 0
+    return hashlib.sha1(repr((etag_epoch, time_bucket, versions)).encode()).hexdigest()
+
+# restituisce la risposta 304 se il client ha già la versione corrente, altrimenti None
+def get_not_modified_response(etag):
+    if not request.if_none_match.contains(etag):
+        return None
+    return add_etag(current_app.response_class(status=304), etag)
+
+# aggiunge l'ETag alla risposta: il client deve sempre rivalidare la risposta salvata
+def add_etag(response, etag):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# incrementa la versione generale (necessario dopo scritture massive che non passano dalla sessione)
+def clear_catalogue_versions():
+    catalogue_versions.clear()
+
+# restituisce durante il flush gli esami modificati e gli esami delle disponibilità create, cancellate, attivate o disattivate
+def collect_catalogue_changes(session):
+    service_ids = set()
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        is_changed = target not in session.dirty
+        if isinstance(target, Service):
+            if is_changed or has_attribute_changes(target, SERVICE_CATALOGUE_FIELDS):
+                service_ids.add(to_uuid(target.service_id))
+        elif isinstance(target, Availability):
+            if is_changed or has_attribute_changes(target, AVAILABILITY_CATALOGUE_FIELDS):
+                service_ids.update(map(to_uuid, get_attribute_values(target, "service_id")))
+    return service_ids
+
+catalogue_versions = CacheVersions("catalogue_changes", collect_catalogue_changes)
@@ -1,17 +1,68 @@
-from datetime import date, datetime, timedelta
+from bisect import bisect_left
+from heapq import merge
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from app.models.model import Availability, Appointment, LocationClosure, OperatorAbsence
+from app.functions.slot_dimensions import get_availability_slot_header
+from app.functions.available_slot import AvailableSlot
+from app.functions.slot_cache import cached_slot_result
+from app.functions.slot_holds import get_held_slot_keys, exclude_held_slots
 
+MINUTES_PER_DAY = 24 * 60
+SLOT_TEMPLATE_CACHE_SIZE = 1024
+SLOT_STREAM_CHUNK_DAYS = 31
 
-# aggiunge minuti ad un orario (non considera il cambio di giorno)
-def add_minutes_to_time(original_time, minutes_to_add):
-        temp_datetime = datetime.combine(date.today(), original_time)
-        temp_datetime += timedelta(minutes=minutes_to_add)
-        return temp_datetime.time()
+# converte un orario in minuti dalla mezzanotte
+def time_to_minutes(original_time):
+    return original_time.hour * 60 + original_time.minute
+
+# converte un datetime in minuti assoluti (giorno ordinale * minuti al giorno + minuti dalla mezzanotte)
+# i secondi vengono arrotondati per difetto o per eccesso in modo che i confronti con slot a minuti interi restino esatti
+def datetime_to_minutes(original_datetime, round_up = False):
+    minutes = original_datetime.toordinal() * MINUTES_PER_DAY + original_datetime.hour * 60 + original_datetime.minute
+    if round_up and (original_datetime.second or original_datetime.microsecond):
+        minutes += 1
+    return minutes
+
+# calcola una sola volta il modello giornaliero degli slot di una regola di disponibilità
+# ogni elemento è (minuto inizio, minuto fine, orario inizio, orario fine, inizio isoformat, fine isoformat)
+# la cache è indicizzata sui valori della regola, quindi quando la riga cambia viene usato automaticamente un nuovo modello
+@lru_cache(maxsize=SLOT_TEMPLATE_CACHE_SIZE)
+def build_slot_template(from_minute, to_minute, slot_duration_minutes, pause_minutes):
+    slot_template = []
+    start_minute = from_minute
+    # gli slot partono sempre dall'orario di inizio della disponibilità (necessario per generare gli slot in modo univoco)
+    while start_minute < to_minute:
+        end_minute = start_minute + slot_duration_minutes
+        # se lo slot supera l'orario di fine disponibilità il modello è completo
+        if end_minute > to_minute:
+            break
+        start_time = time(start_minute // 60, start_minute % 60)
+        end_time = time(end_minute // 60, end_minute % 60)
+        slot_template.append((start_minute, end_minute, start_time, end_time, start_time.isoformat(timespec='minutes'), end_time.isoformat(timespec='minutes')))
+        start_minute = end_minute + pause_minutes
+    return tuple(slot_template)
+
+# restituisce il modello degli slot di una disponibilità
+def get_availability_slot_template(availability):
+    return build_slot_template(
+        time_to_minutes(availability.available_from_time),
+        time_to_minutes(availability.available_to_time),
+        availability.slot_duration_minutes,
+        availability.pause_minutes
+    )
 
 # recupera le disponibilità attive con filtri per data, tipo esame, operatore e laboratorio (se speficiati) e in sovrapposizione con date e orari (se specificati)
+# esame, laboratorio e operatore vengono caricati nella stessa query per evitare un caricamento lazy per ogni disponibilità
 def get_enabled_availabilities(from_datetime = None, to_datetime = None, service_id = None, operator_id = None, location_id = None):
-    query = Availability.query.filter(Availability.enabled == True)
+    query = Availability.query.options(
+        joinedload(Availability.service),
+        joinedload(Availability.location),
+        joinedload(Availability.operator)
+    ).filter(Availability.enabled == True)
     if service_id:
         query = query.filter(Availability.service_id == service_id)
     if operator_id:
@@ -23,8 +74,20 @@ def get_enabled_availabilities(from_datetime = None, to_datetime = None, service
         query = query.filter(Availability.available_to_date >= from_datetime.date())
     if to_datetime:
         query = query.filter(Availability.available_from_date <= to_datetime.date())
-    return query.all()
+    # l'ordine delle disponibilità determina l'ordine degli slot nella stessa data: tutti i motori ordinano per availability_id
+    return query.order_by(Availability.availability_id).all()
     
+# recupera la prima e l'ultima data coperte dalle disponibilità attive con i filtri per tipo esame, operatore e laboratorio
+def get_enabled_availabilities_date_bounds(service_id = None, operator_id = None, location_id = None):
+    query = Availability.query.with_entities(func.min(Availability.available_from_date), func.max(Availability.available_to_date)).filter(Availability.enabled == True)
+    if service_id:
+        query = query.filter(Availability.service_id == service_id)
+    if operator_id:
+        query = query.filter(Availability.operator_id == operator_id)
+    if location_id:
+        query = query.filter(Availability.location_id == location_id)
+    return query.one()
+
 # recupera le chiusure per laborariorio (se specificato) e in sovrapposizione con date e orari (se specificati)
 def get_location_closures(from_datetime = None, to_datetime = None, location_id = None):
     query = LocationClosure.query
@@ -51,9 +114,18 @@ def get_operator_absences(from_datetime = None, to_datetime = None, operator_id
     return query.all()
         
 #recupera slot già prenotati (non rejected) la cui data di appuntamento è in sovrapposizione al filtro
-def get_active_appointments(from_datetime=None, to_datetime=None):
+# se indicate vengono considerate solo le disponibilità candidate e vengono letti solo i campi della chiave dello slot
+# la query è servita dall'indice parziale ix_active_appointments_availability_date (availability_id, appointment_date) where rejected = false
+def get_active_appointments(from_datetime=None, to_datetime=None, availability_ids=None):
     
-    query = Appointment.query.filter(Appointment.rejected == False)
+    query = Appointment.query.with_entities(
+        Appointment.availability_id,
+        Appointment.appointment_date,
+        Appointment.appointment_time_start,
+        Appointment.appointment_time_end
+    ).filter(Appointment.rejected == False)
+    if availability_ids is not None:
+        query = query.filter(Appointment.availability_id.in_(availability_ids))
     if from_datetime:
         query = query.filter(Appointment.appointment_date >= from_datetime.date())
     if to_datetime:
@@ -61,45 +133,82 @@ def get_active_appointments(from_datetime=None, to_datetime=None):
         
     return query.all()
 
+# restituisce la prima data utile (già spostata sul giorno della settimana della regola) e l'ultima data della disponibilità
+# le date della disponibilità vengono sovrascritte dai filtri se impostati e se sono più restrittivi rispetto alla regola
+def get_availability_date_range(availability, datetime_from_filter = None, datetime_to_filter = None):
+    if  isinstance(datetime_from_filter, datetime):
+        first_date = max(availability.available_from_date, datetime_from_filter.date())
+    else:
+        first_date = availability.available_from_date
+    if  isinstance(datetime_to_filter, datetime):
+        last_date = min(datetime_to_filter.date(), availability.available_to_date)
+    else:
+        last_date = availability.available_to_date
+
+    # sposta la data al primo giorno della settimana indicato nella availability
+    first_date += timedelta(days=((availability.available_weekday - first_date.weekday()) % 7))
+    return first_date, last_date
+
+# costruisce un indice a intervalli raggruppato per chiave (laboratorio o operatore)
+# per ogni chiave mantiene gli inizi ordinati e il massimo progressivo delle fini, così la verifica di sovrapposizione costa O(log n)
+# gli intervalli sono espressi in minuti assoluti: inizio arrotondato per difetto e fine per eccesso
+def build_interval_index(rows, key_attr):
+    grouped_intervals = {}
+    for row in rows:
+        grouped_intervals.setdefault(getattr(row, key_attr), []).append(
+            (datetime_to_minutes(row.start_datetime), datetime_to_minutes(row.end_datetime, round_up=True))
+        )
+
+    interval_index = {}
+    for key, intervals in grouped_intervals.items():
+        intervals.sort()
+        starts = []
+        max_ends = []
+        for start, end in intervals:
+            starts.append(start)
+            max_ends.append(end if not max_ends or end > max_ends[-1] else max_ends[-1])
+        interval_index[key] = (starts, max_ends)
+    return interval_index
+
+# verifica se l'intervallo [start, end) si sovrappone ad almeno uno degli intervalli indicizzati per la chiave
+def overlaps_interval_index(interval_index, key, start, end):
+    indexed_intervals = interval_index.get(key)
+    if indexed_intervals is None:
+        return False
+    starts, max_ends = indexed_intervals
+    # gli intervalli candidati sono quelli che iniziano prima della fine dello slot, basta che uno di essi finisca dopo l'inizio
+    position = bisect_left(starts, end)
+    return position > 0 and max_ends[position - 1] > start
+
 # verifica se il laboratorio è chiuso per un laborio specifico
-def is_location_id_closed(location_closures, location_id, slot_start_datetime, slot_end_datetime):
-    if not location_closures:
+def is_location_id_closed(location_closures_index, location_id, slot_start_minute, slot_end_minute):
+    if not location_closures_index:
         return False
-    else: 
-        return any(
-            location_id == location_closure.location_id and
-                slot_start_datetime < location_closure.end_datetime and
-                slot_end_datetime > location_closure.start_datetime
-            for location_closure in location_closures
-        ) 
+    return overlaps_interval_index(location_closures_index, location_id, slot_start_minute, slot_end_minute)
 
 # verifica se l'operatore è assente in un intervallo di date e orario
-def is_operator_id_absent(operator_absences , operator_id, slot_start_datetime, slot_end_datetime):
-    if not operator_absences:
+def is_operator_id_absent(operator_absences_index, operator_id, slot_start_minute, slot_end_minute):
+    if not operator_absences_index:
         return False
-    else:
-        return any(
-            operator_id == operator_absence.operator_id and
-            slot_start_datetime < operator_absence.end_datetime and
-            slot_end_datetime > operator_absence.start_datetime
-            for operator_absence in operator_absences
-        ) 
+    return overlaps_interval_index(operator_absences_index, operator_id, slot_start_minute, slot_end_minute)
+
+# costruisce l'insieme degli slot prenotati con chiave (availability_id, data, inizio, fine)
+def build_booked_slots_index(appointments):
+    return {
+        (booked_slot.availability_id, booked_slot.appointment_date, booked_slot.appointment_time_start, booked_slot.appointment_time_end)
+        for booked_slot in appointments
+    }
 
 # verifica se esiste lo slot è già stato prenotato in relazione ad una regola di disponibilità
-def is_slot_booked(appointments, availability_id, appointment_date, from_time, to_time):
+def is_slot_booked(booked_slots_index, availability_id, appointment_date, from_time, to_time):
     
-    if not appointments:
+    if not booked_slots_index:
         return False
-    else:
-        return any(
-            availability_id == booked_slot.availability_id and
-            appointment_date == booked_slot.appointment_date and
-            from_time == booked_slot.appointment_time_start and
-            to_time == booked_slot.appointment_time_end
-            for booked_slot in appointments
-        )
+    return (availability_id, appointment_date, from_time, to_time) in booked_slots_index
     
-def generate_available_slots(
+# recupera una sola volta per chiamata le disponibilità attive e, se le esclusioni sono attivate, gli indici di chiusure, assenze e appuntamenti attivi
+# restituisce le disponibilità e le esclusioni da applicare agli slot (limiti dei filtri in minuti assoluti e indici)
+def prepare_slot_generation(
     datetime_from_filter = None, 
     datetime_to_filter = None, 
     service_id = None,
@@ -109,108 +218,393 @@ def generate_available_slots(
     exclude_operator_absence_slots = True, 
     exclude_booked_slots= True
     ):
-    
-    availabilities_slots_dategroup = {}
-    
+
     # Recupera le disponibilità attive con i filtri se applicati
     availabilities = get_enabled_availabilities(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
-    
-    # se le esclusioni sono attivate recupera le chiusure, le assenze e gli appuntamenti attivi con i filtri se applicati
+    if not availabilities:
+        return availabilities, None
+
+    # chiusure, assenze e appuntamenti attivi vengono indicizzati una sola volta per chiamata
+    location_closures_index = None
+    operator_absences_index = None
+    booked_slots_index = None
     if exclude_location_closure_slots:
-        location_closures = get_location_closures(datetime_from_filter, datetime_to_filter, location_id)
+        location_closures_index = build_interval_index(get_location_closures(datetime_from_filter, datetime_to_filter, location_id), "location_id")
     if exclude_operator_absence_slots:
-        operator_absences = get_operator_absences(datetime_from_filter, datetime_to_filter, operator_id)
+        operator_absences_index = build_interval_index(get_operator_absences(datetime_from_filter, datetime_to_filter, operator_id), "operator_id")
     if exclude_booked_slots:
-        appointments = get_active_appointments(datetime_from_filter, datetime_to_filter)
+        # vengono letti solo gli appuntamenti delle disponibilità candidate per limitare query e memoria sulle finestre lunghe
+        availability_ids = [availability.availability_id for availability in availabilities]
+        booked_slots_index = build_booked_slots_index(get_active_appointments(datetime_from_filter, datetime_to_filter, availability_ids))
+
+    # i limiti dei filtri vengono convertiti in minuti assoluti: un secondo oltre il minuto sposta il limite al minuto successivo
+    from_filter_minute = datetime_to_minutes(datetime_from_filter, round_up=True) if datetime_from_filter else None
+    to_filter_minute = datetime_to_minutes(datetime_to_filter) if datetime_to_filter else None
+
+    return availabilities, (from_filter_minute, to_filter_minute, booked_slots_index, operator_absences_index, location_closures_index)
+
+# applica il modello degli slot di una disponibilità a ciascuna data utile e restituisce per ogni data gli elementi del modello liberi
+# con stop_at_first la ricerca su una data si interrompe al primo slot libero
+def iter_availability_free_slots(availability, slot_exclusions, datetime_from_filter = None, datetime_to_filter = None, stop_at_first = False):
+    from_filter_minute, to_filter_minute, booked_slots_index, operator_absences_index, location_closures_index = slot_exclusions
+
+    appointment_date, availability_maxdate = get_availability_date_range(availability, datetime_from_filter, datetime_to_filter)
+    slot_template = get_availability_slot_template(availability)
+
+    # per ciascun giorno fino a fine disponibilià compresa applica il modello degli slot alla data
+    while appointment_date <= availability_maxdate:
+
+        day_minute = appointment_date.toordinal() * MINUTES_PER_DAY
+        free_slots = []
+
+        for slot in slot_template:
+            start_minute, end_minute, appointment_time_start, appointment_time_end, _, _ = slot
+            slot_start_minute = day_minute + start_minute
+            slot_end_minute = day_minute + end_minute
+
+            # se attivati i filtri escludi gli slot che non soddisfano le condizioni
+            # escludi lo slot se precede l'orario (time) di inizio filtro
+            if from_filter_minute is not None and slot_start_minute < from_filter_minute:
+                continue
+            # escludi lo slot se supera l'orario (time) di fine filtro
+            if to_filter_minute is not None and slot_end_minute > to_filter_minute:
+                continue
+            # esecludi lo slot se è già prenotato
+            if is_slot_booked(booked_slots_index, availability.availability_id, appointment_date, appointment_time_start, appointment_time_end):
+                continue
+            # escludi lo slot se l'operatore è assente
+            if is_operator_id_absent(operator_absences_index, availability.operator_id, slot_start_minute, slot_end_minute):
+                continue
+            # escludi lo slot se il laboratorio è chiuso
+            if is_location_id_closed(location_closures_index, availability.location_id, slot_start_minute, slot_end_minute):
+                continue
+
+            free_slots.append(slot)
+            if stop_at_first:
+                break
+
+        if free_slots:
+            yield appointment_date, free_slots
+        # passa alla settimana successiva
+        appointment_date += timedelta(days=7)
+
+# gli slot bloccati da hold temporanei vengono esclusi dopo la cache, così creazione e scadenza degli hold non invalidano i risultati
+def generate_available_slots(
+    datetime_from_filter = None, 
+    datetime_to_filter = None, 
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True, 
+    exclude_operator_absence_slots = True, 
+    exclude_booked_slots= True
+    ):
+
+    availabilities_slots_dategroup = generate_cached_available_slots(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+    if exclude_booked_slots:
+        return exclude_held_slots(availabilities_slots_dategroup)
+    return availabilities_slots_dategroup
+
+@cached_slot_result
+def generate_cached_available_slots(
+    datetime_from_filter = None, 
+    datetime_to_filter = None, 
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True, 
+    exclude_operator_absence_slots = True, 
+    exclude_booked_slots= True
+    ):
+
+    slot_engine = current_app.config.get('SLOT_ENGINE', 'python')
+    # il motore vettoriale viene importato solo se selezionato per non richiedere numpy negli altri casi
+    if slot_engine == 'numpy':
+        from app.functions.generate_available_slots_numpy import generate_available_slots_numpy
+        return generate_available_slots_numpy(
+            datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+            exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+        )
+    # il motore SQL espande le regole nel database ed è disponibile solo con PostgreSQL, altrimenti si usa il generatore python
+    if slot_engine == 'sql':
+        from app.functions.generate_available_slots_sql import can_use_slot_sql, generate_available_slots_sql
+        if can_use_slot_sql():
+            return generate_available_slots_sql(
+                datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+                exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+            )
+    # la tabella degli slot materializzati risponde solo se copre la richiesta, altrimenti si usa il generatore python
+    if slot_engine == 'table':
+        from app.functions.slot_table import can_use_slot_table, generate_available_slots_table
+        if can_use_slot_table(datetime_from_filter, datetime_to_filter, exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots):
+            return generate_available_slots_table(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
+    
+    availabilities_slots_dategroup = {}
+    
+    availabilities, slot_exclusions = prepare_slot_generation(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
     
     # se non ci sono disponibilità esci
     if not availabilities:
         current_app.logger.info("No operators availability provided.")
         return availabilities_slots_dategroup
     
-    for availability in availabilities:
+    # con molte disponibilità l'espansione può essere distribuita su più processi (SLOT_GENERATION_WORKERS > 1)
+    slot_generation_workers = current_app.config.get('SLOT_GENERATION_WORKERS', 0)
+    if slot_generation_workers > 1 and len(availabilities) >= current_app.config.get('SLOT_GENERATION_PARALLEL_THRESHOLD', 0):
+        from app.functions.generate_available_slots_parallel import expand_availabilities_parallel
+        availabilities_free_slots = expand_availabilities_parallel(availabilities, slot_exclusions, datetime_from_filter, datetime_to_filter, slot_generation_workers)
+    else:
+        availabilities_free_slots = (
+            (
+                (appointment_date.isoformat(), [(time_start_iso, time_end_iso) for _, _, _, _, time_start_iso, time_end_iso in free_slots])
+                for appointment_date, free_slots in iter_availability_free_slots(availability, slot_exclusions, datetime_from_filter, datetime_to_filter)
+            )
+            for availability in availabilities
+        )
+
+    for availability, free_slot_dates in zip(availabilities, availabilities_free_slots):
         current_app.logger.debug("Processing availability_id=%s", availability.availability_id)
-        
-        # Sovrascrivi le date della disponibilità basandoti sui filtri se impostati e se sono più restrittivi rispetto alla regola di disponibilità
-        
-        if  isinstance(datetime_from_filter, datetime):
-            appointment_date = max(availability.available_from_date, datetime_from_filter.date())
-        else:
-            appointment_date = availability.available_from_date
-        if  isinstance(datetime_to_filter, datetime):
-            availability_maxdate = min(datetime_to_filter.date(), availability.available_to_date)
-        else:
-            availability_maxdate = availability.available_to_date
-            
-        #current_app.logger.debug("Filtered date range: %s - %s",appointment_date,availability_maxdate)
-        
-        # sposta availability date al primo giorno della settimana indicato nella availability
-        appointment_date += timedelta(days=((availability.available_weekday - appointment_date.weekday()) % 7))
-        
-        # per ciascun giorno fino a fine disponibilià compresa
-        while appointment_date <= availability_maxdate:
-            
-            # imposta la partenza del primo slot sempre all'orario di partenza delle disponibiltà (necessario per generare gli slot in modo univoco)
-            appointment_time_start = availability.available_from_time
-            # per ciascun giorno crea gli slot in fino all'ora di di fine disponibilità
-            while appointment_time_start < availability.available_to_time:
-                
-                # calcola la fine dello slot
-                appointment_time_end = add_minutes_to_time(appointment_time_start, availability.slot_duration_minutes)
-                
-                # se lo slot supera l'orario esci dal ciclo e passa alla settimana successiva
-                if appointment_time_end > availability.available_to_time:
-                   break
-                
-                slot = {
-                    "availability_id": availability.availability_id,
-                    "service_name": availability.service.name,
-                    "location_name": availability.location.name,
-                    "location_address": availability.location.address,
-                    "location_tel_number": availability.location.tel_number,
-                    "operator_name": f"{availability.operator.title} {availability.operator.first_name} {availability.operator.last_name}",
-                    "appointment_date":  appointment_date.isoformat(),
-                    "appointment_time_start": appointment_time_start.isoformat(timespec='minutes'),
-                    "appointment_time_end": appointment_time_end.isoformat(timespec='minutes')
-                }
-                
-                slot_start_datetime = datetime.combine(appointment_date, appointment_time_start)
-                slot_end_datetime = datetime.combine(appointment_date, appointment_time_end)
-                
-                # se attivati i filtri escludi gli slot che non soddisfano le condizioni
-                exclude_conditions = []
-                # escludi lo slot se precede l'orario (time) di inizio filtro
-                if datetime_from_filter:
-                    exclude_conditions.append(slot_start_datetime < datetime_from_filter)
-                # escludi lo slot se supera l'orario (time) di fine filtro
-                if datetime_to_filter:
-                    exclude_conditions.append(slot_end_datetime > datetime_to_filter)
-                # esecludi lo slot se è già prenotato
-                if exclude_booked_slots:
-                    exclude_conditions.append(is_slot_booked(appointments, availability.availability_id, appointment_date, appointment_time_start, appointment_time_end))
-                # escludi lo slot se l'operatore è assente
-                if exclude_operator_absence_slots:
-                    exclude_conditions.append(is_operator_id_absent(operator_absences, availability.operator_id, slot_start_datetime, slot_end_datetime))
-                # escludi lo slot se il laboratorio è chiuso
-                if exclude_location_closure_slots:
-                    exclude_conditions.append(is_location_id_closed(location_closures, availability.location_id, slot_start_datetime, slot_end_datetime))
-                
-                # se uno dei filtri indicati è vero scarta lo slot
-                if any(exclude_conditions):
-                    appointment_time_start = add_minutes_to_time(appointment_time_end, availability.pause_minutes)
-                    continue
-                    
-                # se lo slot è valido aggiungilo al dizionario
-            
-                if appointment_date.isoformat() in availabilities_slots_dategroup:
-                    availabilities_slots_dategroup[appointment_date.isoformat()].append(slot)
-                else:
-                    availabilities_slots_dategroup[appointment_date.isoformat()] = [slot]
-                appointment_time_start = add_minutes_to_time(appointment_time_end, availability.pause_minutes)
-            # passa alla settimana successiva
-            appointment_date += timedelta(days=7)
+        slot_header = get_availability_slot_header(availability)
+
+        for appointment_date_iso, free_slot_times in free_slot_dates:
+            # gli slot validi vengono aggiunti al dizionario in forma compatta, il dizionario pubblico viene creato solo in serializzazione
+            slots = [AvailableSlot(slot_header, appointment_date_iso, time_start_iso, time_end_iso) for time_start_iso, time_end_iso in free_slot_times]
+            if appointment_date_iso in availabilities_slots_dategroup:
+                availabilities_slots_dategroup[appointment_date_iso].extend(slots)
+            else:
+                availabilities_slots_dategroup[appointment_date_iso] = slots
     
     current_app.logger.debug("Generated for %d dates", len(availabilities_slots_dategroup))
     current_app.logger.debug("Generated %d slots", sum(len(slots) for slots in availabilities_slots_dategroup.values()))
             
-    return availabilities_slots_dategroup
\ No newline at end of file
+    return availabilities_slots_dategroup
+
+# generatore senza cache dei risultati (funzione originale del decoratore) usato per i blocchi dello streaming
+generate_uncached_available_slots = generate_cached_available_slots.__wrapped__
+
+# conta gli slot liberi per data senza costruire i dizionari degli slot: restituisce {data isoformat: numero di slot liberi}
+# con stop_at_first per ogni disponibilità e data ci si ferma al primo slot libero, il conteggio indica quindi solo
+# quante disponibilità hanno almeno uno slot libero in quella data ed è sufficiente per sapere quali date sono prenotabili
+# come in generate_available_slots gli slot bloccati da hold temporanei vengono esclusi dopo la cache
+def count_available_slots(
+    datetime_from_filter = None, 
+    datetime_to_filter = None, 
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True, 
+    exclude_operator_absence_slots = True, 
+    exclude_booked_slots= True,
+    stop_at_first = False
+    ):
+
+    available_slots_count_dategroup = count_cached_available_slots(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots, stop_at_first
+    )
+    if not exclude_booked_slots:
+        return available_slots_count_dategroup
+
+    held_slot_keys = get_held_slot_keys()
+    held_dates = {appointment_date for _, appointment_date, _ in held_slot_keys if appointment_date in available_slots_count_dategroup}
+    if not held_dates:
+        return available_slots_count_dategroup
+
+    # le date con slot bloccati (pochi: gli hold sono limitati per account) vengono ricontate dagli slot della singola data
+    # il risultato originale può essere condiviso dalla cache: viene restituita una copia
+    unheld_slots_count_dategroup = dict(available_slots_count_dategroup)
+    for appointment_date_iso in held_dates:
+        day_datetime = datetime.fromisoformat(appointment_date_iso)
+        day_datetime_from_filter = max(datetime_from_filter, day_datetime) if datetime_from_filter else day_datetime
+        day_datetime_to_filter = min(datetime_to_filter, day_datetime + timedelta(days=1)) if datetime_to_filter else day_datetime + timedelta(days=1)
+        unheld_slots = [
+            slot for slot in generate_cached_available_slots(
+                day_datetime_from_filter, day_datetime_to_filter, service_id, operator_id, location_id,
+                exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+            ).get(appointment_date_iso, [])
+            if (slot.availability_id, slot.appointment_date, slot.appointment_time_start) not in held_slot_keys
+        ]
+        unheld_slots_count = len({slot.availability_id for slot in unheld_slots}) if stop_at_first else len(unheld_slots)
+        if unheld_slots_count:
+            unheld_slots_count_dategroup[appointment_date_iso] = unheld_slots_count
+        else:
+            del unheld_slots_count_dategroup[appointment_date_iso]
+    return unheld_slots_count_dategroup
+
+@cached_slot_result
+def count_cached_available_slots(
+    datetime_from_filter = None, 
+    datetime_to_filter = None, 
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True, 
+    exclude_operator_absence_slots = True, 
+    exclude_booked_slots= True,
+    stop_at_first = False
+    ):
+
+    slot_engine = current_app.config.get('SLOT_ENGINE', 'python')
+    # il motore vettoriale, il motore SQL e la tabella degli slot calcolano comunque i conteggi esatti
+    if slot_engine == 'numpy':
+        from app.functions.generate_available_slots_numpy import count_available_slots_numpy
+        return count_available_slots_numpy(
+            datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+            exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+        )
+    if slot_engine == 'sql':
+        from app.functions.generate_available_slots_sql import can_use_slot_sql, count_available_slots_sql
+        if can_use_slot_sql():
+            return count_available_slots_sql(
+                datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+                exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+            )
+    if slot_engine == 'table':
+        from app.functions.slot_table import can_use_slot_table, count_available_slots_table
+        if can_use_slot_table(datetime_from_filter, datetime_to_filter, exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots):
+            return count_available_slots_table(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
+
+    available_slots_count_dategroup = {}
+
+    availabilities, slot_exclusions = prepare_slot_generation(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+    if not availabilities:
+        current_app.logger.info("No operators availability provided.")
+        return available_slots_count_dategroup
+
+    for availability in availabilities:
+        for appointment_date, free_slots in iter_availability_free_slots(availability, slot_exclusions, datetime_from_filter, datetime_to_filter, stop_at_first):
+            appointment_date_iso = appointment_date.isoformat()
+            available_slots_count_dategroup[appointment_date_iso] = available_slots_count_dategroup.get(appointment_date_iso, 0) + len(free_slots)
+
+    return available_slots_count_dategroup
+
+# genera gli slot disponibili data per data in ordine cronologico restituendo coppie (data isoformat, [slot, ...])
+# la finestra viene elaborata a blocchi di giorni interi: gli slot non attraversano la mezzanotte, quindi il risultato
+# coincide con generate_available_slots ma la memoria occupata dipende solo dall'ampiezza del blocco
+# i blocchi non passano dalla cache dei risultati, che altrimenti li terrebbe tutti in memoria
+def iter_available_slots(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True,
+    chunk_days = SLOT_STREAM_CHUNK_DAYS
+    ):
+
+    for chunk_from_datetime, chunk_to_datetime in iter_slot_chunk_windows(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id, chunk_days):
+        chunk_slots = generate_uncached_available_slots(
+            chunk_from_datetime,
+            chunk_to_datetime,
+            service_id,
+            operator_id,
+            location_id,
+            exclude_location_closure_slots,
+            exclude_operator_absence_slots,
+            exclude_booked_slots
+        )
+        if exclude_booked_slots:
+            chunk_slots = exclude_held_slots(chunk_slots)
+        for appointment_date_iso in sorted(chunk_slots.keys()):
+            yield appointment_date_iso, chunk_slots[appointment_date_iso]
+
+# suddivide la finestra in intervalli consecutivi di chunk_days giorni che terminano a mezzanotte
+# se i limiti non sono indicati usa le date estreme delle disponibilità attive
+def iter_slot_chunk_windows(datetime_from_filter, datetime_to_filter, service_id = None, operator_id = None, location_id = None, chunk_days = SLOT_STREAM_CHUNK_DAYS):
+    if datetime_from_filter is None or datetime_to_filter is None:
+        first_date, last_date = get_enabled_availabilities_date_bounds(service_id, operator_id, location_id)
+        if first_date is None:
+            current_app.logger.info("No operators availability provided.")
+            return
+        if datetime_from_filter is None:
+            datetime_from_filter = datetime.combine(first_date, time(0, 0))
+        if datetime_to_filter is None:
+            datetime_to_filter = datetime.combine(last_date + timedelta(days=1), time(0, 0))
+
+    chunk_from_datetime = datetime_from_filter
+    while chunk_from_datetime < datetime_to_filter:
+        chunk_to_datetime = min(datetime.combine(chunk_from_datetime.date() + timedelta(days=chunk_days), time(0, 0)), datetime_to_filter)
+        yield chunk_from_datetime, chunk_to_datetime
+        chunk_from_datetime = chunk_to_datetime
+
+# restituisce in ordine cronologico gli slot liberi di una disponibilità come (minuto assoluto di inizio, posizione, data, slot)
+# le date vengono espanse una alla volta solo quando servono; con time_from_minute e time_to_minute vengono scartati gli slot
+# che iniziano prima o finiscono dopo l'orario indicato
+def iter_availability_next_slots(availability, position, slot_exclusions, datetime_from_filter = None, datetime_to_filter = None, time_from_minute = None, time_to_minute = None):
+    for appointment_date, free_slots in iter_availability_free_slots(availability, slot_exclusions, datetime_from_filter, datetime_to_filter):
+        day_minute = appointment_date.toordinal() * MINUTES_PER_DAY
+        for slot in free_slots:
+            if time_from_minute is not None and slot[0] < time_from_minute:
+                continue
+            if time_to_minute is not None and slot[1] > time_to_minute:
+                continue
+            yield day_minute + slot[0], position, appointment_date, slot
+
+# cerca i primi slot liberi a partire da datetime_from_filter con filtri opzionali per operatore, laboratorio e fascia oraria
+# le disponibilità vengono scorse in parallelo con una coda di priorità ordinata per inizio dello slot
+# e la ricerca si interrompe appena sono stati trovati limit slot, senza espandere l'intera finestra
+def find_next_available_slots(
+    limit = 1,
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    time_from = None,
+    time_to = None
+    ):
+
+    # gli slot bloccati da hold temporanei vengono saltati
+    held_slot_keys = get_held_slot_keys()
+
+    # la tabella degli slot materializzati risponde con una query ordinata e limitata se copre la finestra richiesta
+    # vengono letti anche tanti slot quanti sono gli hold attivi, in modo da restare a limit dopo averli esclusi
+    if current_app.config.get('SLOT_ENGINE') == 'table':
+        from app.functions.slot_table import can_use_slot_table, find_next_available_slots_table
+        if can_use_slot_table(datetime_from_filter, datetime_to_filter, True, True, True):
+            next_slots = find_next_available_slots_table(limit + len(held_slot_keys), datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id, time_from, time_to)
+            return [
+                slot for slot in next_slots
+                if (slot.availability_id, slot.appointment_date, slot.appointment_time_start) not in held_slot_keys
+            ][:limit]
+
+    # un orario con i secondi sposta il limite di inizio al minuto successivo
+    time_from_minute = time_to_minutes(time_from) + (1 if time_from.second or time_from.microsecond else 0) if time_from else None
+    time_to_minute = time_to_minutes(time_to) if time_to else None
+
+    # disponibilità, appuntamenti, chiusure e assenze vengono caricati un intervallo di SLOT_STREAM_CHUNK_DAYS giorni alla volta:
+    # gli intervalli sono consecutivi, quindi la ricerca si ferma al primo intervallo che completa limit slot
+    # senza leggere il resto della finestra
+    next_slots = []
+    for chunk_from_datetime, chunk_to_datetime in iter_slot_chunk_windows(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id):
+        availabilities, slot_exclusions = prepare_slot_generation(chunk_from_datetime, chunk_to_datetime, service_id, operator_id, location_id)
+        if not availabilities:
+            continue
+
+        availabilities_next_slots = [
+            iter_availability_next_slots(availability, position, slot_exclusions, chunk_from_datetime, chunk_to_datetime, time_from_minute, time_to_minute)
+            for position, availability in enumerate(availabilities)
+        ]
+        for _, position, appointment_date, slot in merge(*availabilities_next_slots):
+            _, _, _, _, time_start_iso, time_end_iso = slot
+            if held_slot_keys and (availabilities[position].availability_id, appointment_date.isoformat(), time_start_iso) in held_slot_keys:
+                continue
+            next_slots.append(AvailableSlot(get_availability_slot_header(availabilities[position]), appointment_date.isoformat(), time_start_iso, time_end_iso))
+            if len(next_slots) >= limit:
+                break
+        if len(next_slots) >= limit:
+            break
+
+    current_app.logger.debug("Found %d next available slots", len(next_slots))
+    return next_slots
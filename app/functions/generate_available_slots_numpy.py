@@ -0,0 +1,216 @@
+import numpy as np
+from flask import current_app
+from app.functions.generate_available_slots import (
+    MINUTES_PER_DAY,
+    get_enabled_availabilities,
+    get_location_closures,
+    get_operator_absences,
+    get_active_appointments,
+    get_availability_date_range,
+    get_availability_slot_template
+)
+from app.functions.slot_dimensions import get_availability_slot_header
+from app.functions.available_slot import AvailableSlot
+
+# motore vettoriale per la generazione degli slot: costruisce tutti gli slot candidati come array datetime64
+# e applica filtri ed esclusioni come maschere, restituendo la stessa struttura {data: [slot, ...]} del motore python
+
+# costruisce gli array degli slot candidati di tutte le disponibilità
+# gli slot di ciascuna disponibilità sono contigui e ordinati per data e orario
+def build_candidate_slots(availabilities, datetime_from_filter = None, datetime_to_filter = None):
+    positions = []
+    template_positions = []
+    slot_starts = []
+    slot_ends = []
+
+    for position, availability in enumerate(availabilities):
+        first_date, last_date = get_availability_date_range(availability, datetime_from_filter, datetime_to_filter)
+        slot_template = get_availability_slot_template(availability)
+        if first_date > last_date or not slot_template:
+            continue
+
+        weeks = (last_date - first_date).days // 7 + 1
+        day_starts = (np.datetime64(first_date, 'D') + np.arange(weeks) * 7).astype('datetime64[m]')
+        template_starts = np.array([slot[0] for slot in slot_template], dtype='timedelta64[m]')
+        template_ends = np.array([slot[1] for slot in slot_template], dtype='timedelta64[m]')
+
+        slot_starts.append((day_starts[:, None] + template_starts[None, :]).ravel())
+        slot_ends.append((day_starts[:, None] + template_ends[None, :]).ravel())
+        positions.append(np.full(weeks * len(slot_template), position, dtype=np.int64))
+        template_positions.append(np.tile(np.arange(len(slot_template), dtype=np.int64), weeks))
+
+    if not positions:
+        empty_datetimes = np.array([], dtype='datetime64[m]')
+        empty_positions = np.array([], dtype=np.int64)
+        return empty_positions, empty_positions, empty_datetimes, empty_datetimes
+
+    return np.concatenate(positions), np.concatenate(template_positions), np.concatenate(slot_starts), np.concatenate(slot_ends)
+
+# costruisce per ciascuna chiave (laboratorio o operatore) gli inizi ordinati e il massimo progressivo delle fini
+def build_interval_arrays(rows, key_attr):
+    grouped_intervals = {}
+    for row in rows:
+        grouped_intervals.setdefault(getattr(row, key_attr), []).append((row.start_datetime, row.end_datetime))
+
+    interval_arrays = {}
+    for key, intervals in grouped_intervals.items():
+        intervals.sort()
+        starts = np.array([start for start, _ in intervals], dtype='datetime64[us]')
+        ends = np.array([end for _, end in intervals], dtype='datetime64[us]')
+        interval_arrays[key] = (starts, np.maximum.accumulate(ends))
+    return interval_arrays
+
+# marca come da escludere gli slot che si sovrappongono agli intervalli della propria chiave
+def exclude_overlapping_slots(keep, slot_keys, slot_starts, slot_ends, interval_arrays):
+    for key, (interval_starts, interval_max_ends) in interval_arrays.items():
+        selected = np.nonzero(keep & (slot_keys == key))[0]
+        if selected.size == 0:
+            continue
+        # gli intervalli candidati sono quelli che iniziano prima della fine dello slot, basta che uno di essi finisca dopo l'inizio
+        positions = np.searchsorted(interval_starts, slot_ends[selected].astype('datetime64[us]'), side='left')
+        overlapping = (positions > 0) & (interval_max_ends[np.maximum(positions - 1, 0)] > slot_starts[selected])
+        keep[selected[overlapping]] = False
+
+# codifica uno slot come intero univoco a partire da inizio (minuti dal 1970) e minuto di fine nella giornata
+def encode_slots(slot_starts, slot_ends):
+    start_minutes = slot_starts.astype(np.int64)
+    return start_minutes * MINUTES_PER_DAY + slot_ends.astype(np.int64) % MINUTES_PER_DAY
+
+# marca come da escludere gli slot già prenotati confrontando i codici degli appuntamenti attivi per ciascuna disponibilità
+def exclude_booked_slots_mask(keep, positions, slot_starts, slot_ends, availabilities, appointments):
+    availability_positions = {availability.availability_id: position for position, availability in enumerate(availabilities)}
+    booked_codes = {}
+    for booked_slot in appointments:
+        position = availability_positions.get(booked_slot.availability_id)
+        start_time = booked_slot.appointment_time_start
+        end_time = booked_slot.appointment_time_end
+        # gli slot generati sono a minuti interi, un appuntamento con secondi non può coincidere con nessuno slot
+        if position is None or start_time.second or start_time.microsecond or end_time.second or end_time.microsecond:
+            continue
+        start_minute = (np.datetime64(booked_slot.appointment_date, 'D').astype('datetime64[m]').astype(np.int64)
+                        + start_time.hour * 60 + start_time.minute)
+        booked_codes.setdefault(position, []).append(start_minute * MINUTES_PER_DAY + end_time.hour * 60 + end_time.minute)
+
+    for position, codes in booked_codes.items():
+        selected = np.nonzero(keep & (positions == position))[0]
+        if selected.size == 0:
+            continue
+        booked = np.isin(encode_slots(slot_starts[selected], slot_ends[selected]), np.array(codes, dtype=np.int64))
+        keep[selected[booked]] = False
+
+# calcola gli slot candidati e la maschera degli slot liberi dopo filtri ed esclusioni
+def compute_available_slots_mask(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    # Recupera le disponibilità attive con i filtri se applicati
+    availabilities = get_enabled_availabilities(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
+    if not availabilities:
+        return availabilities, None, None, None, None
+
+    positions, template_positions, slot_starts, slot_ends = build_candidate_slots(availabilities, datetime_from_filter, datetime_to_filter)
+    keep = np.ones(positions.size, dtype=bool)
+
+    # escludi gli slot che precedono l'inizio del filtro o superano la fine del filtro
+    if datetime_from_filter:
+        keep &= slot_starts >= np.datetime64(datetime_from_filter, 'us')
+    if datetime_to_filter:
+        keep &= slot_ends <= np.datetime64(datetime_to_filter, 'us')
+
+    # escludi gli slot già prenotati
+    if exclude_booked_slots:
+        availability_ids = [availability.availability_id for availability in availabilities]
+        exclude_booked_slots_mask(keep, positions, slot_starts, slot_ends, availabilities, get_active_appointments(datetime_from_filter, datetime_to_filter, availability_ids))
+
+    # escludi gli slot in cui l'operatore è assente
+    if exclude_operator_absence_slots:
+        operator_keys = {}
+        slot_operators = np.array([operator_keys.setdefault(availability.operator_id, len(operator_keys)) for availability in availabilities], dtype=np.int64)[positions]
+        absences = get_operator_absences(datetime_from_filter, datetime_to_filter, operator_id)
+        absence_arrays = {operator_keys[key]: value for key, value in build_interval_arrays(absences, "operator_id").items() if key in operator_keys}
+        exclude_overlapping_slots(keep, slot_operators, slot_starts, slot_ends, absence_arrays)
+
+    # escludi gli slot in cui il laboratorio è chiuso
+    if exclude_location_closure_slots:
+        location_keys = {}
+        slot_locations = np.array([location_keys.setdefault(availability.location_id, len(location_keys)) for availability in availabilities], dtype=np.int64)[positions]
+        closures = get_location_closures(datetime_from_filter, datetime_to_filter, location_id)
+        closure_arrays = {location_keys[key]: value for key, value in build_interval_arrays(closures, "location_id").items() if key in location_keys}
+        exclude_overlapping_slots(keep, slot_locations, slot_starts, slot_ends, closure_arrays)
+
+    return availabilities, positions, template_positions, slot_starts, keep
+
+def generate_available_slots_numpy(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    availabilities_slots_dategroup = {}
+
+    availabilities, positions, template_positions, slot_starts, keep = compute_available_slots_mask(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+
+    # se non ci sono disponibilità esci
+    if not availabilities:
+        current_app.logger.info("No operators availability provided.")
+        return availabilities_slots_dategroup
+
+    # raggruppa per data gli slot rimasti mantenendo l'ordine per disponibilità e orario all'interno della stessa data
+    selected = np.nonzero(keep)[0]
+    slot_dates = slot_starts[selected].astype('datetime64[D]')
+    order = np.argsort(slot_dates, kind='stable')
+    slot_date_isos = slot_dates[order].astype(str)
+    slot_templates = [get_availability_slot_template(availability) for availability in availabilities]
+    # i campi descrittivi vengono letti dalla cache una sola volta per disponibilità e non per ogni slot
+    slot_headers = [get_availability_slot_header(availability) for availability in availabilities]
+
+    for position, template_position, appointment_date_iso in zip(positions[selected[order]].tolist(), template_positions[selected[order]].tolist(), slot_date_isos.tolist()):
+        _, _, _, _, time_start_iso, time_end_iso = slot_templates[position][template_position]
+        slot = AvailableSlot(slot_headers[position], appointment_date_iso, time_start_iso, time_end_iso)
+        if appointment_date_iso in availabilities_slots_dategroup:
+            availabilities_slots_dategroup[appointment_date_iso].append(slot)
+        else:
+            availabilities_slots_dategroup[appointment_date_iso] = [slot]
+
+    current_app.logger.debug("Generated for %d dates", len(availabilities_slots_dategroup))
+    current_app.logger.debug("Generated %d slots", sum(len(slots) for slots in availabilities_slots_dategroup.values()))
+
+    return availabilities_slots_dategroup
+
+# conta gli slot liberi per data senza costruire i dizionari degli slot
+def count_available_slots_numpy(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    availabilities, _, _, slot_starts, keep = compute_available_slots_mask(
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+    if not availabilities:
+        current_app.logger.info("No operators availability provided.")
+        return {}
+
+    slot_dates, slot_counts = np.unique(slot_starts[keep].astype('datetime64[D]'), return_counts=True)
+    return dict(zip(slot_dates.astype(str).tolist(), slot_counts.tolist()))
@@ -0,0 +1,109 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from flask import current_app
+from app.functions.generate_available_slots import iter_availability_free_slots
+
+# generazione parallela degli slot: le disponibilità vengono suddivise in blocchi ed espanse in processi separati
+# ai processi vengono passate solo tuple semplici (regole ed esclusioni), mai oggetti ORM o sessioni del database
+
+SLOT_GENERATION_CHUNKS_PER_WORKER = 4
+
+# regola di disponibilità ridotta ai soli campi usati dall'espansione degli slot
+AvailabilityRule = namedtuple("AvailabilityRule", [
+    "availability_id",
+    "operator_id",
+    "location_id",
+    "available_weekday",
+    "available_from_date",
+    "available_to_date",
+    "available_from_time",
+    "available_to_time",
+    "slot_duration_minutes",
+    "pause_minutes"
+])
+
+slot_generation_pool = None
+slot_generation_pool_workers = None
+
+# restituisce il pool di processi condiviso, ricreandolo solo se cambia il numero di worker
+# i processi vengono avviati con spawn in modo che non ereditino le connessioni al database del processo principale
+def get_slot_generation_pool(workers):
+    global slot_generation_pool, slot_generation_pool_workers
+    if slot_generation_pool is None or slot_generation_pool_workers != workers:
+        if slot_generation_pool is not None:
+            slot_generation_pool.shutdown(wait=False)
+        slot_generation_pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        slot_generation_pool_workers = workers
+    return slot_generation_pool
+
+# converte una disponibilità ORM nella regola serializzabile
+def to_availability_rule(availability):
+    return AvailabilityRule(
+        availability.availability_id,
+        availability.operator_id,
+        availability.location_id,
+        availability.available_weekday,
+        availability.available_from_date,
+        availability.available_to_date,
+        availability.available_from_time,
+        availability.available_to_time,
+        availability.slot_duration_minutes,
+        availability.pause_minutes
+    )
+
+# riduce le esclusioni a quelle che riguardano le regole del blocco per limitare i dati inviati a ciascun processo
+def partition_slot_exclusions(availability_rules, slot_exclusions, booked_slots_by_availability):
+    from_filter_minute, to_filter_minute, booked_slots_index, operator_absences_index, location_closures_index = slot_exclusions
+
+    if booked_slots_index is not None:
+        booked_slots_index = {
+            booked_slot
+            for availability_rule in availability_rules
+            for booked_slot in booked_slots_by_availability.get(availability_rule.availability_id, ())
+        }
+    if operator_absences_index is not None:
+        operator_ids = {availability_rule.operator_id for availability_rule in availability_rules}
+        operator_absences_index = {key: value for key, value in operator_absences_index.items() if key in operator_ids}
+    if location_closures_index is not None:
+        location_ids = {availability_rule.location_id for availability_rule in availability_rules}
+        location_closures_index = {key: value for key, value in location_closures_index.items() if key in location_ids}
+
+    return from_filter_minute, to_filter_minute, booked_slots_index, operator_absences_index, location_closures_index
+
+# eseguita nei processi del pool: per ciascuna regola restituisce la lista di (data isoformat, [(inizio, fine), ...]) degli slot liberi
+def expand_availability_rules(availability_rules, slot_exclusions, datetime_from_filter = None, datetime_to_filter = None):
+    return [
+        [
+            (appointment_date.isoformat(), [(time_start_iso, time_end_iso) for _, _, _, _, time_start_iso, time_end_iso in free_slots])
+            for appointment_date, free_slots in iter_availability_free_slots(availability_rule, slot_exclusions, datetime_from_filter, datetime_to_filter)
+        ]
+        for availability_rule in availability_rules
+    ]
+
+# espande le disponibilità nel pool di processi e restituisce i risultati nello stesso ordine delle disponibilità ricevute
+# i blocchi sono contigui e i risultati vengono letti nell'ordine di invio, quindi l'unione per data è deterministica
+def expand_availabilities_parallel(availabilities, slot_exclusions, datetime_from_filter = None, datetime_to_filter = None, workers = 2):
+    availability_rules = [to_availability_rule(availability) for availability in availabilities]
+
+    booked_slots_by_availability = {}
+    for booked_slot in slot_exclusions[2] or ():
+        booked_slots_by_availability.setdefault(booked_slot[0], []).append(booked_slot)
+
+    chunk_size = -(-len(availability_rules) // (workers * SLOT_GENERATION_CHUNKS_PER_WORKER))
+    chunks = [availability_rules[start:start + chunk_size] for start in range(0, len(availability_rules), chunk_size)]
+    current_app.logger.debug("Expanding %d availabilities in %d chunks with %d workers", len(availability_rules), len(chunks), workers)
+
+    pool = get_slot_generation_pool(workers)
+    futures = [
+        pool.submit(
+            expand_availability_rules,
+            chunk,
+            partition_slot_exclusions(chunk, slot_exclusions, booked_slots_by_availability),
+            datetime_from_filter,
+            datetime_to_filter
+        )
+        for chunk in chunks
+    ]
+    for future in futures:
+        yield from future.result()
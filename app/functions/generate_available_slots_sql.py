@@ -0,0 +1,186 @@
+from flask import current_app
+from sqlalchemy import text
+from app.extensions import db
+from app.functions.generate_available_slots import get_enabled_availabilities, get_availability_slot_template
+from app.functions.slot_dimensions import get_availability_slot_header
+from app.functions.available_slot import AvailableSlot
+
+# motore SQL per la generazione degli slot (solo PostgreSQL): le regole di disponibilità vengono espanse nel database
+# con generate_series su date e orari e gli slot prenotati o in sovrapposizione a chiusure e assenze vengono scartati
+# nella stessa query con NOT EXISTS, quindi a Python arrivano solo gli slot liberi
+# gli slot sono identificati dalla posizione della disponibilità e dalla posizione nel modello giornaliero, in modo che
+# orari in isoformat e intestazioni vengano presi dai modelli già usati dal motore python e il risultato coincida
+
+# la data di inizio viene spostata sul giorno della settimana della regola (available_weekday usa lunedì = 0 come Python)
+# e gli orari della regola vengono troncati al minuto come in time_to_minutes
+SLOT_EXPANSION_SQL = """
+    WITH candidate AS (
+        SELECT
+            candidate.position,
+            availability.availability_id,
+            availability.location_id,
+            availability.operator_id,
+            availability.slot_duration_minutes,
+            availability.pause_minutes,
+            CAST(EXTRACT(HOUR FROM availability.available_from_time) * 60 + EXTRACT(MINUTE FROM availability.available_from_time) AS integer) AS from_minute,
+            CAST(EXTRACT(HOUR FROM availability.available_to_time) * 60 + EXTRACT(MINUTE FROM availability.available_to_time) AS integer) AS to_minute,
+            availability.available_weekday,
+            GREATEST(availability.available_from_date, CAST(:from_date AS date)) AS first_date,
+            LEAST(availability.available_to_date, CAST(:to_date AS date)) AS last_date
+        FROM unnest(CAST(:availability_ids AS uuid[])) WITH ORDINALITY AS candidate(availability_id, position)
+        JOIN availability ON availability.availability_id = candidate.availability_id
+    ),
+    expanded_slot AS (
+        SELECT
+            candidate.position,
+            candidate.availability_id,
+            candidate.location_id,
+            candidate.operator_id,
+            template.template_position,
+            CAST(slot_day.slot_datetime AS date) AS slot_date,
+            slot_day.slot_datetime + make_interval(mins => template.start_minute) AS start_datetime,
+            slot_day.slot_datetime + make_interval(mins => template.start_minute + candidate.slot_duration_minutes) AS end_datetime
+        FROM candidate
+        CROSS JOIN LATERAL generate_series(
+            CAST(candidate.first_date + (candidate.available_weekday - CAST(EXTRACT(ISODOW FROM candidate.first_date) AS integer) + 8) % 7 AS timestamp),
+            CAST(candidate.last_date AS timestamp),
+            interval '7 days'
+        ) AS slot_day(slot_datetime)
+        CROSS JOIN LATERAL generate_series(
+            candidate.from_minute,
+            candidate.to_minute - candidate.slot_duration_minutes,
+            candidate.slot_duration_minutes + candidate.pause_minutes
+        ) WITH ORDINALITY AS template(start_minute, template_position)
+    )
+"""
+
+SLOT_FROM_FILTER_SQL = "expanded_slot.start_datetime >= CAST(:from_datetime AS timestamp)"
+SLOT_TO_FILTER_SQL = "expanded_slot.end_datetime <= CAST(:to_datetime AS timestamp)"
+# gli appuntamenti vengono limitati anche alle disponibilità candidate: il planner non conosce il numero degli slot espansi
+# e senza questa condizione leggerebbe l'intera tabella invece dell'indice parziale ix_active_appointments_availability_date
+SLOT_BOOKED_EXCLUSION_SQL = """NOT EXISTS (
+        SELECT 1 FROM appointment
+        WHERE appointment.availability_id = ANY(CAST(:availability_ids AS uuid[]))
+        AND appointment.availability_id = expanded_slot.availability_id
+        AND appointment.appointment_date = expanded_slot.slot_date
+        AND appointment.appointment_time_start = CAST(expanded_slot.start_datetime AS time)
+        AND appointment.appointment_time_end = CAST(expanded_slot.end_datetime AS time)
+        AND appointment.rejected = false
+    )"""
+SLOT_OPERATOR_ABSENCE_EXCLUSION_SQL = """NOT EXISTS (
+        SELECT 1 FROM operator_absence
+        WHERE operator_absence.operator_id = expanded_slot.operator_id
+        AND operator_absence.start_datetime < expanded_slot.end_datetime
+        AND operator_absence.end_datetime > expanded_slot.start_datetime
+    )"""
+SLOT_LOCATION_CLOSURE_EXCLUSION_SQL = """NOT EXISTS (
+        SELECT 1 FROM location_closure
+        WHERE location_closure.location_id = expanded_slot.location_id
+        AND location_closure.start_datetime < expanded_slot.end_datetime
+        AND location_closure.end_datetime > expanded_slot.start_datetime
+    )"""
+
+# verifica se il database corrente può eseguire il motore SQL
+def can_use_slot_sql():
+    return db.engine.dialect.name == "postgresql"
+
+# compone la query di espansione con i soli filtri ed esclusioni attivi e restituisce query e parametri
+def build_slot_expansion_query(
+    select_sql,
+    availabilities,
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    conditions = []
+    if datetime_from_filter:
+        conditions.append(SLOT_FROM_FILTER_SQL)
+    if datetime_to_filter:
+        conditions.append(SLOT_TO_FILTER_SQL)
+    if exclude_booked_slots:
+        conditions.append(SLOT_BOOKED_EXCLUSION_SQL)
+    if exclude_operator_absence_slots:
+        conditions.append(SLOT_OPERATOR_ABSENCE_EXCLUSION_SQL)
+    if exclude_location_closure_slots:
+        conditions.append(SLOT_LOCATION_CLOSURE_EXCLUSION_SQL)
+
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = text(f"{SLOT_EXPANSION_SQL} {select_sql.format(where=where_sql)}")
+    params = {
+        "availability_ids": [str(availability.availability_id) for availability in availabilities],
+        "from_date": datetime_from_filter.date() if datetime_from_filter else None,
+        "to_date": datetime_to_filter.date() if datetime_to_filter else None,
+        "from_datetime": datetime_from_filter,
+        "to_datetime": datetime_to_filter
+    }
+    return query, params
+
+def generate_available_slots_sql(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    availabilities_slots_dategroup = {}
+
+    # Recupera le disponibilità attive con i filtri se applicati
+    availabilities = get_enabled_availabilities(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
+    if not availabilities:
+        current_app.logger.info("No operators availability provided.")
+        return availabilities_slots_dategroup
+
+    # gli slot vengono restituiti per data e, nella stessa data, nell'ordine delle disponibilità e degli orari come nel motore python
+    query, params = build_slot_expansion_query(
+        "SELECT expanded_slot.position, expanded_slot.template_position, expanded_slot.slot_date FROM expanded_slot {where} ORDER BY expanded_slot.slot_date, expanded_slot.position, expanded_slot.template_position",
+        availabilities, datetime_from_filter, datetime_to_filter,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+    slot_templates = [get_availability_slot_template(availability) for availability in availabilities]
+    slot_headers = [get_availability_slot_header(availability) for availability in availabilities]
+
+    # le posizioni restituite da WITH ORDINALITY partono da 1
+    for position, template_position, appointment_date in db.session.execute(query, params):
+        _, _, _, _, time_start_iso, time_end_iso = slot_templates[position - 1][template_position - 1]
+        appointment_date_iso = appointment_date.isoformat()
+        slot = AvailableSlot(slot_headers[position - 1], appointment_date_iso, time_start_iso, time_end_iso)
+        if appointment_date_iso in availabilities_slots_dategroup:
+            availabilities_slots_dategroup[appointment_date_iso].append(slot)
+        else:
+            availabilities_slots_dategroup[appointment_date_iso] = [slot]
+
+    current_app.logger.debug("Generated for %d dates", len(availabilities_slots_dategroup))
+    current_app.logger.debug("Generated %d slots", sum(len(slots) for slots in availabilities_slots_dategroup.values()))
+
+    return availabilities_slots_dategroup
+
+# conta gli slot liberi per data direttamente nel database
+def count_available_slots_sql(
+    datetime_from_filter = None,
+    datetime_to_filter = None,
+    service_id = None,
+    operator_id = None,
+    location_id = None,
+    exclude_location_closure_slots = True,
+    exclude_operator_absence_slots = True,
+    exclude_booked_slots = True
+    ):
+
+    availabilities = get_enabled_availabilities(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
+    if not availabilities:
+        current_app.logger.info("No operators availability provided.")
+        return {}
+
+    query, params = build_slot_expansion_query(
+        "SELECT expanded_slot.slot_date, count(*) FROM expanded_slot {where} GROUP BY expanded_slot.slot_date ORDER BY expanded_slot.slot_date",
+        availabilities, datetime_from_filter, datetime_to_filter,
+        exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots
+    )
+    return {appointment_date.isoformat(): slots_count for appointment_date, slots_count in db.session.execute(query, params)}
@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from app.extensions import db, mail
+from app.models.model import MailOutbox
+
+# outbox transazionale delle mail: le mail vengono salvate nella tabella mail_outbox nella stessa transazione della scrittura
+# che le genera (prenotazione, cancellazione, registrazione...) e vengono inviate in background da un pool di thread,
+# così le richieste non attendono il server SMTP e una mail non viene persa se l'invio fallisce o la scrittura viene annullata
+
+MAIL_STATUS_PENDING = "pending"
+MAIL_STATUS_SENT = "sent"
+MAIL_STATUS_FAILED = "failed"
+# mail con il link di validazione dell'account o di reimpostazione della password: il token non viene salvato nella tabella
+MAIL_KIND_ACCESS_TOKEN = "access_token"
+
+# risveglia il dispatcher appena viene confermata una transazione con nuove mail
+mail_outbox_wakeup = threading.Event()
+mail_outbox_start_lock = threading.Lock()
+
+# aggiunge una mail alla sessione corrente senza commit: viene salvata con il commit del chiamante
+def queue_mail(recipient, subject, body, account_id = None, kind = None):
+    outbox_mail = MailOutbox(account_id=account_id, kind=kind, recipient=recipient, subject=subject, body=body)
+    db.session.add(outbox_mail)
+    db.session.info["mail_outbox_queued"] = True
+    return outbox_mail
+
+@event.listens_for(Session, "after_commit")
+def wake_mail_outbox_on_commit(session):
+    if session.info.pop("mail_outbox_queued", False):
+        mail_outbox_wakeup.set()
+
+@event.listens_for(Session, "after_rollback")
+def discard_mail_outbox_on_rollback(session):
+    session.info.pop("mail_outbox_queued", None)
+
+# prende in carico fino a limit mail da inviare: con SKIP LOCKED più processi possono leggere la tabella senza prendere le stesse righe
+# la presa in carico incrementa i tentativi e sposta next_attempt_at in avanti di MAIL_OUTBOX_LEASE_SECONDS:
+# se il processo termina durante l'invio la mail torna disponibile alla scadenza
+def claim_pending_mails(limit):
+    now = datetime.now()
+    outbox_mails = db.session.execute(
+        select(MailOutbox.mail_id, MailOutbox.account_id, MailOutbox.kind, MailOutbox.recipient, MailOutbox.subject, MailOutbox.body, MailOutbox.attempts)
+        .where(MailOutbox.status == MAIL_STATUS_PENDING, MailOutbox.next_attempt_at <= now)
+        .order_by(MailOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if outbox_mails:
+        db.session.execute(
+            update(MailOutbox)
+            .where(MailOutbox.mail_id.in_([outbox_mail.mail_id for outbox_mail in outbox_mails]))
+            .values(attempts=MailOutbox.attempts + 1, next_attempt_at=now + timedelta(seconds=current_app.config["MAIL_OUTBOX_LEASE_SECONDS"]))
+        )
+    db.session.commit()
+    return outbox_mails
+
+# testo della mail da inviare: per le mail con token il link viene generato adesso e non viene mai salvato
+def render_outbox_mail_body(outbox_mail):
+    if outbox_mail.kind == MAIL_KIND_ACCESS_TOKEN:
+        from app.functions.send_mail import get_access_token_url
+        return f"{outbox_mail.body}: {get_access_token_url(outbox_mail.account_id)}"
+    return outbox_mail.body
+
+# invia una mail presa in carico e ne aggiorna lo stato: dopo un errore la mail viene riprogrammata con attesa esponenziale
+# fino a MAIL_OUTBOX_MAX_ATTEMPTS tentativi, poi viene marcata come failed
+# le mail inviate o fallite restano nella tabella solo come stato: oggetto e testo vengono svuotati
+def send_outbox_mail(outbox_mail):
+    attempts = outbox_mail.attempts + 1
+    try:
+        message = Message(outbox_mail.subject, recipients=[outbox_mail.recipient])
+        message.body = render_outbox_mail_body(outbox_mail)
+        mail.send(message)
+        values = {"status": MAIL_STATUS_SENT, "sent_at": datetime.now(), "last_error": None, "subject": "", "body": ""}
+    except Exception as e:
+        current_app.logger.error("Error sending mail %s (attempt %d): %s", outbox_mail.mail_id, attempts, e)
+        if attempts >= current_app.config["MAIL_OUTBOX_MAX_ATTEMPTS"]:
+            values = {"status": MAIL_STATUS_FAILED, "last_error": str(e)[:512], "subject": "", "body": ""}
+        else:
+            retry_seconds = current_app.config["MAIL_OUTBOX_RETRY_SECONDS"] * 2 ** (attempts - 1)
+            values = {"next_attempt_at": datetime.now() + timedelta(seconds=retry_seconds), "last_error": str(e)[:512]}
+
+    db.session.execute(update(MailOutbox).where(MailOutbox.mail_id == outbox_mail.mail_id).values(**values))
+    db.session.commit()
+    return values.get("status") == MAIL_STATUS_SENT
+
+# invia tutte le mail scadute a blocchi di MAIL_OUTBOX_BATCH_SIZE e restituisce il numero di mail inviate
+# con un executor gli invii di un blocco sono eseguiti in parallelo, ognuno nel proprio contesto applicativo e sessione
+def send_pending_mails(executor = None):
+    app = current_app._get_current_object()
+    batch_size = current_app.config["MAIL_OUTBOX_BATCH_SIZE"]
+
+    def send_in_app_context(outbox_mail):
+        with app.app_context():
+            return send_outbox_mail(outbox_mail)
+
+    sent_mails = 0
+    while True:
+        outbox_mails = claim_pending_mails(batch_size)
+        if executor is None:
+            sent_mails += sum(send_outbox_mail(outbox_mail) for outbox_mail in outbox_mails)
+        else:
+            sent_mails += sum(executor.map(send_in_app_context, outbox_mails))
+        if len(outbox_mails) < batch_size:
+            return sent_mails
+
+# ciclo del dispatcher: controlla la tabella ogni MAIL_OUTBOX_POLL_SECONDS o appena viene confermata una nuova mail
+def run_mail_outbox_dispatcher(app, executor):
+    while True:
+        mail_outbox_wakeup.wait(app.config["MAIL_OUTBOX_POLL_SECONDS"])
+        mail_outbox_wakeup.clear()
+        try:
+            with app.app_context():
+                sent_mails = send_pending_mails(executor)
+                if sent_mails:
+                    app.logger.info("Sent %d mails from outbox", sent_mails)
+        except Exception as e:
+            app.logger.error("Error processing mail outbox: %s", e)
+
+# avvia il dispatcher e il pool di invio in thread daemon (uno per applicazione e processo)
+# può essere chiamata da più richieste in parallelo: il dispatcher viene avviato una sola volta
+def start_mail_outbox_dispatcher(app):
+    workers = app.config.get("MAIL_OUTBOX_WORKERS", 0)
+    if workers <= 0 or "mail_outbox" in app.extensions:
+        return None
+    with mail_outbox_start_lock:
+        if "mail_outbox" in app.extensions:
+            return None
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mail-outbox")
+        dispatcher = threading.Thread(target=run_mail_outbox_dispatcher, args=(app, executor), name="mail-outbox-dispatcher", daemon=True)
+        app.extensions["mail_outbox"] = dispatcher
+        dispatcher.start()
+    return dispatcher
@@ -0,0 +1,35 @@
+from sqlalchemy import inspect
+
+# utilità per leggere dalla history di SQLAlchemy le modifiche di un oggetto durante il flush
+
+# colonne della regola di disponibilità che determinano gli slot generati
+AVAILABILITY_SLOT_FIELDS = (
+    "service_id", "location_id", "operator_id", "available_from_date", "available_to_date", "available_from_time",
+    "available_to_time", "available_weekday", "slot_duration_minutes", "pause_minutes", "enabled"
+)
+APPOINTMENT_SLOT_FIELDS = ("availability_id", "appointment_date", "appointment_time_start", "appointment_time_end", "rejected")
+
+# restituisce i valori correnti e, se modificati nel flush, quelli precedenti degli attributi indicati
+def get_attribute_versions(target, attribute_names):
+    state = inspect(target)
+    current_values = tuple(getattr(target, attribute_name) for attribute_name in attribute_names)
+    previous_values = []
+    for attribute_name in attribute_names:
+        history = state.attrs[attribute_name].history
+        previous_values.append(history.deleted[0] if history.deleted else getattr(target, attribute_name))
+    previous_values = tuple(previous_values)
+    return [current_values] if previous_values == current_values else [current_values, previous_values]
+
+# verifica se nel flush è cambiato almeno uno degli attributi indicati
+def has_attribute_changes(target, attribute_names):
+    state = inspect(target)
+    return any(state.attrs[attribute_name].history.has_changes() for attribute_name in attribute_names)
+
+# colonne di esami, laboratori e operatori mostrate negli slot
+SERVICE_SLOT_FIELDS = ("name",)
+LOCATION_SLOT_FIELDS = ("name", "address", "tel_number")
+OPERATOR_SLOT_FIELDS = ("title", "first_name", "last_name")
+
+# restituisce tutti i valori (correnti e precedenti) assunti da un attributo nel flush
+def get_attribute_values(target, attribute_name):
+    return {values[0] for values in get_attribute_versions(target, (attribute_name,))}
@@ -0,0 +1,13 @@
+from sqlalchemy.schema import CreateIndex
+from app.extensions import db
+
+# db.create_all crea solo le tabelle mancanti: gli indici aggiunti ai modelli di tabelle già esistenti
+# (appuntamenti, disponibilità, chiusure e assenze) non verrebbero mai creati sui database esistenti
+# per ogni indice dei modelli viene eseguito CREATE INDEX IF NOT EXISTS, gli indici già presenti non vengono toccati
+# sulle tabelle grandi la prima creazione blocca le scritture sulla tabella fino al termine
+
+def create_missing_indexes():
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                connection.execute(CreateIndex(index, if_not_exists=True))
@@ -1,22 +1,22 @@
 from flask import current_app
-from flask_mail import Message
 from flask_jwt_extended import create_access_token
-from app.extensions import mail
+from app.functions.mail_outbox import queue_mail, MAIL_KIND_ACCESS_TOKEN
 from datetime import timedelta
 
-# le mail vengono inviate con il metodo send_mail e localizzato in italiano
+# le mail sono localizzate in italiano e vengono accodate nella tabella mail_outbox con la sessione corrente:
+# vanno chiamate prima del commit della scrittura a cui si riferiscono e vengono inviate in background (vedi mail_outbox.py)
+
+# link con il token di accesso dell'account, generato al momento dell'invio della mail
+def get_access_token_url(account_id):
+    access_token = create_access_token(identity=account_id)
+    return f"{current_app.config['FRONTEND_URL']}/validate-account?token={access_token}"
 
 def send_access_token(email, account):
-    access_token = create_access_token(identity=account.account_id)
-    reset_url = f"{current_app.config['FRONTEND_URL']}/validate-account?token={access_token}"
 
     subject = "Prenotazioni Centro Medico: Validazione Password"
     body = "Usa il seguente link per reimpostare la tua password"
 
-    msg = Message(subject,
-                recipients=[email])
-    msg.body = f"{body}: {reset_url}"
-    mail.send(msg)
+    queue_mail(email, subject, body, account.account_id, MAIL_KIND_ACCESS_TOKEN)
 
 def send_appointment_confirmation(email, service_name, patient_name, appointment):
 
@@ -26,10 +26,7 @@ def send_appointment_confirmation(email, service_name, patient_name, appointment
 
     subject = f"Conferma prenotazione {service_name} per {patient_name}"
     body = f"La prenotazione per {patient_name} del {appointment_date} dalle {appointment_time_start} alle {appointment_time_end} è stata confermata"
-    msg = Message(subject,
-                recipients=[email])
-    msg.body = f"{body}"
-    mail.send(msg)
+    queue_mail(email, subject, f"{body}", appointment.account_id)
 
 
 def send_appointment_cancellation(email, service_name, patient_name, appointment):
@@ -40,7 +37,16 @@ def send_appointment_cancellation(email, service_name, patient_name, appointment
 
     subject = f"Conferma cancellazione {service_name} per {patient_name}"
     body = f"La prenotazione per {patient_name} del {appointment_date} dalle {appointment_time_start} alle {appointment_time_end} è stata cancellata"
-    msg = Message(subject,
-                recipients=[email])
-    msg.body = f"{body}"
-    mail.send(msg)
+    queue_mail(email, subject, f"{body}", appointment.account_id)
+
+# riepilogo unico delle prenotazioni di un lotto: booked_slots contiene tuple (esame, data, inizio, fine)
+def send_appointments_summary(email, patient_name, booked_slots, account_id):
+
+    appointment_lines = [
+        f"- {service_name} del {appointment_date.strftime('%d/%m/%Y')} dalle {appointment_time_start.strftime('%H:%M')} alle {appointment_time_end.strftime('%H:%M')}"
+        for service_name, appointment_date, appointment_time_start, appointment_time_end in booked_slots
+    ]
+
+    subject = f"Conferma {len(booked_slots)} prenotazioni per {patient_name}"
+    body = f"Le seguenti prenotazioni per {patient_name} sono state confermate"
+    queue_mail(email, subject, f"{body}:\n" + "\n".join(appointment_lines), account_id)
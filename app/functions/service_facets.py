@@ -0,0 +1,97 @@
+from threading import Lock
+from sqlalchemy import select
+from app.extensions import db
+from app.models.model import Availability, Location, Operator
+from app.functions.model_changes import get_attribute_values, has_attribute_changes
+from app.functions.slot_cache import to_uuid
+from app.functions.cache_versions import CacheVersions, ALL_CACHE_KEYS
+
+# cache per processo dei filtri della pagina degli slot (operatori e laboratori di ogni esame):
+# per ogni esame vengono salvati gli operatori, i laboratori, i laboratori di ogni operatore e gli operatori di ogni laboratorio,
+# letti con una sola query alla prima richiesta dell'esame e salvati con la versione dell'esame (vedi cache_versions).
+# I valori sono condivisi tra le richieste e non vanno modificati
+
+# colonne delle disponibilità che determinano i filtri
+AVAILABILITY_FACET_FIELDS = ("service_id", "location_id", "operator_id")
+# colonne di operatori e laboratori mostrate nei filtri
+OPERATOR_FACET_FIELDS = ("title", "first_name", "last_name")
+LOCATION_FACET_FIELDS = ("name",)
+
+service_facets = {}
+service_facets_lock = Lock()
+
+# legge le combinazioni operatore/laboratorio delle disponibilità dell'esame e costruisce i filtri ordinati per nome
+# restituisce (operatori, laboratori, {operator_id: laboratori}, {location_id: operatori}) nel formato di to_dict
+def build_service_facets(service_id):
+    facet_rows = db.session.execute(
+        select(Availability.operator_id, Operator.title, Operator.first_name, Operator.last_name, Availability.location_id, Location.name)
+        .join(Operator, Availability.operator_id == Operator.operator_id)
+        .join(Location, Availability.location_id == Location.location_id)
+        .where(Availability.service_id == service_id)
+        .distinct()
+    ).all()
+
+    operators = {}
+    locations = {}
+    operator_locations = {}
+    location_operators = {}
+    for operator_id, title, first_name, last_name, location_id, location_name in facet_rows:
+        operator = operators.setdefault(operator_id, {"operator_id": operator_id, "name": f"{title} {first_name} {last_name}"})
+        location = locations.setdefault(location_id, {"location_id": location_id, "name": location_name})
+        operator_locations.setdefault(operator_id, []).append(location)
+        location_operators.setdefault(location_id, []).append(operator)
+
+    def sort_by_name(facets):
+        return sorted(facets, key=lambda facet: facet["name"])
+
+    return (
+        sort_by_name(operators.values()),
+        sort_by_name(locations.values()),
+        {operator_id: sort_by_name(facets) for operator_id, facets in operator_locations.items()},
+        {location_id: sort_by_name(facets) for location_id, facets in location_operators.items()}
+    )
+
+# restituisce (operatori, laboratori) dell'esame: se è indicato un laboratorio solo gli operatori che vi lavorano
+# e se è indicato un operatore solo i laboratori in cui lavora
+def get_service_facets(service_id, operator_id = None, location_id = None):
+    # la versione viene letta prima della query: una voce costruita mentre viene confermata una scrittura resta obsoleta
+    version = service_facets_versions.get_version(service_id)
+    entry = service_facets.get(service_id)
+    if entry is None or entry[0] != version:
+        entry = (version, build_service_facets(service_id))
+        # i filtri letti con scritture non confermate nella sessione non vengono salvati
+        session = db.session
+        if not (session.new or session.dirty or session.deleted or service_facets_versions.has_pending_changes(session)):
+            with service_facets_lock:
+                service_facets[service_id] = entry
+
+    operators, locations, operator_locations, location_operators = entry[1]
+    return (
+        location_operators.get(location_id, []) if location_id else operators,
+        operator_locations.get(operator_id, []) if operator_id else locations
+    )
+
+# svuota la cache (necessario dopo scritture massive che non passano dalla sessione)
+def clear_service_facets():
+    service_facets_versions.clear()
+    with service_facets_lock:
+        service_facets.clear()
+
+# restituisce durante il flush gli esami delle disponibilità modificate, le modifiche ai nomi di operatori e laboratori
+# rendono obsoleti i filtri di tutti gli esami
+def collect_service_facets_changes(session):
+    service_ids = set()
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        is_changed = target not in session.dirty
+        if isinstance(target, Availability):
+            if is_changed or has_attribute_changes(target, AVAILABILITY_FACET_FIELDS):
+                service_ids.update(map(to_uuid, get_attribute_values(target, "service_id")))
+        elif isinstance(target, Operator):
+            if not is_changed and has_attribute_changes(target, OPERATOR_FACET_FIELDS):
+                service_ids.add(ALL_CACHE_KEYS)
+        elif isinstance(target, Location):
+            if not is_changed and has_attribute_changes(target, LOCATION_FACET_FIELDS):
+                service_ids.add(ALL_CACHE_KEYS)
+    return service_ids
+
+service_facets_versions = CacheVersions("service_facets_changes", collect_service_facets_changes)
@@ -0,0 +1,184 @@
+import heapq
+import time
+import unicodedata
+from bisect import bisect_left
+from array import array
+from threading import Lock
+from flask import current_app
+from sqlalchemy import select
+from app.extensions import db
+from app.models.model import Service
+from app.functions.model_changes import has_attribute_changes
+from app.functions.slot_cache import to_uuid
+from app.functions.cache_versions import CacheVersions
+
+# indice per processo per la ricerca per sottostringa degli esami (typeahead del catalogo), senza query al database:
+# nomi e descrizioni vengono normalizzati (minuscole, senza accenti) e gli esami vengono ordinati per nome normalizzato,
+# in modo che la posizione di un esame ne dia anche l'ordine a parità di qualità della corrispondenza.
+# Ogni livello di qualità ha la sua struttura e viene calcolato solo se i livelli precedenti non bastano a riempire il risultato:
+# - inizio del nome: ricerca binaria sui nomi ordinati
+# - inizio di una parola: ricerca binaria sui suffissi dei nomi che iniziano con una parola
+# - parte del nome o della descrizione: elenchi crescenti delle posizioni degli esami che contengono ogni trigramma,
+#   scorsi a partire dal più corto fino a trovare abbastanza esami
+# l'indice viene ricostruito alla prima ricerca dopo un commit che modifica gli esami o dopo SERVICE_SEARCH_INDEX_TTL_SECONDS
+# (le scritture confermate da altri processi non incrementano la versione locale)
+
+SERVICE_SEARCH_NGRAM_SIZE = 3
+# colonne degli esami indicizzate
+SERVICE_SEARCH_FIELDS = ("name", "description")
+
+# qualità della corrispondenza, in ordine di rilevanza
+MATCH_NAME_EXACT = 0
+MATCH_NAME_PREFIX = 1
+MATCH_NAME_WORD_PREFIX = 2
+MATCH_NAME_SUBSTRING = 3
+MATCH_DESCRIPTION_SUBSTRING = 4
+
+# indice corrente, None se da costruire
+service_search_index = {"index": None}
+service_search_lock = Lock()
+
+# minuscole e senza accenti: "Ecografia Addome" e "ecografià" producono gli stessi trigrammi
+def normalize_search_text(value):
+    value = unicodedata.normalize("NFKD", value or "").casefold()
+    return "".join(character for character in value if not unicodedata.combining(character))
+
+def get_ngrams(value):
+    return {value[position:position + SERVICE_SEARCH_NGRAM_SIZE] for position in range(len(value) - SERVICE_SEARCH_NGRAM_SIZE + 1)}
+
+# aggiunge la posizione dell'esame agli elenchi dei trigrammi del testo (le posizioni arrivano in ordine crescente)
+def add_ngram_postings(ngrams, value, position):
+    for ngram in get_ngrams(value):
+        postings = ngrams.get(ngram)
+        if postings is None:
+            postings = ngrams[ngram] = array("i")
+        postings.append(position)
+
+# legge gli esami con una sola query e costruisce le strutture dei livelli di qualità
+def build_service_search_index(version):
+    services = [
+        (normalize_search_text(service.name), normalize_search_text(service.description), service)
+        for service in db.session.execute(select(Service.service_id, Service.name, Service.description)).all()
+    ]
+    services.sort(key=lambda service: (service[0], service[2].name))
+
+    name_ngrams = {}
+    description_ngrams = {}
+    word_suffixes = []
+    for position, (name, description, _) in enumerate(services):
+        add_ngram_postings(name_ngrams, name, position)
+        add_ngram_postings(description_ngrams, description, position)
+        # suffissi del nome che seguono un separatore: una ricerca che inizia una parola ne è il prefisso
+        word_suffixes.extend((name[start:], position) for start in range(1, len(name)) if not name[start - 1].isalnum())
+    word_suffixes.sort()
+
+    current_app.logger.debug("Service search index built for %d services", len(services))
+    return {
+        "version": version,
+        "expires_at": time.monotonic() + current_app.config.get("SERVICE_SEARCH_INDEX_TTL_SECONDS", 300),
+        "services": [(service.service_id, service.name, service.description) for _, _, service in services],
+        "names": [name for name, _, _ in services],
+        "descriptions": [description for _, description, _ in services],
+        "name_ngrams": name_ngrams,
+        "description_ngrams": description_ngrams,
+        "word_suffixes": [word_suffix for word_suffix, _ in word_suffixes],
+        "word_suffix_positions": array("i", (position for _, position in word_suffixes))
+    }
+
+def is_service_search_index_valid(index, version):
+    return index is not None and index["version"] == version and index["expires_at"] > time.monotonic()
+
+# restituisce l'indice corrente ricostruendolo se la versione del catalogo è cambiata o se è scaduto
+def get_service_search_index():
+    version = service_search_versions.get_version()
+    index = service_search_index["index"]
+    if is_service_search_index_valid(index, version):
+        return index
+    with service_search_lock:
+        index = service_search_index["index"]
+        if not is_service_search_index_valid(index, version):
+            index = build_service_search_index(version)
+            service_search_index["index"] = index
+    return index
+
+# qualità della corrispondenza del testo cercato con nome e descrizione dell'esame, None se non corrisponde
+def get_match_quality(search, name, description):
+    if name == search:
+        return MATCH_NAME_EXACT
+    if name.startswith(search):
+        return MATCH_NAME_PREFIX
+    position = name.find(search)
+    if position < 0:
+        return MATCH_DESCRIPTION_SUBSTRING if search in description else None
+    while position > 0:
+        if not name[position - 1].isalnum():
+            return MATCH_NAME_WORD_PREFIX
+        position = name.find(search, position + 1)
+    return MATCH_NAME_SUBSTRING
+
+# intervallo [inizio, fine) degli elementi di una lista ordinata che iniziano con il testo cercato
+def get_prefix_range(sorted_values, search):
+    return bisect_left(sorted_values, search), bisect_left(sorted_values, search + "\U0010ffff")
+
+# posizioni crescenti degli esami che possono contenere il testo: l'elenco di trigrammi più corto
+# oppure tutti gli esami per i testi più corti di un trigramma
+def get_ngram_candidates(ngrams, search, services_count):
+    search_ngrams = get_ngrams(search)
+    if not search_ngrams:
+        return range(services_count)
+    if not all(ngram in ngrams for ngram in search_ngrams):
+        return ()
+    return min((ngrams[ngram] for ngram in search_ngrams), key=len)
+
+# cerca gli esami che contengono il testo nel nome o nella descrizione e li restituisce ordinati per qualità
+# della corrispondenza e poi per nome: [(service_id, nome, descrizione), ...]
+def search_services(search, limit = 10):
+    search = normalize_search_text(search).strip()
+    if not search or limit <= 0:
+        return []
+
+    index = get_service_search_index()
+    names = index["names"]
+    descriptions = index["descriptions"]
+
+    # nome uguale e inizio del nome: i nomi uguali precedono gli altri nell'ordinamento
+    prefix_start, prefix_end = get_prefix_range(names, search)
+    positions = list(range(prefix_start, min(prefix_end, prefix_start + limit)))
+
+    # inizio di una parola del nome, escludendo i nomi che iniziano con il testo
+    if len(positions) < limit:
+        suffix_start, suffix_end = get_prefix_range(index["word_suffixes"], search)
+        word_prefix_positions = {
+            position for position in index["word_suffix_positions"][suffix_start:suffix_end]
+            if not prefix_start <= position < prefix_end
+        }
+        positions.extend(heapq.nsmallest(limit - len(positions), word_prefix_positions))
+
+    # parte del nome e poi della descrizione: gli elenchi sono crescenti, la scansione si ferma al riempimento del risultato
+    for match_quality, ngrams in ((MATCH_NAME_SUBSTRING, index["name_ngrams"]), (MATCH_DESCRIPTION_SUBSTRING, index["description_ngrams"])):
+        if len(positions) >= limit:
+            break
+        for position in get_ngram_candidates(ngrams, search, len(names)):
+            if get_match_quality(search, names[position], descriptions[position]) == match_quality:
+                positions.append(position)
+                if len(positions) >= limit:
+                    break
+
+    return [index["services"][position] for position in positions]
+
+# forza la ricostruzione dell'indice (necessario dopo scritture massive che non passano dalla sessione)
+def clear_service_search_index():
+    service_search_versions.clear()
+    with service_search_lock:
+        service_search_index["index"] = None
+
+# restituisce durante il flush gli esami creati, cancellati o con nome o descrizione modificati
+def collect_service_search_changes(session):
+    return {
+        to_uuid(target.service_id)
+        for target in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(target, Service) and (target not in session.dirty or has_attribute_changes(target, SERVICE_SEARCH_FIELDS))
+    }
+
+# l'indice è unico: viene usata la versione della chiave None, incrementata ad ogni modifica confermata
+service_search_versions = CacheVersions("service_search_changes", collect_service_search_changes)
@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from inspect import signature
+from threading import Lock
+from uuid import UUID
+from flask import current_app
+from sqlalchemy import select
+from app.extensions import db
+from app.models.model import Appointment, Availability, LocationClosure, OperatorAbsence, Service, Location, Operator
+from app.functions.model_changes import (
+    AVAILABILITY_SLOT_FIELDS,
+    APPOINTMENT_SLOT_FIELDS,
+    SERVICE_SLOT_FIELDS,
+    LOCATION_SLOT_FIELDS,
+    OPERATOR_SLOT_FIELDS,
+    get_attribute_values,
+    has_attribute_changes
+)
+from app.functions.cache_versions import CacheVersions
+
+# cache per processo dei risultati dei generatori di slot (LRU con scadenza, numero massimo di risultati e di slot salvati)
+# ogni risultato è salvato con la versione dell'esame richiesto letta prima del calcolo: le scritture confermate con commit
+# su appuntamenti, disponibilità, chiusure, assenze, esami, laboratori e operatori incrementano la versione degli esami coinvolti
+# e rendono obsoleti solo i risultati di quegli esami. I risultati sono condivisi tra le richieste e non vanno modificati
+
+slot_cache_entries = OrderedDict()
+slot_cache_lock = Lock()
+slot_cache_stats = {"hits": 0, "misses": 0}
+# numero di slot (o di date per i conteggi) dei risultati in cache
+slot_cache_slots = {"total": 0}
+
+def get_slot_cache_version(service_id):
+    return slot_cache_versions.get_version(service_id)
+
+# svuota la cache (necessario dopo scritture massive che non passano dalla sessione)
+def clear_slot_cache():
+    slot_cache_versions.clear()
+    with slot_cache_lock:
+        slot_cache_entries.clear()
+        slot_cache_slots["total"] = 0
+
+def get_slot_cache_stats():
+    with slot_cache_lock:
+        return {
+            "hits": slot_cache_stats["hits"],
+            "misses": slot_cache_stats["misses"],
+            "size": len(slot_cache_entries),
+            "max_size": current_app.config.get("SLOT_CACHE_SIZE", 0),
+            "slots": slot_cache_slots["total"],
+            "max_slots": current_app.config.get("SLOT_CACHE_MAX_SLOTS", 0),
+            "ttl_seconds": current_app.config.get("SLOT_CACHE_TTL_SECONDS", 0)
+        }
+
+# verifica se la sessione corrente ha scritture non ancora confermate: i risultati in cache non le vedrebbero
+def has_pending_slot_changes():
+    session = db.session
+    return bool(session.new or session.dirty or session.deleted) or slot_cache_versions.has_pending_changes(session)
+
+# dimensione di un risultato: numero di slot per i risultati {data: [slot, ...]}, numero di date per i conteggi
+def get_slot_result_size(result):
+    return sum(len(value) if isinstance(value, list) else 1 for value in result.values())
+
+# decoratore per le funzioni di generazione: la chiave è composta dal nome della funzione e da tutti i parametri
+# con SLOT_CACHE_SIZE = 0 la cache è disattivata, i risultati più grandi di SLOT_CACHE_MAX_SLOTS non vengono salvati
+def cached_slot_result(function):
+    function_signature = signature(function)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        cache_size = current_app.config.get("SLOT_CACHE_SIZE", 0)
+        if cache_size <= 0 or has_pending_slot_changes():
+            return function(*args, **kwargs)
+
+        arguments = function_signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        cache_key = (function.__name__, tuple(arguments.arguments.items()))
+        # la versione viene letta prima del calcolo: un risultato calcolato mentre viene confermata una scrittura resta obsoleto
+        version = get_slot_cache_version(arguments.arguments.get("service_id"))
+        now = time.monotonic()
+
+        with slot_cache_lock:
+            entry = slot_cache_entries.get(cache_key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                slot_cache_entries.move_to_end(cache_key)
+                slot_cache_stats["hits"] += 1
+                return entry[2]
+            slot_cache_stats["misses"] += 1
+
+        result = function(*args, **kwargs)
+        result_size = get_slot_result_size(result)
+        max_slots = current_app.config.get("SLOT_CACHE_MAX_SLOTS", 0)
+        if max_slots > 0 and result_size > max_slots:
+            return result
+
+        with slot_cache_lock:
+            replaced_entry = slot_cache_entries.pop(cache_key, None)
+            if replaced_entry is not None:
+                slot_cache_slots["total"] -= replaced_entry[3]
+            slot_cache_entries[cache_key] = (version, now + current_app.config.get("SLOT_CACHE_TTL_SECONDS", 0), result, result_size)
+            slot_cache_slots["total"] += result_size
+            # vengono eliminati i risultati usati meno di recente fino a rientrare nei limiti di risultati e di slot
+            while len(slot_cache_entries) > cache_size or (max_slots > 0 and slot_cache_slots["total"] > max_slots):
+                _, evicted_entry = slot_cache_entries.popitem(last=False)
+                slot_cache_slots["total"] -= evicted_entry[3]
+        return result
+
+    return wrapper
+
+# i valori inviati dal client possono essere stringhe
+def to_uuid(value):
+    return value if isinstance(value, UUID) or value is None else UUID(str(value))
+
+# registra nella sessione corrente gli esami toccati da scritture che non passano dal flush (inserimenti massivi con Core)
+# le versioni vengono incrementate al commit come per le altre scritture
+def add_slot_cache_changes(service_ids):
+    slot_cache_versions.add_changes(db.session, service_ids)
+
+# restituisce durante il flush gli esami toccati dalle scritture che influenzano gli slot
+def collect_slot_cache_changes(session):
+    service_ids = set()
+    availability_ids = set()
+    location_ids = set()
+    operator_ids = set()
+    deleted = session.deleted
+
+    for target in list(session.new) + list(session.dirty) + list(deleted):
+        is_changed = target in session.new or target in deleted
+        if isinstance(target, Appointment):
+            if is_changed or has_attribute_changes(target, APPOINTMENT_SLOT_FIELDS):
+                availability_ids.update(map(to_uuid, get_attribute_values(target, "availability_id")))
+        elif isinstance(target, Availability):
+            if is_changed or has_attribute_changes(target, AVAILABILITY_SLOT_FIELDS):
+                service_ids.update(map(to_uuid, get_attribute_values(target, "service_id")))
+        elif isinstance(target, LocationClosure):
+            location_ids.update(map(to_uuid, get_attribute_values(target, "location_id")))
+        elif isinstance(target, OperatorAbsence):
+            operator_ids.update(map(to_uuid, get_attribute_values(target, "operator_id")))
+        elif isinstance(target, Service):
+            if is_changed or has_attribute_changes(target, SERVICE_SLOT_FIELDS):
+                service_ids.add(target.service_id)
+        elif isinstance(target, Location):
+            if is_changed or has_attribute_changes(target, LOCATION_SLOT_FIELDS):
+                location_ids.add(target.location_id)
+        elif isinstance(target, Operator):
+            if is_changed or has_attribute_changes(target, OPERATOR_SLOT_FIELDS):
+                operator_ids.add(target.operator_id)
+
+    # disponibilità, laboratori e operatori vengono ricondotti agli esami con una sola query sulla connessione del flush
+    if availability_ids or location_ids or operator_ids:
+        query = select(Availability.service_id).distinct().where(
+            Availability.availability_id.in_(availability_ids)
+            | Availability.location_id.in_(location_ids)
+            | Availability.operator_id.in_(operator_ids)
+        )
+        service_ids.update(session.connection().execute(query).scalars())
+    return service_ids
+
+# versioni per esame dei risultati in cache, la chiave None è usata dalle richieste senza filtro per esame
+slot_cache_versions = CacheVersions("slot_cache_changes", collect_slot_cache_changes)
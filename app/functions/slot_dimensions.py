@@ -0,0 +1,91 @@
+from app.extensions import db
+from app.models.model import Service, Location, Operator
+from app.functions.model_changes import SERVICE_SLOT_FIELDS, LOCATION_SLOT_FIELDS, OPERATOR_SLOT_FIELDS, has_attribute_changes
+from app.functions.cache_versions import CacheVersions
+
+# cache per processo dei campi descrittivi degli slot già formattati (nome esame, dati del laboratorio, nome dell'operatore)
+# ogni voce è salvata con la versione di (tipo, id) letta prima del caricamento: le modifiche confermate con commit
+# su esami, laboratori e operatori incrementano la versione e rendono obsoleta la voce (vedi cache_versions)
+
+service_dimensions = {}
+location_dimensions = {}
+operator_dimensions = {}
+
+# verifica se la voce è in cache con la versione corrente
+def is_dimension_cached(dimensions, dimension_type, dimension_id):
+    entry = dimensions.get(dimension_id)
+    return entry is not None and entry[0] == slot_dimension_versions.get_version((dimension_type, dimension_id))
+
+# restituisce la voce dalla cache o la calcola con load e la salva
+# le voci lette con scritture non confermate nella sessione non vengono salvate
+def get_dimension(dimensions, dimension_type, dimension_id, load):
+    version = slot_dimension_versions.get_version((dimension_type, dimension_id))
+    entry = dimensions.get(dimension_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    value = load()
+    session = db.session
+    if not (session.new or session.dirty or session.deleted or slot_dimension_versions.has_pending_changes(session)):
+        dimensions[dimension_id] = (version, value)
+    return value
+
+# restituisce il nome dell'esame, caricandolo dall'oggetto fornito o dal database solo alla prima richiesta
+def get_service_dimension(service_id, service = None):
+    return get_dimension(service_dimensions, "service", service_id, lambda: (service or db.session.get(Service, service_id)).name)
+
+# restituisce (nome, indirizzo, telefono) del laboratorio
+def get_location_dimension(location_id, location = None):
+    def load_location_dimension():
+        dimension_location = location or db.session.get(Location, location_id)
+        return dimension_location.name, dimension_location.address, dimension_location.tel_number
+    return get_dimension(location_dimensions, "location", location_id, load_location_dimension)
+
+# restituisce il nome completo dell'operatore nel formato "titolo nome cognome"
+def get_operator_dimension(operator_id, operator = None):
+    def load_operator_dimension():
+        dimension_operator = operator or db.session.get(Operator, operator_id)
+        return f"{dimension_operator.title} {dimension_operator.first_name} {dimension_operator.last_name}"
+    return get_dimension(operator_dimensions, "operator", operator_id, load_operator_dimension)
+
+# restituisce l'intestazione comune a tutti gli slot di una disponibilità:
+# (availability_id, nome esame, nome laboratorio, indirizzo, telefono, nome operatore)
+# se viene passata la disponibilità le voci mancanti vengono lette dalle sue relazioni già caricate
+def get_slot_header(availability_id, service_id, location_id, operator_id, availability = None):
+    location_name, location_address, location_tel_number = get_location_dimension(location_id, availability.location if availability and not is_dimension_cached(location_dimensions, "location", location_id) else None)
+    return (
+        availability_id,
+        get_service_dimension(service_id, availability.service if availability and not is_dimension_cached(service_dimensions, "service", service_id) else None),
+        location_name,
+        location_address,
+        location_tel_number,
+        get_operator_dimension(operator_id, availability.operator if availability and not is_dimension_cached(operator_dimensions, "operator", operator_id) else None)
+    )
+
+# intestazione degli slot di una disponibilità ORM
+def get_availability_slot_header(availability):
+    return get_slot_header(availability.availability_id, availability.service_id, availability.location_id, availability.operator_id, availability)
+
+# svuota la cache (necessario dopo cancellazioni massive che non generano eventi)
+def clear_slot_dimensions():
+    slot_dimension_versions.clear()
+    service_dimensions.clear()
+    location_dimensions.clear()
+    operator_dimensions.clear()
+
+# restituisce durante il flush (tipo, id) degli esami, laboratori e operatori modificati nei campi mostrati o cancellati
+def collect_slot_dimension_changes(session):
+    dimension_keys = set()
+    for target in list(session.dirty) + list(session.deleted):
+        is_deleted = target in session.deleted
+        if isinstance(target, Service):
+            if is_deleted or has_attribute_changes(target, SERVICE_SLOT_FIELDS):
+                dimension_keys.add(("service", target.service_id))
+        elif isinstance(target, Location):
+            if is_deleted or has_attribute_changes(target, LOCATION_SLOT_FIELDS):
+                dimension_keys.add(("location", target.location_id))
+        elif isinstance(target, Operator):
+            if is_deleted or has_attribute_changes(target, OPERATOR_SLOT_FIELDS):
+                dimension_keys.add(("operator", target.operator_id))
+    return dimension_keys
+
+slot_dimension_versions = CacheVersions("slot_dimension_changes", collect_slot_dimension_changes)
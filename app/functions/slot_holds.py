@@ -0,0 +1,136 @@
+from datetime import date, datetime, time, timedelta
+from uuid import UUID
+from flask import current_app
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from app.extensions import db
+from app.models.model import SlotHold
+
+# prenotazioni temporanee degli slot (hold): un paziente può bloccare uno slot per SLOT_HOLD_SECONDS mentre compila il modulo
+# gli slot bloccati non vengono restituiti dai generatori e le prenotazioni di altri account vengono rifiutate prima di scrivere
+# gli hold sono salvati nella tabella slot_hold, quindi sono visibili a tutti i processi: l'indice unico sullo slot
+# garantisce un solo hold per slot anche con richieste concorrenti. Gli hold scaduti vengono ignorati in lettura
+# ed eliminati alla creazione di un nuovo hold
+
+# chiave dello slot: (availability_id, data isoformat, inizio isoformat) come negli oggetti AvailableSlot
+def get_slot_hold_key(availability_id, appointment_date, appointment_time_start):
+    return availability_id, appointment_date.isoformat(), appointment_time_start.isoformat(timespec='minutes')
+
+# condizione sullo slot della chiave
+def get_slot_hold_key_filter(slot_key):
+    availability_id, appointment_date_iso, appointment_time_start_iso = slot_key
+    return (
+        (SlotHold.availability_id == availability_id)
+        & (SlotHold.appointment_date == date.fromisoformat(appointment_date_iso))
+        & (SlotHold.appointment_time_start == time.fromisoformat(appointment_time_start_iso))
+    )
+
+# blocca lo slot per l'account: se lo slot è già bloccato dallo stesso account l'hold viene rinnovato
+# restituisce (hold_id, scadenza) oppure None se lo slot è bloccato da un altro account o l'account ha troppi hold attivi
+def acquire_slot_hold(account_id, slot_key):
+    account_id = UUID(str(account_id))
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=current_app.config.get("SLOT_HOLD_SECONDS", 120))
+    try:
+        db.session.execute(delete(SlotHold).where(SlotHold.expires_at <= now))
+        slot_hold_account_id = db.session.execute(select(SlotHold.account_id).where(get_slot_hold_key_filter(slot_key))).scalar()
+        if slot_hold_account_id is not None and slot_hold_account_id != account_id:
+            db.session.rollback()
+            return None
+        if slot_hold_account_id is None:
+            account_holds = db.session.execute(
+                select(func.count()).select_from(SlotHold).where(SlotHold.account_id == account_id, SlotHold.expires_at > now)
+            ).scalar()
+            if account_holds >= current_app.config.get("SLOT_HOLD_MAX_PER_ACCOUNT", 5):
+                db.session.rollback()
+                return None
+
+        # con un hold concorrente di un altro account sullo stesso slot la riga non viene aggiornata e non compare in RETURNING
+        availability_id, appointment_date_iso, appointment_time_start_iso = slot_key
+        insert_statement = postgresql_insert(SlotHold).values(
+            account_id=account_id,
+            availability_id=availability_id,
+            appointment_date=date.fromisoformat(appointment_date_iso),
+            appointment_time_start=time.fromisoformat(appointment_time_start_iso),
+            expires_at=expires_at
+        )
+        hold_id = db.session.execute(
+            insert_statement.on_conflict_do_update(
+                index_elements=[SlotHold.availability_id, SlotHold.appointment_date, SlotHold.appointment_time_start],
+                set_={"expires_at": insert_statement.excluded.expires_at},
+                where=SlotHold.account_id == insert_statement.excluded.account_id
+            ).returning(SlotHold.hold_id)
+        ).scalar()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if hold_id is None:
+        return None
+    return hold_id, expires_at
+
+# rilascia un hold dell'account (per id o per slot), restituisce False se non esiste o appartiene a un altro account
+def release_slot_hold(account_id, hold_id = None, slot_key = None):
+    slot_hold_filters = [SlotHold.account_id == UUID(str(account_id))]
+    if hold_id is not None:
+        slot_hold_filters.append(SlotHold.hold_id == hold_id)
+    if slot_key is not None:
+        slot_hold_filters.append(get_slot_hold_key_filter(slot_key))
+    released_hold_id = db.session.execute(delete(SlotHold).where(*slot_hold_filters).returning(SlotHold.hold_id)).scalar()
+    db.session.commit()
+    return released_hold_id is not None
+
+# restituisce le chiavi degli slot indicati bloccati da account diversi da quello indicato, con una sola query
+def get_slots_held_by_other(slot_keys, account_id):
+    if not slot_keys:
+        return set()
+    slot_hold_rows = db.session.execute(
+        select(SlotHold.availability_id, SlotHold.appointment_date, SlotHold.appointment_time_start)
+        .where(or_(*(get_slot_hold_key_filter(slot_key) for slot_key in slot_keys)))
+        .where(SlotHold.account_id != UUID(str(account_id)), SlotHold.expires_at > datetime.now())
+    ).all()
+    return {get_slot_hold_key(*slot_hold_row) for slot_hold_row in slot_hold_rows}
+
+# verifica se lo slot è bloccato da un account diverso da quello indicato
+def is_slot_held_by_other(slot_key, account_id):
+    return bool(get_slots_held_by_other([slot_key], account_id))
+
+# restituisce le chiavi degli slot bloccati, senza copie se non ci sono hold attivi
+def get_held_slot_keys():
+    slot_hold_rows = db.session.execute(
+        select(SlotHold.availability_id, SlotHold.appointment_date, SlotHold.appointment_time_start)
+        .where(SlotHold.expires_at > datetime.now())
+    ).all()
+    if not slot_hold_rows:
+        return ()
+    return {get_slot_hold_key(*slot_hold_row) for slot_hold_row in slot_hold_rows}
+
+# versione degli hold attivi (numero e scadenza più lontana): cambia con ogni hold creato, rinnovato, rilasciato o scaduto
+def get_slot_holds_version():
+    active_holds, last_expires_at = db.session.execute(
+        select(func.count(), func.max(SlotHold.expires_at)).where(SlotHold.expires_at > datetime.now())
+    ).one()
+    return active_holds, last_expires_at.isoformat() if last_expires_at else None
+
+# restituisce il risultato di un generatore {data: [slot, ...]} senza gli slot bloccati
+# il risultato originale può essere condiviso dalla cache: vengono copiate solo le date che contengono slot bloccati
+def exclude_held_slots(availabilities_slots_dategroup):
+    held_slot_keys = get_held_slot_keys()
+    if not held_slot_keys:
+        return availabilities_slots_dategroup
+
+    held_dates = {appointment_date for _, appointment_date, _ in held_slot_keys if appointment_date in availabilities_slots_dategroup}
+    if not held_dates:
+        return availabilities_slots_dategroup
+
+    unheld_slots_dategroup = dict(availabilities_slots_dategroup)
+    for appointment_date in held_dates:
+        unheld_slots = [
+            slot for slot in availabilities_slots_dategroup[appointment_date]
+            if (slot.availability_id, slot.appointment_date, slot.appointment_time_start) not in held_slot_keys
+        ]
+        if unheld_slots:
+            unheld_slots_dategroup[appointment_date] = unheld_slots
+        else:
+            del unheld_slots_dategroup[appointment_date]
+    return unheld_slots_dategroup
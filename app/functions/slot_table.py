@@ -0,0 +1,291 @@
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import event, select, insert, update, delete, and_, or_, case, func, tuple_
+from app.extensions import db
+from app.models.model import Slot, SlotTableWindow, Availability, Appointment, LocationClosure, OperatorAbsence
+from app.functions.generate_available_slots import get_availability_date_range, get_availability_slot_template
+from app.functions.slot_dimensions import get_slot_header
+from app.functions.available_slot import AvailableSlot
+from app.functions.validate_form_data import BOOKING_WINDOW_DAYS
+from app.functions.model_changes import AVAILABILITY_SLOT_FIELDS, APPOINTMENT_SLOT_FIELDS, get_attribute_versions, has_attribute_changes
+
+# tabella degli slot materializzati: contiene gli slot espansi di ogni disponibilità attiva nella finestra di prenotazione
+# ed è aggiornata in modo incrementale nella stessa transazione delle scritture su disponibilità, chiusure, assenze e appuntamenti
+
+SLOT_STATUS_FREE = "free"
+SLOT_STATUS_BOOKED = "booked"
+SLOT_STATUS_BLOCKED = "blocked"
+
+# la finestra da materializzare va da oggi al limite di prenotazione (domani + BOOKING_WINDOW_DAYS) compreso
+# la finestra si sposta ogni giorno: la tabella va ricostruita quotidianamente con rebuild_slot_table.py
+def get_slot_table_build_window():
+    first_date = date.today()
+    return first_date, first_date + timedelta(days=BOOKING_WINDOW_DAYS + 1)
+
+# restituisce la finestra (prima data, ultima data) registrata dall'ultima ricostruzione, None se la tabella non è mai stata costruita
+# se la ricostruzione quotidiana non viene eseguita le date oltre l'ultima data materializzata restano servite dal generatore
+def get_slot_table_window(connection = None):
+    connection = connection or db.session
+    return connection.execute(select(SlotTableWindow.first_date, SlotTableWindow.last_date)).first()
+
+# verifica se una richiesta può essere servita dalla tabella: la tabella unisce chiusure e assenze nello stato blocked
+# quindi può rispondere solo con tutte le esclusioni attive e con una finestra interamente materializzata
+def can_use_slot_table(datetime_from_filter, datetime_to_filter, exclude_location_closure_slots, exclude_operator_absence_slots, exclude_booked_slots):
+    if not (exclude_location_closure_slots and exclude_operator_absence_slots and exclude_booked_slots):
+        return False
+    if not (isinstance(datetime_from_filter, datetime) and isinstance(datetime_to_filter, datetime)):
+        return False
+    slot_table_window = get_slot_table_window()
+    if slot_table_window is None:
+        return False
+    first_date, last_date = slot_table_window
+    return datetime_from_filter.date() >= first_date and datetime_to_filter <= datetime.combine(last_date + timedelta(days=1), time(0, 0))
+
+# espande una regola di disponibilità negli slot compresi tra first_date e last_date
+def expand_availability_slot_rows(availability, first_date, last_date):
+    appointment_date, availability_maxdate = get_availability_date_range(
+        availability, datetime.combine(first_date, time(0, 0)), datetime.combine(last_date, time(0, 0))
+    )
+    slot_template = get_availability_slot_template(availability)
+    slot_rows = []
+    while appointment_date <= availability_maxdate:
+        for _, _, slot_time_start, slot_time_end, _, _ in slot_template:
+            slot_rows.append({
+                "availability_id": availability.availability_id,
+                "service_id": availability.service_id,
+                "location_id": availability.location_id,
+                "operator_id": availability.operator_id,
+                "slot_date": appointment_date,
+                "slot_time_start": slot_time_start,
+                "slot_time_end": slot_time_end,
+                "start_datetime": datetime.combine(appointment_date, slot_time_start),
+                "end_datetime": datetime.combine(appointment_date, slot_time_end),
+                "status": SLOT_STATUS_FREE
+            })
+        appointment_date += timedelta(days=7)
+    return slot_rows
+
+# ricalcola lo stato degli slot selezionati con una sola update: blocked se in sovrapposizione a chiusure o assenze,
+# booked se esiste un appuntamento attivo sullo stesso slot, altrimenti free
+def refresh_slot_status(connection, slot_filter = None):
+    slots = Slot.__table__
+    is_blocked = or_(
+        select(LocationClosure.closure_id).where(
+            LocationClosure.location_id == slots.c.location_id,
+            LocationClosure.start_datetime < slots.c.end_datetime,
+            LocationClosure.end_datetime > slots.c.start_datetime
+        ).exists(),
+        select(OperatorAbsence.absence_id).where(
+            OperatorAbsence.operator_id == slots.c.operator_id,
+            OperatorAbsence.start_datetime < slots.c.end_datetime,
+            OperatorAbsence.end_datetime > slots.c.start_datetime
+        ).exists()
+    )
+    is_booked = select(Appointment.appointment_id).where(
+        Appointment.availability_id == slots.c.availability_id,
+        Appointment.appointment_date == slots.c.slot_date,
+        Appointment.appointment_time_start == slots.c.slot_time_start,
+        Appointment.appointment_time_end == slots.c.slot_time_end,
+        Appointment.rejected == False
+    ).exists()
+    statement = update(slots).values(status=case((is_blocked, SLOT_STATUS_BLOCKED), (is_booked, SLOT_STATUS_BOOKED), else_=SLOT_STATUS_FREE))
+    if slot_filter is not None:
+        statement = statement.where(slot_filter)
+    connection.execute(statement)
+
+# rigenera gli slot di una disponibilità: li elimina e, se la regola è attiva, li espande di nuovo nella finestra materializzata
+def rebuild_availability_slots(connection, availability_id):
+    slots = Slot.__table__
+    connection.execute(delete(slots).where(slots.c.availability_id == availability_id))
+    availability = connection.execute(select(Availability.__table__).where(Availability.availability_id == availability_id)).first()
+    slot_table_window = get_slot_table_window(connection)
+    if availability is None or not availability.enabled or slot_table_window is None:
+        return 0
+    first_date, last_date = slot_table_window
+    slot_rows = expand_availability_slot_rows(availability, first_date, last_date)
+    if slot_rows:
+        connection.execute(insert(slots), slot_rows)
+        refresh_slot_status(connection, slots.c.availability_id == availability_id)
+    return len(slot_rows)
+
+# ricostruisce l'intera tabella degli slot, da usare per il ripristino e per spostare in avanti la finestra
+def rebuild_slot_table():
+    connection = db.session.connection()
+    connection.execute(delete(Slot.__table__))
+    first_date, last_date = get_slot_table_build_window()
+    slots_count = 0
+    for availability in connection.execute(select(Availability.__table__).where(Availability.enabled == True)).all():
+        slot_rows = expand_availability_slot_rows(availability, first_date, last_date)
+        if slot_rows:
+            connection.execute(insert(Slot.__table__), slot_rows)
+            slots_count += len(slot_rows)
+    refresh_slot_status(connection)
+    # la finestra viene registrata nella stessa transazione degli slot
+    connection.execute(delete(SlotTableWindow.__table__))
+    connection.execute(insert(SlotTableWindow.__table__).values(window_id=1, first_date=first_date, last_date=last_date, built_at=datetime.now()))
+    db.session.commit()
+    current_app.logger.info("Slot table rebuilt with %d slots", slots_count)
+    return slots_count
+
+# aggiornamenti incrementali: gli eventi vengono eseguiti durante il flush sulla stessa connessione e transazione della scrittura
+# la tabella viene mantenuta solo con il motore "table": con gli altri motori gli eventi non eseguono scritture
+# e passando al motore "table" la tabella va ricostruita con rebuild_slot_table.py
+def is_slot_table_enabled():
+    return current_app.config.get("SLOT_ENGINE") == "table"
+
+@event.listens_for(Availability, "after_insert")
+def on_availability_insert(mapper, connection, target):
+    if not is_slot_table_enabled():
+        return
+    rebuild_availability_slots(connection, target.availability_id)
+
+@event.listens_for(Availability, "after_update")
+def on_availability_update(mapper, connection, target):
+    if is_slot_table_enabled() and has_attribute_changes(target, AVAILABILITY_SLOT_FIELDS):
+        rebuild_availability_slots(connection, target.availability_id)
+
+@event.listens_for(Availability, "before_delete")
+def on_availability_delete(mapper, connection, target):
+    if not is_slot_table_enabled():
+        return
+    connection.execute(delete(Slot.__table__).where(Slot.__table__.c.availability_id == target.availability_id))
+
+@event.listens_for(LocationClosure, "after_insert")
+@event.listens_for(LocationClosure, "after_update")
+@event.listens_for(LocationClosure, "after_delete")
+def on_location_closure_change(mapper, connection, target):
+    if not is_slot_table_enabled():
+        return
+    slots = Slot.__table__
+    for location_id, start_datetime, end_datetime in get_attribute_versions(target, ("location_id", "start_datetime", "end_datetime")):
+        refresh_slot_status(connection, and_(slots.c.location_id == location_id, slots.c.start_datetime < end_datetime, slots.c.end_datetime > start_datetime))
+
+@event.listens_for(OperatorAbsence, "after_insert")
+@event.listens_for(OperatorAbsence, "after_update")
+@event.listens_for(OperatorAbsence, "after_delete")
+def on_operator_absence_change(mapper, connection, target):
+    if not is_slot_table_enabled():
+        return
+    slots = Slot.__table__
+    for operator_id, start_datetime, end_datetime in get_attribute_versions(target, ("operator_id", "start_datetime", "end_datetime")):
+        refresh_slot_status(connection, and_(slots.c.operator_id == operator_id, slots.c.start_datetime < end_datetime, slots.c.end_datetime > start_datetime))
+
+# ricalcola lo stato dello slot corrispondente a un appuntamento
+def refresh_appointment_slot(connection, availability_id, appointment_date, appointment_time_start):
+    slots = Slot.__table__
+    refresh_slot_status(connection, and_(
+        slots.c.availability_id == availability_id,
+        slots.c.slot_date == appointment_date,
+        slots.c.slot_time_start == appointment_time_start
+    ))
+
+# ricalcola con una sola update gli slot di più appuntamenti, da usare dopo inserimenti massivi che non generano eventi
+# appointment_keys contiene tuple (availability_id, appointment_date, appointment_time_start)
+def refresh_appointment_slots(connection, appointment_keys):
+    if not appointment_keys or not is_slot_table_enabled():
+        return
+    slots = Slot.__table__
+    refresh_slot_status(connection, tuple_(slots.c.availability_id, slots.c.slot_date, slots.c.slot_time_start).in_(appointment_keys))
+
+@event.listens_for(Appointment, "after_insert")
+@event.listens_for(Appointment, "after_update")
+def on_appointment_change(mapper, connection, target):
+    if not is_slot_table_enabled() or not has_attribute_changes(target, APPOINTMENT_SLOT_FIELDS):
+        return
+    # i valori inviati dal client possono essere stringhe: la chiave dello slot viene riletta dal database
+    appointment = connection.execute(select(Appointment.__table__).where(Appointment.appointment_id == target.appointment_id)).first()
+    refresh_appointment_slot(connection, appointment.availability_id, appointment.appointment_date, appointment.appointment_time_start)
+    # se l'appuntamento è stato spostato ricalcola anche lo slot precedente
+    appointment_key_versions = get_attribute_versions(target, ("availability_id", "appointment_date", "appointment_time_start"))
+    if len(appointment_key_versions) > 1:
+        refresh_appointment_slot(connection, *appointment_key_versions[1])
+
+@event.listens_for(Appointment, "after_delete")
+def on_appointment_delete(mapper, connection, target):
+    if not is_slot_table_enabled():
+        return
+    refresh_appointment_slot(connection, target.availability_id, target.appointment_date, target.appointment_time_start)
+
+# restituisce gli slot liberi della tabella con la stessa struttura {data: [slot, ...]} del generatore
+# i campi descrittivi vengono letti dalla cache delle dimensioni una sola volta per disponibilità invece che con join per ogni riga
+# nella stessa data gli slot sono ordinati per disponibilità e orario come negli altri motori
+def generate_available_slots_table(datetime_from_filter = None, datetime_to_filter = None, service_id = None, operator_id = None, location_id = None):
+    query = filter_free_slots(
+        db.session.query(
+            Slot.availability_id,
+            Slot.service_id,
+            Slot.location_id,
+            Slot.operator_id,
+            Slot.slot_date,
+            Slot.slot_time_start,
+            Slot.slot_time_end
+        ),
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id
+    ).order_by(Slot.slot_date, Slot.availability_id, Slot.slot_time_start)
+
+    availabilities_slots_dategroup = {}
+    slot_headers = {}
+    for slot_availability_id, slot_service_id, slot_location_id, slot_operator_id, slot_date, slot_time_start, slot_time_end in query:
+        slot_header = slot_headers.get(slot_availability_id)
+        if slot_header is None:
+            slot_header = slot_headers[slot_availability_id] = get_slot_header(slot_availability_id, slot_service_id, slot_location_id, slot_operator_id)
+        appointment_date_iso = slot_date.isoformat()
+        slot = AvailableSlot(slot_header, appointment_date_iso, slot_time_start.isoformat(timespec='minutes'), slot_time_end.isoformat(timespec='minutes'))
+        if appointment_date_iso in availabilities_slots_dategroup:
+            availabilities_slots_dategroup[appointment_date_iso].append(slot)
+        else:
+            availabilities_slots_dategroup[appointment_date_iso] = [slot]
+    return availabilities_slots_dategroup
+
+# restituisce i primi slot liberi della tabella in ordine cronologico con una query ordinata e limitata
+def find_next_available_slots_table(limit = 1, datetime_from_filter = None, datetime_to_filter = None, service_id = None, operator_id = None, location_id = None, time_from = None, time_to = None):
+    query = filter_free_slots(
+        db.session.query(
+            Slot.availability_id,
+            Slot.service_id,
+            Slot.location_id,
+            Slot.operator_id,
+            Slot.slot_date,
+            Slot.slot_time_start,
+            Slot.slot_time_end
+        ),
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id
+    )
+    if time_from:
+        query = query.filter(Slot.slot_time_start >= time_from)
+    if time_to:
+        query = query.filter(Slot.slot_time_end <= time_to)
+    query = query.order_by(Slot.start_datetime, Slot.availability_id).limit(limit)
+
+    return [
+        AvailableSlot(
+            get_slot_header(slot_availability_id, slot_service_id, slot_location_id, slot_operator_id),
+            slot_date.isoformat(),
+            slot_time_start.isoformat(timespec='minutes'),
+            slot_time_end.isoformat(timespec='minutes')
+        )
+        for slot_availability_id, slot_service_id, slot_location_id, slot_operator_id, slot_date, slot_time_start, slot_time_end in query
+    ]
+
+# conta gli slot liberi per data con una query aggregata sulla tabella
+def count_available_slots_table(datetime_from_filter = None, datetime_to_filter = None, service_id = None, operator_id = None, location_id = None):
+    query = filter_free_slots(
+        db.session.query(Slot.slot_date, func.count(Slot.slot_id)),
+        datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id
+    ).group_by(Slot.slot_date)
+    return {slot_date.isoformat(): slots_count for slot_date, slots_count in query}
+
+# applica alla query gli stessi filtri del generatore
+def filter_free_slots(query, datetime_from_filter = None, datetime_to_filter = None, service_id = None, operator_id = None, location_id = None):
+    query = query.filter(Slot.status == SLOT_STATUS_FREE)
+    if service_id:
+        query = query.filter(Slot.service_id == service_id)
+    if operator_id:
+        query = query.filter(Slot.operator_id == operator_id)
+    if location_id:
+        query = query.filter(Slot.location_id == location_id)
+    if datetime_from_filter:
+        query = query.filter(Slot.slot_date >= datetime_from_filter.date(), Slot.start_datetime >= datetime_from_filter)
+    if datetime_to_filter:
+        query = query.filter(Slot.slot_date <= datetime_to_filter.date(), Slot.end_datetime <= datetime_to_filter)
+    return query
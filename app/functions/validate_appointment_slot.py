@@ -0,0 +1,89 @@
+from datetime import date, datetime, time
+from uuid import UUID
+from flask import current_app
+from sqlalchemy import select, or_
+from app.extensions import db
+from app.models.model import Availability, LocationClosure, OperatorAbsence
+from app.functions.generate_available_slots import time_to_minutes
+
+# verifica al momento della prenotazione che uno slot proposto dal client sia uno slot generabile dalla regola di disponibilità
+# senza eseguire il generatore: la regola viene letta per chiave primaria e la posizione dello slot viene verificata
+# aritmeticamente (giorno della settimana, intervallo di date e allineamento alla griglia durata + pausa);
+# chiusure e assenze vengono verificate con una sola query di sovrapposizione servita dagli indici sui periodi
+# la sovrapposizione con altri appuntamenti attivi resta garantita dall'indice univoco uq_active_appointments
+
+# converte i valori inviati dal client (stringhe in isoformat) nei tipi delle colonne
+def parse_appointment_slot(availability_id, appointment_date, appointment_time_start, appointment_time_end):
+    try:
+        return (
+            availability_id if isinstance(availability_id, UUID) else UUID(str(availability_id)),
+            appointment_date if isinstance(appointment_date, date) else date.fromisoformat(appointment_date),
+            appointment_time_start if isinstance(appointment_time_start, time) else time.fromisoformat(appointment_time_start),
+            appointment_time_end if isinstance(appointment_time_end, time) else time.fromisoformat(appointment_time_end)
+        )
+    except (TypeError, ValueError):
+        return None
+
+# verifica che lo slot rispetti la regola di disponibilità: stesso calcolo di build_slot_template senza espandere la giornata
+def is_slot_on_availability_grid(availability, appointment_date, appointment_time_start, appointment_time_end):
+    if not availability.enabled or availability.slot_duration_minutes <= 0:
+        return False
+    if not (availability.available_from_date <= appointment_date <= availability.available_to_date):
+        return False
+    if appointment_date.weekday() != availability.available_weekday:
+        return False
+    # gli slot generati sono sempre a minuti interi
+    if appointment_time_start.second or appointment_time_start.microsecond or appointment_time_end.second or appointment_time_end.microsecond:
+        return False
+
+    from_minute = time_to_minutes(availability.available_from_time)
+    to_minute = time_to_minutes(availability.available_to_time)
+    start_minute = time_to_minutes(appointment_time_start)
+    end_minute = time_to_minutes(appointment_time_end)
+    return (
+        start_minute >= from_minute
+        and (start_minute - from_minute) % (availability.slot_duration_minutes + availability.pause_minutes) == 0
+        and end_minute == start_minute + availability.slot_duration_minutes
+        and end_minute <= to_minute
+    )
+
+# verifica con una sola query se lo slot si sovrappone a una chiusura del laboratorio o a un'assenza dell'operatore
+def is_slot_blocked(availability, slot_start_datetime, slot_end_datetime):
+    is_closed = select(LocationClosure.closure_id).where(
+        LocationClosure.location_id == availability.location_id,
+        LocationClosure.start_datetime < slot_end_datetime,
+        LocationClosure.end_datetime > slot_start_datetime
+    ).exists()
+    is_absent = select(OperatorAbsence.absence_id).where(
+        OperatorAbsence.operator_id == availability.operator_id,
+        OperatorAbsence.start_datetime < slot_end_datetime,
+        OperatorAbsence.end_datetime > slot_start_datetime
+    ).exists()
+    return db.session.execute(select(or_(is_closed, is_absent))).scalar()
+
+# restituisce lo slot convertito (availability_id, data, inizio, fine) se può essere prenotato: regola esistente e attiva,
+# slot sulla griglia, non passato, laboratorio aperto e operatore presente; altrimenti None
+def validate_appointment_slot(availability_id, appointment_date, appointment_time_start, appointment_time_end):
+    slot = parse_appointment_slot(availability_id, appointment_date, appointment_time_start, appointment_time_end)
+    if slot is None:
+        current_app.logger.error("Invalid slot values: %s %s %s %s", availability_id, appointment_date, appointment_time_start, appointment_time_end)
+        return None
+    availability_id, appointment_date, appointment_time_start, appointment_time_end = slot
+
+    availability = db.session.get(Availability, availability_id)
+    if availability is None:
+        current_app.logger.error("Availability %s not found", availability_id)
+        return None
+    if not is_slot_on_availability_grid(availability, appointment_date, appointment_time_start, appointment_time_end):
+        current_app.logger.error("Slot %s %s-%s does not match availability %s", appointment_date, appointment_time_start, appointment_time_end, availability_id)
+        return None
+
+    slot_start_datetime = datetime.combine(appointment_date, appointment_time_start)
+    slot_end_datetime = datetime.combine(appointment_date, appointment_time_end)
+    if slot_start_datetime < datetime.now():
+        current_app.logger.error("Slot %s %s is in the past", appointment_date, appointment_time_start)
+        return None
+    if is_slot_blocked(availability, slot_start_datetime, slot_end_datetime):
+        current_app.logger.error("Slot %s %s-%s overlaps a location closure or an operator absence", appointment_date, appointment_time_start, appointment_time_end)
+        return None
+    return slot
@@ -1,6 +1,6 @@
 import uuid
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import text, Index
+from sqlalchemy import text, Index, select, func
 from app.extensions import db
 from datetime import datetime
 from flask import current_app
@@ -73,6 +73,9 @@ class Account(db.Model):
         for appointment in account_appointments:
             appointment.info = None
 
+        # elimina le mail dell'account ancora presenti nella tabella mail_outbox (destinatari, nomi e prenotazioni)
+        MailOutbox.query.filter_by(account_id=self.account_id).delete()
+
         # anonimizza l'account
         self.enabled = False
         self.username = uuid.uuid4().hex
@@ -148,6 +151,11 @@ class LocationClosure(db.Model):
     start_datetime = db.Column(db.DateTime, nullable=False)
     end_datetime = db.Column(db.DateTime, nullable=False)
 
+    # indice per la verifica di sovrapposizione delle chiusure di un laboratorio con uno slot
+    __table_args__ = (
+        Index("ix_location_closure_location_period", "location_id", "start_datetime", "end_datetime"),
+    )
+
     # Relationships
 
     location = db.relationship("Location", back_populates="location_closure")
@@ -167,14 +175,30 @@ class Service(db.Model):
     # Metodi
 
     # restituisce un dizionario con i dati dell'esame e un flag per indicare se ci sono disponibilità attive
-    def to_dict(self):
+    # se il numero di disponibilità attive è già stato letto con la query del servizio non vengono caricate le disponibilità
+    def to_dict(self, enabled_availability_count = None):
+        if enabled_availability_count is None:
+            enabled_availability_count = sum(1 for av in self.availability if av.enabled)
         return {
             "service_id": self.service_id,
             "name": self.name,
             "description": self.description,
-            "has_enabled_availability": any(av.enabled for av in self.availability)
+            "has_enabled_availability": enabled_availability_count > 0,
+            "enabled_availability_count": enabled_availability_count
         }
 
+    # subquery correlata che conta le disponibilità attive del servizio, da aggiungere alle colonne della query dei servizi
+    # viene risolta per i soli servizi della pagina con l'indice ix_availability_service_enabled
+    @staticmethod
+    def enabled_availability_count_column():
+        return (
+            select(func.count(Availability.availability_id))
+            .where(Availability.service_id == Service.service_id, Availability.enabled == True)
+            .correlate(Service)
+            .scalar_subquery()
+            .label("enabled_availability_count")
+        )
+
 class Operator(db.Model):
     __tablename__ = "operators"
 
@@ -204,6 +228,11 @@ class OperatorAbsence(db.Model):
     start_datetime = db.Column(db.DateTime, nullable=False)
     end_datetime = db.Column(db.DateTime, nullable=False)
 
+    # indice per la verifica di sovrapposizione delle assenze di un operatore con uno slot
+    __table_args__ = (
+        Index("ix_operator_absence_operator_period", "operator_id", "start_datetime", "end_datetime"),
+    )
+
     # Relazioni
     operator = db.relationship("Operator", back_populates="operator_absence")
 
@@ -223,6 +252,11 @@ class Availability(db.Model):
     pause_minutes = db.Column(db.Integer, nullable=False)
     enabled = db.Column(db.Boolean, default=True, nullable=False)
 
+    # indice per il conteggio delle disponibilità attive di un servizio (catalogo dei servizi)
+    __table_args__ = (
+        Index("ix_availability_service_enabled", "service_id", "enabled"),
+    )
+
     #Relazioni
 
     location = db.relationship("Location", back_populates="availability")
@@ -316,4 +350,123 @@ class Appointment(db.Model):
             unique=True,
             postgresql_where=text("rejected = false")
         ),
+        # indice di copertura per la lettura degli appuntamenti attivi delle disponibilità candidate durante la generazione degli slot
+        # include gli orari in modo che la query venga risolta con un index-only scan
+        Index(
+            "ix_active_appointments_availability_date",
+            "availability_id",
+            "appointment_date",
+            postgresql_include=["appointment_time_start", "appointment_time_end"],
+            postgresql_where=text("rejected = false")
+        ),
+        # indice per la lista appuntamenti dell'account: serve l'ordinamento e la paginazione con cursore senza ordinare la tabella
+        Index(
+            "ix_appointment_account_date",
+            "account_id",
+            "appointment_date",
+            "appointment_time_start",
+            "appointment_id"
+        ),
+    )
+
+class Slot(db.Model):
+    __tablename__ = "slot"
+
+    slot_id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    availability_id = db.Column(UUID(as_uuid=True), db.ForeignKey("availability.availability_id"), nullable=False)
+    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey("service.service_id"), nullable=False)
+    location_id = db.Column(UUID(as_uuid=True), db.ForeignKey("location.location_id"), nullable=False)
+    operator_id = db.Column(UUID(as_uuid=True), db.ForeignKey("operators.operator_id"), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False)
+    slot_time_start = db.Column(db.Time, nullable=False)
+    slot_time_end = db.Column(db.Time, nullable=False)
+    start_datetime = db.Column(db.DateTime, nullable=False)
+    end_datetime = db.Column(db.DateTime, nullable=False)
+    # free: prenotabile, booked: appuntamento attivo, blocked: chiusura del laboratorio o assenza dell'operatore
+    status = db.Column(db.String(16), default="free", nullable=False)
+
+    # vincoli
+
+    # uno slot per disponibilità, data e ora e indice per le ricerche per esame e intervallo di date
+    __table_args__ = (
+        Index(
+            "uq_slot_availability_date_time",
+            "availability_id",
+            "slot_date",
+            "slot_time_start",
+            unique=True
+        ),
+        Index(
+            "ix_slot_service_status_date",
+            "service_id",
+            "status",
+            "slot_date"
+        ),
+    )
+
+# finestra di date effettivamente materializzata nella tabella degli slot, registrata ad ogni ricostruzione (una sola riga)
+class SlotTableWindow(db.Model):
+    __tablename__ = "slot_table_window"
+
+    window_id = db.Column(db.Integer, primary_key=True)
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    built_at = db.Column(db.DateTime, nullable=False)
+
+# prenotazioni temporanee degli slot (hold), condivise da tutti i processi: uno slot può avere un solo hold
+# le righe scadute vengono ignorate in lettura ed eliminate alla creazione di un nuovo hold
+class SlotHold(db.Model):
+    __tablename__ = "slot_hold"
+
+    hold_id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    account_id = db.Column(UUID(as_uuid=True), db.ForeignKey("account.account_id"), nullable=False)
+    availability_id = db.Column(UUID(as_uuid=True), db.ForeignKey("availability.availability_id"), nullable=False)
+    appointment_date = db.Column(db.Date, nullable=False)
+    appointment_time_start = db.Column(db.Time, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    # un hold per slot, indici per la lettura degli hold attivi e per il conteggio degli hold di un account
+    __table_args__ = (
+        Index(
+            "uq_slot_hold_slot",
+            "availability_id",
+            "appointment_date",
+            "appointment_time_start",
+            unique=True
+        ),
+        Index("ix_slot_hold_expires_at", "expires_at"),
+        Index("ix_slot_hold_account", "account_id", "expires_at"),
+    )
+
+class MailOutbox(db.Model):
+    __tablename__ = "mail_outbox"
+
+    mail_id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    # account a cui si riferisce la mail: le mail vengono eliminate con l'anonimizzazione dell'account
+    account_id = db.Column(UUID(as_uuid=True), db.ForeignKey("account.account_id"), nullable=True)
+    # tipo di mail: le mail con token (validazione dell'account e reimpostazione della password) salvano solo il testo
+    # e il link con il token viene generato al momento dell'invio
+    kind = db.Column(db.String(32), nullable=True)
+    recipient = db.Column(db.String(254), nullable=False)
+    # oggetto e testo vengono svuotati quando la mail è inviata o i tentativi sono esauriti
+    subject = db.Column(db.String(512), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # pending: da inviare (anche dopo un errore), sent: inviata, failed: tentativi esauriti
+    status = db.Column(db.String(16), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # prossimo invio: viene spostato in avanti quando la mail è presa in carico e dopo ogni errore
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(512), nullable=True)
+
+    # indice per la ricerca delle mail da inviare
+    __table_args__ = (
+        Index(
+            "ix_mail_outbox_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'")
+        ),
+        # indice per l'eliminazione delle mail di un account
+        Index("ix_mail_outbox_account", "account_id"),
     )
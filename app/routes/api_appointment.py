@@ -1,17 +1,80 @@
-from app.models.model import Appointment, Service, Location, Patient, Availability
+from app.models.model import Appointment, Service, Location, Patient, Availability, Operator
 from flask import jsonify
 from flask import request
-from uuid import UUID
+from uuid import UUID, uuid4
 from app.routes import bp
 from flask import current_app
 from app import db
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.functions.validate_form_data import validate_data
+from app.functions.validate_appointment_slot import validate_appointment_slot
 from datetime import datetime
-from sqlalchemy import or_, and_
-from app.functions.send_mail import send_appointment_confirmation, send_appointment_cancellation
+from sqlalchemy import or_, and_, select, func, tuple_
+from app.functions.send_mail import send_appointment_confirmation, send_appointment_cancellation, send_appointments_summary
+from app.functions.slot_table import refresh_appointment_slots
+from app.functions.slot_cache import add_slot_cache_changes
+from app.functions.slot_holds import get_slot_hold_key, acquire_slot_hold, release_slot_hold, is_slot_held_by_other, get_slots_held_by_other
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+# numero massimo di slot per una prenotazione multipla (un anno di visite settimanali)
+MAX_BATCH_APPOINTMENTS = 52
+
+# colonne della lista appuntamenti: vengono lette con una sola SELECT sulle tabelle in join
+# invece di caricare con to_dict le relazioni di ogni appuntamento (servizio, laboratorio, operatore e paziente)
+APPOINTMENT_LIST_COLUMNS = (
+    Appointment.appointment_id,
+    Appointment.availability_id,
+    Appointment.appointment_date,
+    Appointment.appointment_time_start,
+    Appointment.appointment_time_end,
+    Appointment.info,
+    Appointment.rejected,
+    Service.name.label("service_name"),
+    Service.service_id,
+    Location.name.label("location_name"),
+    Location.address.label("location_address"),
+    Location.tel_number.label("location_tel_number"),
+    Patient.first_name.label("patient_first_name"),
+    Patient.last_name.label("patient_last_name"),
+    Operator.title.label("operator_title"),
+    Operator.first_name.label("operator_first_name"),
+    Operator.last_name.label("operator_last_name")
+)
+
+# il cursore identifica l'ultimo appuntamento restituito: data, ora di inizio e id (stesso ordine della lista)
+def encode_appointments_cursor(appointment_row):
+    return f"{appointment_row.appointment_date.isoformat()}T{appointment_row.appointment_time_start.isoformat()}_{appointment_row.appointment_id}"
+
+def decode_appointments_cursor(cursor):
+    try:
+        cursor_datetime, cursor_appointment_id = cursor.split("_")
+        cursor_datetime = datetime.fromisoformat(cursor_datetime)
+        return cursor_datetime.date(), cursor_datetime.time(), UUID(cursor_appointment_id)
+    except ValueError:
+        return None
+
+# stessi campi di Appointment.to_dict
+def appointment_row_to_dict(appointment_row):
+    return {
+        "appointment_id": appointment_row.appointment_id,
+        "availability_id": appointment_row.availability_id,
+        "appointment_date": appointment_row.appointment_date.isoformat(),
+        "appointment_time_start": appointment_row.appointment_time_start.strftime("%H:%M"),
+        "appointment_time_end": appointment_row.appointment_time_end.strftime("%H:%M"),
+        "info": appointment_row.info,
+        "rejected": appointment_row.rejected,
+        "service_name": appointment_row.service_name,
+        "service_id": appointment_row.service_id,
+        "location_name": appointment_row.location_name,
+        "location_address": appointment_row.location_address,
+        "location_tel_number": appointment_row.location_tel_number,
+        "patient_name": f"{appointment_row.patient_first_name} {appointment_row.patient_last_name}",
+        "operator_name": f"{appointment_row.operator_title} {appointment_row.operator_first_name} {appointment_row.operator_last_name}" if appointment_row.operator_title is not None else None,
+    }
 
 # restituisce tutti gli appuntamenti associati all'utente corrente
+# la paginazione può usare il numero di pagina (OFFSET) o il cursore next_cursor della risposta precedente (keyset),
+# che resta veloce anche sulle ultime pagine; con include_total=false viene saltato il conteggio degli appuntamenti
 @bp.route('/api/v1/appointments', methods=['GET'])
 @jwt_required()
 def get_appointments():
@@ -19,37 +82,73 @@ def get_appointments():
     # converte i parametri della query string in booleani in base al valore fornito
     rejected_appointments = request.args.get('rejected_appointments', 'false').lower() == 'true'
     past_appointments = request.args.get('past_appointments', 'false').lower() == 'true'
+    include_total = request.args.get('include_total', 'true').lower() == 'true'
    
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     per_page = request.args.get('per_page', 10, type=int)
+    if per_page < 1:
+        per_page = 10
+    cursor = request.args.get('cursor')
     
     current_user = get_jwt_identity() 
 
-    # naviga tra le tabelle per ottenere i dati relativi agli appuntamenti ordinati per data e ora
-    appointments_query = Appointment.query.join(Availability).join(Service).join(Location).join(Patient).filter(Appointment.account_id == current_user)
+    # filtri della lista condivisi dalla query dei dati e dal conteggio
+    appointments_filters = [Appointment.account_id == current_user]
   
     # se non stati specificati appuntamenti rifiutati, filtra gli appuntamenti rifiutati
     if rejected_appointments == False:
-        appointments_query = appointments_query.filter(Appointment.rejected == False)
+        appointments_filters.append(Appointment.rejected == False)
 
     # se non sono stati specificati appuntamenti passati, filtra gli appuntamenti passati
     if past_appointments == False:
         today = datetime.now()
-        appointments_query = appointments_query = appointments_query.filter(
+        appointments_filters.append(
             or_(
                 Appointment.appointment_date > today.date(),
                 and_(Appointment.appointment_time_start == today.time(),Appointment.appointment_time_start >= today.time())
             )
         )
 
-    appointments_query =  appointments_query.order_by(Appointment.appointment_date.desc(), Appointment.appointment_time_start.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    # naviga tra le tabelle per ottenere i dati relativi agli appuntamenti ordinati per data e ora
+    appointments_query = (
+        select(*APPOINTMENT_LIST_COLUMNS)
+        .join(Availability, Appointment.availability_id == Availability.availability_id)
+        .join(Service, Availability.service_id == Service.service_id)
+        .join(Location, Availability.location_id == Location.location_id)
+        .join(Patient, Appointment.patient_id == Patient.patient_id)
+        .outerjoin(Operator, Availability.operator_id == Operator.operator_id)
+        .where(*appointments_filters)
+        .order_by(Appointment.appointment_date.desc(), Appointment.appointment_time_start.desc(), Appointment.appointment_id.desc())
+    )
+
+    if cursor:
+        cursor_values = decode_appointments_cursor(cursor)
+        if cursor_values is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        appointments_query = appointments_query.where(
+            tuple_(Appointment.appointment_date, Appointment.appointment_time_start, Appointment.appointment_id) < tuple_(*cursor_values)
+        )
+    else:
+        appointments_query = appointments_query.offset((page - 1) * per_page)
+
+    # viene letto un appuntamento in più per sapere se esiste una pagina successiva
+    appointment_rows = db.session.execute(appointments_query.limit(per_page + 1)).all()
+    next_cursor = encode_appointments_cursor(appointment_rows[per_page - 1]) if len(appointment_rows) > per_page else None
+    appointment_rows = appointment_rows[:per_page]
+
+    # il conteggio usa solo la tabella degli appuntamenti: i join della lista non filtrano righe
+    total = None
+    pages = None
+    if include_total:
+        total = db.session.execute(select(func.count()).select_from(Appointment).where(*appointments_filters)).scalar()
+        pages = -(-total // per_page)
     
-    # usa il metodo to_dict per ottenere solo i dati necessari e restiuici un json 
     return jsonify({
-        'total': appointments_query.total,
-        'pages': appointments_query.pages,
-        'current_page': appointments_query.page,
-        'data': [appointment.to_dict() for appointment in appointments_query.items]
+        'total': total,
+        'pages': pages,
+        'current_page': None if cursor else page,
+        'next_cursor': next_cursor,
+        'data': [appointment_row_to_dict(appointment_row) for appointment_row in appointment_rows]
     })
 
 # crea un nuovo appuntamento e paziente associato
@@ -67,13 +166,27 @@ def create_appointment():
             return jsonify({"error": "Invalid patient_datata"}), 400
         if not validate_data(appointment_data):
             return jsonify({"error": "Invalid appointment_data"}), 400
+        # verifica che lo slot richiesto sia generabile dalla disponibilità e non sia bloccato da chiusure o assenze
+        slot = validate_appointment_slot(
+            appointment_data.get("availability_id"),
+            appointment_data.get("appointment_date"),
+            appointment_data.get("appointment_time_start"),
+            appointment_data.get("appointment_time_end")
+        )
+        if not slot:
+            return jsonify({"error": "Invalid appointment slot"}), 400
+        availability_id, appointment_date, appointment_time_start, appointment_time_end = slot
+        # uno slot bloccato da un altro account viene rifiutato prima di aprire la transazione di scrittura
+        slot_hold_key = get_slot_hold_key(availability_id, appointment_date, appointment_time_start)
+        if is_slot_held_by_other(slot_hold_key, current_user):
+            return jsonify({"error": "Slot held by another user"}), 409
         
         # crea un nuovo appuntamento
         appointment = Appointment(
-            availability_id = appointment_data.get("availability_id"),
-            appointment_date = appointment_data.get("appointment_date"),
-            appointment_time_start = appointment_data.get("appointment_time_start"),
-            appointment_time_end = appointment_data.get("appointment_time_end"),
+            availability_id = availability_id,
+            appointment_date = appointment_date,
+            appointment_time_start = appointment_time_start,
+            appointment_time_end = appointment_time_end,
             info = appointment_data.get("info"),
             account_id = current_user
         )
@@ -88,10 +201,13 @@ def create_appointment():
             patient_birth_date = patient_data.get("birth_date"),
             patient_is_default = patient_data.get("is_default")
         )
-        db.session.commit()
+        # la mail di conferma viene accodata nella stessa transazione dell'appuntamento (il flush rende disponibili paziente ed esame)
+        db.session.flush()
         patient_full_name = f"{appointment.patient.first_name} {appointment.patient.last_name}"
         service_name = appointment.availability.service.name
         send_appointment_confirmation(appointment.patient.email, service_name, patient_full_name, appointment)
+        db.session.commit()
+        release_slot_hold(current_user, slot_key=slot_hold_key)
         return jsonify({"success": "Appointment created"}), 200
     
     except Exception as e:
@@ -99,6 +215,180 @@ def create_appointment():
         current_app.logger.error(e)
         return jsonify({"error": "Invalid data"}), 400
 
+# restituisce il paziente di default dell'account o crea il nuovo paziente indicato (come Appointment.create_new)
+def get_or_create_batch_patient(account_id, patient_data):
+    if patient_data.get("is_default") == True:
+        return Patient.query.filter_by(account_id=account_id, is_default=True).first()
+    patient = Patient(
+        account_id = account_id,
+        first_name = patient_data.get("first_name"),
+        last_name = patient_data.get("last_name"),
+        email = patient_data.get("email"),
+        tel_number = patient_data.get("tel_number"),
+        fiscal_code = patient_data.get("fiscal_code"),
+        birth_date = patient_data.get("birth_date"),
+        is_default = False
+    )
+    db.session.add(patient)
+    # usa il flush per ottenere l'id del paziente
+    db.session.flush()
+    return patient
+
+# prenota una serie di slot per lo stesso paziente in una sola transazione
+# tutti gli slot vengono validati prima dell'inserimento, che avviene con un solo INSERT ... ON CONFLICT DO NOTHING:
+# gli slot già prenotati (uq_active_appointments) vengono riportati come conflitti senza annullare gli altri
+# e viene accodata una sola mail di riepilogo
+@bp.route('/api/v1/appointments/batch', methods=['POST'])
+@jwt_required()
+def create_appointments_batch():
+
+    current_user = get_jwt_identity()
+    data = request.get_json()
+    patient_data = data.get("patient")
+    appointments_data = data.get("appointments")
+
+    if not patient_data or not validate_data(patient_data):
+        return jsonify({"error": "Invalid patient_data"}), 400
+    if not isinstance(appointments_data, list) or not 1 <= len(appointments_data) <= MAX_BATCH_APPOINTMENTS:
+        return jsonify({"error": f"appointments must contain between 1 and {MAX_BATCH_APPOINTMENTS} slots"}), 400
+
+    # valida tutti gli slot prima di scrivere: un solo slot non valido annulla la richiesta
+    slots = []
+    invalid_slots = []
+    for index, appointment_data in enumerate(appointments_data):
+        slot = None
+        if isinstance(appointment_data, dict) and validate_data(appointment_data):
+            slot = validate_appointment_slot(
+                appointment_data.get("availability_id"),
+                appointment_data.get("appointment_date"),
+                appointment_data.get("appointment_time_start"),
+                appointment_data.get("appointment_time_end")
+            )
+        if not slot:
+            invalid_slots.append(index)
+        slots.append(slot)
+    if invalid_slots:
+        return jsonify({"error": "Invalid appointment slot", "invalid_slots": invalid_slots}), 400
+    slot_hold_keys = [get_slot_hold_key(availability_id, appointment_date, appointment_time_start) for availability_id, appointment_date, appointment_time_start, _ in slots]
+    held_slot_keys = get_slots_held_by_other(slot_hold_keys, current_user)
+    held_slots = [index for index, slot_hold_key in enumerate(slot_hold_keys) if slot_hold_key in held_slot_keys]
+    if held_slots:
+        return jsonify({"error": "Slot held by another user", "held_slots": held_slots}), 409
+
+    try:
+        patient = get_or_create_batch_patient(current_user, patient_data)
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+
+        appointment_rows = [
+            {
+                "appointment_id": uuid4(),
+                "account_id": UUID(str(current_user)),
+                "patient_id": patient.patient_id,
+                "availability_id": availability_id,
+                "appointment_date": appointment_date,
+                "appointment_time_start": appointment_time_start,
+                "appointment_time_end": appointment_time_end,
+                "info": appointment_data.get("info"),
+                "rejected": False
+            }
+            for (availability_id, appointment_date, appointment_time_start, appointment_time_end), appointment_data in zip(slots, appointments_data)
+        ]
+        # gli slot in conflitto con appuntamenti attivi (o ripetuti nella richiesta) non vengono inseriti e non compaiono in RETURNING
+        booked_ids = set(db.session.execute(
+            postgresql_insert(Appointment).values(appointment_rows).on_conflict_do_nothing().returning(Appointment.appointment_id)
+        ).scalars())
+        booked_rows = [appointment_row for appointment_row in appointment_rows if appointment_row["appointment_id"] in booked_ids]
+
+        # l'inserimento massivo non genera eventi: tabella degli slot e cache dei risultati vengono aggiornate esplicitamente
+        availabilities = {appointment_row["availability_id"]: db.session.get(Availability, appointment_row["availability_id"]) for appointment_row in booked_rows}
+        refresh_appointment_slots(db.session.connection(), [
+            (appointment_row["availability_id"], appointment_row["appointment_date"], appointment_row["appointment_time_start"])
+            for appointment_row in booked_rows
+        ])
+        add_slot_cache_changes({availability.service_id for availability in availabilities.values()})
+
+        if booked_rows:
+            send_appointments_summary(
+                patient.email,
+                f"{patient.first_name} {patient.last_name}",
+                [
+                    (availabilities[appointment_row["availability_id"]].service.name, appointment_row["appointment_date"], appointment_row["appointment_time_start"], appointment_row["appointment_time_end"])
+                    for appointment_row in booked_rows
+                ],
+                patient.account_id
+            )
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(e)
+        return jsonify({"error": "Invalid data"}), 400
+
+    for slot_hold_key in slot_hold_keys:
+        release_slot_hold(current_user, slot_key=slot_hold_key)
+
+    results = [
+        {"index": index, "status": "booked", "appointment_id": appointment_row["appointment_id"]} if appointment_row["appointment_id"] in booked_ids
+        else {"index": index, "status": "conflict"}
+        for index, appointment_row in enumerate(appointment_rows)
+    ]
+    if not booked_rows:
+        return jsonify({"error": "Slots already booked", "results": results}), 409
+    return jsonify({"success": f"{len(booked_rows)} appointments created", "results": results}), 200
+
+# blocca uno slot per SLOT_HOLD_SECONDS mentre il paziente compila il modulo: lo slot non viene più restituito
+# dai generatori e le prenotazioni di altri account vengono rifiutate con 409; richiedere di nuovo lo stesso slot rinnova l'hold
+@bp.route('/api/v1/slot-holds', methods=['POST'])
+@jwt_required()
+def create_slot_hold():
+
+    current_user = get_jwt_identity()
+    data = request.get_json()
+
+    if not data or not validate_data(data):
+        return jsonify({"error": "Invalid slot data"}), 400
+    slot = validate_appointment_slot(
+        data.get("availability_id"),
+        data.get("appointment_date"),
+        data.get("appointment_time_start"),
+        data.get("appointment_time_end")
+    )
+    if not slot:
+        return jsonify({"error": "Invalid appointment slot"}), 400
+    availability_id, appointment_date, appointment_time_start, _ = slot
+
+    slot_hold_key = get_slot_hold_key(availability_id, appointment_date, appointment_time_start)
+    if is_slot_held_by_other(slot_hold_key, current_user):
+        return jsonify({"error": "Slot held by another user"}), 409
+    # uno slot già prenotato non può essere bloccato
+    booked_appointment = Appointment.query.with_entities(Appointment.appointment_id).filter_by(
+        availability_id=availability_id,
+        appointment_date=appointment_date,
+        appointment_time_start=appointment_time_start,
+        rejected=False
+    ).first()
+    if booked_appointment:
+        return jsonify({"error": "Slot already booked"}), 409
+
+    slot_hold = acquire_slot_hold(current_user, slot_hold_key)
+    if slot_hold is None:
+        return jsonify({"error": "Slot held by another user or too many active holds"}), 409
+    hold_id, expires_at = slot_hold
+    return jsonify({"hold_id": hold_id, "expires_at": expires_at.isoformat(timespec="seconds")}), 200
+
+# rilascia un hold dell'utente corrente
+@bp.route('/api/v1/slot-holds/<hold_id>', methods=['DELETE'])
+@jwt_required()
+def delete_slot_hold(hold_id):
+    try:
+        hold_uuid = UUID(hold_id)
+    except ValueError:
+        return jsonify({"error": "Invalid hold_id"}), 400
+    if not release_slot_hold(get_jwt_identity(), hold_id=hold_uuid):
+        return jsonify({"error": "Slot hold not found"}), 404
+    return jsonify({"success": "Slot hold released"}), 200
+
 # restituisce i dati di un appuntamento
 @bp.route('/api/v1/appointments/<appointment_id>', methods=['GET'])
 @jwt_required()
@@ -122,6 +412,19 @@ def replace_appointment(appointment_id):
         return jsonify({"error": "Invalid patient_data"}), 400
     if not validate_data(appointment_data):
         return jsonify({"error": "Invalid appointment_data"}), 400
+    # verifica che lo slot richiesto sia generabile dalla disponibilità e non sia bloccato da chiusure o assenze
+    slot = validate_appointment_slot(
+        appointment_data.get("availability_id"),
+        appointment_data.get("appointment_date"),
+        appointment_data.get("appointment_time_start"),
+        appointment_data.get("appointment_time_end")
+    )
+    if not slot:
+        return jsonify({"error": "Invalid appointment slot"}), 400
+    availability_id, appointment_date, appointment_time_start, appointment_time_end = slot
+    slot_hold_key = get_slot_hold_key(availability_id, appointment_date, appointment_time_start)
+    if is_slot_held_by_other(slot_hold_key, current_user):
+        return jsonify({"error": "Slot held by another user"}), 409
 
     # recupera l'appuntamento e verifica che l'account associato sia l'utente corrente
     appointment = Appointment.query.filter_by(appointment_id=UUID(appointment_id), account_id=current_user).first()
@@ -132,10 +435,10 @@ def replace_appointment(appointment_id):
     try:
          # crea un nuovo appuntamento
         new_appointment = Appointment(
-            availability_id = appointment_data.get("availability_id"),
-            appointment_date = appointment_data.get("appointment_date"),
-            appointment_time_start = appointment_data.get("appointment_time_start"),
-            appointment_time_end = appointment_data.get("appointment_time_end"),
+            availability_id = availability_id,
+            appointment_date = appointment_date,
+            appointment_time_start = appointment_time_start,
+            appointment_time_end = appointment_time_end,
             info = appointment_data.get("info"),
             account_id = current_user
         )
@@ -152,14 +455,16 @@ def replace_appointment(appointment_id):
         )
 
         # sostituisci l'appuntamento con il nuovo appuntamento
-        
-        db.session.commit()
+        # le mail vengono accodate nella stessa transazione del nuovo appuntamento
+        db.session.flush()
         patient_full_name = f"{new_appointment.patient.first_name} {new_appointment.patient.last_name}"
         service_name = new_appointment.availability.service.name
         send_appointment_cancellation(appointment.patient.email, service_name,  patient_full_name, appointment)
         send_appointment_confirmation(new_appointment.patient.email, service_name, patient_full_name, new_appointment)
+        db.session.commit()
         db.session.delete(appointment)
         db.session.commit()
+        release_slot_hold(current_user, slot_key=slot_hold_key)
         return jsonify("Appointment replaced"), 200
     
     except Exception as e:
@@ -175,10 +480,10 @@ def reject_appointment(appointment_id):
     try:
         appointment = Appointment.query.get(UUID(appointment_id))
         appointment.rejected = True
-        db.session.commit()
         patient_full_name = f"{appointment.patient.first_name} {appointment.patient.last_name}"
         service_name = appointment.availability.service.name
         send_appointment_cancellation(appointment.patient.email, service_name, patient_full_name, appointment)
+        db.session.commit()
         return jsonify("Appointment rejected"), 200
     
     except Exception as e:
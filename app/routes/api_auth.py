@@ -205,6 +205,7 @@ def request_password_reset():
 
     # crea un token valido e crea un link per reimpostare la password
     send_access_token(email, account)
+    db.session.commit()
     
     return jsonify({"message": "reset link sent"}), 200
 
@@ -269,9 +270,9 @@ def register():
                 fiscal_code=data.get("fiscal_code"),
                 birth_date=data.get("birth_date")
             )
-            db.session.commit()
-
+            # la mail viene accodata nella stessa transazione dell'account
             send_access_token(data.get("email"), account)
+            db.session.commit()
 
         except Exception as e:
             current_app.logger.error(e)
@@ -1,12 +1,21 @@
-from app.models.model import Availability, Service, Operator, Location
-from flask import jsonify
-from app.functions import generate_available_slots
+from app.models.model import Availability, Service, Operator, Location, Account
+from flask import jsonify, Response, stream_with_context
+from app.functions import generate_available_slots, iter_available_slots, count_available_slots, find_next_available_slots, get_slot_cache_stats
 from datetime import datetime, time, timedelta, timezone
 from flask import request
 from uuid import UUID
 from app.routes import bp
+from app.functions.validate_form_data import BOOKING_WINDOW_DAYS
+from app.functions.service_search import search_services
+from app.functions.service_facets import get_service_facets
+from app.functions.etags import make_etag, get_catalogue_version, get_slots_version, get_not_modified_response, add_etag
 from flask import current_app
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+# numero massimo di slot restituiti dalla ricerca dei primi slot liberi
+MAX_NEXT_AVAILABLE_SLOTS = 50
+# numero massimo di esami restituiti dalla ricerca typeahead
+MAX_SERVICE_SEARCH_RESULTS = 50
 
 # funzioni per ottenere il primo giorno del mese successivo e del mese precedente
 # le date sono impostate a mezzanotte per forzare un limite inclusivo per la data di inizio e esclusivo per la data di fine
@@ -19,6 +28,22 @@ def first_day_of_prev_month(dt: datetime) -> datetime:
         return datetime(dt.year - 1, 12, 1 ,0, 0)
     return datetime(dt.year, dt.month - 1, 1, 0, 0)
 
+# produce la risposta json un pezzo alla volta: gli slot vengono serializzati data per data man mano che sono generati
+def stream_available_slots(operators, locations, datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id):
+    yield '{"operators": ' + current_app.json.dumps(operators) + ', "locations": ' + current_app.json.dumps(locations) + ', "slots_by_date": {'
+    separator = ''
+    for appointment_date_iso, slots in iter_available_slots(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id):
+        yield separator + current_app.json.dumps(appointment_date_iso) + ': ' + current_app.json.dumps([slot.to_dict() for slot in slots])
+        separator = ', '
+    yield '}}'
+
+# imposto i limiti per la data di prenotazione e la data di fine prenotazione 
+# la data di prenotazione non può essere inferiore alla data attuale
+# la data di fine prenotazione non può essere superiore a un anno dalla data attuale
+def get_reservation_limits():
+    min_reservation_datetime = datetime.combine((datetime.now() + timedelta(days=1)).date(), time(0, 0))
+    return min_reservation_datetime, min_reservation_datetime + timedelta(days=BOOKING_WINDOW_DAYS)
+
 def parse_datetime(dt_str: str) -> datetime:
     dt = datetime.fromisoformat(dt_str)
     if dt.tzinfo is not None:
@@ -33,40 +58,65 @@ def get_services():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     search = request.args.get('search', type=str,)
+
+    # la lista cambia solo con le scritture sugli esami e sulle disponibilità: senza modifiche risponde 304 senza query
+    etag = make_etag("services", get_catalogue_version())
+    not_modified_response = get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
     
     # se è stato fornito un parametro di ricerca filtra i servizi per nome
-    services_query = Service.query
+    # il numero di disponibilità attive viene letto nella stessa query dei servizi
+    services_query = Service.query.add_columns(Service.enabled_availability_count_column())
     if search:
         services_query = services_query.filter(Service.name.ilike(f"%{search}%"))
     
     services_query = services_query.order_by(Service.name.asc()).paginate(page=page, per_page=per_page, error_out=True)    
     
-    return jsonify({
+    return add_etag(jsonify({
         "page": services_query.page,
         "total": services_query.total,
         "pages": services_query.pages,
-        "data": [service.to_dict() for service in services_query.items]
+        "data": [service.to_dict(enabled_availability_count) for service, enabled_availability_count in services_query.items]
+    }), etag)
+
+# ricerca typeahead degli esami per sottostringa di nome o descrizione, servita dall'indice in memoria senza query
+# i risultati sono ordinati per qualità della corrispondenza: nome uguale, inizio del nome, inizio di una parola,
+# parte del nome e infine descrizione
+@bp.route('/api/v1/services/search', methods=['GET'])
+@jwt_required()
+def get_services_search():
+
+    search = request.args.get('q', '', type=str)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_SERVICE_SEARCH_RESULTS)
+
+    return jsonify({
+        "data": [
+            {"service_id": service_id, "name": name, "description": description}
+            for service_id, name, description in search_services(search, limit)
+        ]
     })
 
 @bp.route('/api/v1/services/<service_id>', methods=['GET'])
 @jwt_required()
 def get_service(service_id):
-    service = Service.query.get(UUID(service_id))
-    if service:
-        return jsonify(service.to_dict())
+    service_id = UUID(service_id)
+    etag = make_etag("service", service_id, get_catalogue_version(service_id))
+    not_modified_response = get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
+
+    service_row = Service.query.add_columns(Service.enabled_availability_count_column()).filter(Service.service_id == service_id).first()
+    if service_row:
+        service, enabled_availability_count = service_row
+        return add_etag(jsonify(service.to_dict(enabled_availability_count)), etag)
     return jsonify({"error": "Service type not found"}), 404
 
 @bp.route('/api/v1/services/<service_id>/available-slots', methods=['GET'])
 @jwt_required()
 def get_service_availabilities(service_id):
 
-    # imposto i limiti per la data di prenotazione e la data di fine prenotazione 
-    # la data di prenotazione non può essere inferiore alla data attuale
-    # la data di fine prenotazione non può essere superiore a un anno dalla data attuale
-
-    MIN_RESERVATION_DATETIME = datetime.combine((datetime.now() + timedelta(days=1)).date(), time(0, 0))
-    BOOKING_WINDOW_DAYS = 365
-    RESERVATION_DATETIME_LIMIT = MIN_RESERVATION_DATETIME + timedelta(days=BOOKING_WINDOW_DAYS)
+    MIN_RESERVATION_DATETIME, RESERVATION_DATETIME_LIMIT = get_reservation_limits()
 
     try:
         # recupera i parametri dalla query string e li converte in UUID
@@ -77,6 +127,9 @@ def get_service_availabilities(service_id):
         # se è stata fornita una data specifica per restituire gli slot di una data specifica
         page_date_str = request.args.get('page_date', type=str)
 
+        # in modalità streaming restituisce tutti gli slot della finestra raggruppati per data in una risposta chunked
+        stream = request.args.get('stream', 'false').lower() == 'true'
+
         # imposto i cursori per la paginazione se la data arriva con un timezone la converto in UTC
         datetime_from_filter = request.args.get('datetime_from_filter', default=MIN_RESERVATION_DATETIME, type=parse_datetime)
         datetime_to_filter = request.args.get('datetime_to_filter', default=None, type=parse_datetime)
@@ -96,52 +149,64 @@ def get_service_availabilities(service_id):
         datetime_from_filter = RESERVATION_DATETIME_LIMIT
     
 
-    # se la data di fine è maggiore del limite massimo imposto la data di fine al limite massimo
-    if (datetime_to_filter - datetime_from_filter) > (first_day_of_next_month(datetime_from_filter) - datetime_from_filter):
+    # in modalità streaming la finestra può estendersi fino al limite di prenotazione
+    # altrimenti se la data di fine è maggiore del limite massimo imposto la data di fine al limite massimo
+    if stream:
+        if datetime_to_filter > RESERVATION_DATETIME_LIMIT:
+            datetime_to_filter = RESERVATION_DATETIME_LIMIT
+    elif (datetime_to_filter - datetime_from_filter) > (first_day_of_next_month(datetime_from_filter) - datetime_from_filter):
         datetime_to_filter = first_day_of_next_month(datetime_from_filter)
 
     current_app.logger.info("Datetime filter: %s - %s", datetime_from_filter, datetime_to_filter)
-    
-    # genera gli slot disponibili
-
-    available_slots = generate_available_slots(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id)
- 
-    available_dates_count = len(available_slots.keys())
-    available_slots_count = sum(len(available_slots[date]) for date in available_slots.keys())
 
-    current_app.logger.info("Available dates: %d", available_dates_count)
-    current_app.logger.info("Available slots: %d", available_slots_count)
+    # la risposta dipende dai parametri normalizzati, dalla modalità (JSON o streaming), dalla versione degli slot dell'esame
+    # e dal primo giorno prenotabile: se il client ha già la versione corrente risponde 304 prima di leggere i filtri e generare gli slot
+    etag = make_etag(
+        "available-slots-stream" if stream else "available-slots",
+        service_id, operator_id, location_id, page_date_str, datetime_from_filter, datetime_to_filter,
+        get_slots_version(service_id, MIN_RESERVATION_DATETIME)
+    )
+    not_modified_response = get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
     
     # genera i filtri per la selezione degli operatori e dei laboratori    
-    # genera la lista di operatori e laboratori disponibili per l'esame selezionato senza duplicati
+    # la lista di operatori e laboratori disponibili per l'esame selezionato senza duplicati viene letta dalla cache dei filtri
     # filtrali uno rispetto all'altro se sono stati forniti come parametri 
-    distinct_locations_query = Location.query.join(Availability).filter(Availability.service_id == service_id)
-    if operator_id:
-        distinct_locations_query = distinct_locations_query.filter(Availability.operator_id == operator_id)
-    distinct_locations = distinct_locations_query.distinct()
-
-    distinct_operators_query = Operator.query.join(Availability).filter(Availability.service_id == service_id)
-    if location_id:
-        distinct_operators_query = distinct_operators_query.filter(Availability.location_id == location_id)
-    distinct_operators = distinct_operators_query.distinct()
+    distinct_operators, distinct_locations = get_service_facets(service_id, operator_id, location_id)
+
+    if stream:
+        return add_etag(Response(
+            stream_with_context(stream_available_slots(
+                distinct_operators,
+                distinct_locations,
+                datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id
+            )),
+            mimetype='application/json'
+        ), etag)
+
+    # calcola solo le date con almeno uno slot disponibile senza generare i dettagli degli slot
+    available_dates = count_available_slots(datetime_from_filter, datetime_to_filter, service_id, operator_id, location_id, stop_at_first=True)
     
-    if not available_slots:
-        date_list = []
-        date_slots = []
-    else:
-        # se è sono stati genrati slot per il mese corrent oordina le date e popola slots con la prima data disponibile
-        # essendo date isoformat posso ordinarlare senza convertirle in datetime
-        date_list = sorted(available_slots.keys())
-        
+    # essendo date isoformat posso ordinarle senza convertirle in datetime
+    date_list = sorted(available_dates.keys())
+    current_app.logger.info("Available dates: %d", len(date_list))
 
     # se è stata fornita una data specifica restituisce gli slot per quella data altrimenti restituisce gli slot per la prima data disponibile
     if not page_date_str and len(date_list) > 0:
-        date_slots = available_slots[date_list[0]]
-    elif page_date_str in date_list:    
-        date_slots = available_slots[page_date_str]
+        page_date_str = date_list[0]
+    
+    if page_date_str in date_list:
+        # genera gli slot solo per la data richiesta restringendo la finestra al giorno
+        page_datetime = datetime.fromisoformat(page_date_str)
+        page_datetime_from_filter = max(datetime_from_filter, page_datetime)
+        page_datetime_to_filter = min(datetime_to_filter, page_datetime + timedelta(days=1))
+        date_slots = generate_available_slots(page_datetime_from_filter, page_datetime_to_filter, service_id, operator_id, location_id).get(page_date_str, [])
     else:
         date_slots = []
 
+    current_app.logger.info("Available slots: %d", len(date_slots))
+
     # calcola i cursori per la paginazione non considera solo il mese e l'anno per poter portare avanti e indietro 
     # il cursore nei mesi di MIN_RESERVATION_DATETIME e RESERVATION_DATETIME_LIMIT
     prev_month = first_day_of_prev_month(datetime_from_filter)
@@ -156,12 +221,94 @@ def get_service_availabilities(service_id):
     else:
         next_cursor_datetime = next_month.isoformat()
 
-    return jsonify({
-                "operators": [distinct_operator.to_dict() for distinct_operator in distinct_operators],
-                "locations": [distinct_location.to_dict() for distinct_location in distinct_locations],
+    return add_etag(jsonify({
+                "operators": distinct_operators,
+                "locations": distinct_locations,
                 "date_list": date_list,
-                "slots": date_slots,
+                "slots": [date_slot.to_dict() for date_slot in date_slots],
                 "next_cursor_datetime": next_cursor_datetime,
                 "prev_cursor_datetime": prev_cursor_datetime,
+            }), etag), 200
+
+# restituisce per ogni giorno della finestra di prenotazione il numero di slot liberi dell'esame (0 se non ci sono slot)
+# i conteggi vengono calcolati senza generare gli slot (con il motore "table" con una query aggregata sulla tabella materializzata)
+@bp.route('/api/v1/services/<service_id>/available-slots/heatmap', methods=['GET'])
+@jwt_required()
+def get_service_availability_heatmap(service_id):
+
+    MIN_RESERVATION_DATETIME, RESERVATION_DATETIME_LIMIT = get_reservation_limits()
+
+    try:
+        service_id = UUID(service_id)
+        operator_id = request.args.get('operator_id', type=UUID)
+        location_id = request.args.get('location_id', type=UUID)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify({"error": "Invalid data"}), 400
+
+    # la finestra è sempre quella di prenotazione: la risposta dipende dai filtri, dalla versione degli slot dell'esame
+    # e dal primo giorno prenotabile, se il client ha già la versione corrente risponde 304 prima di contare gli slot
+    etag = make_etag("heatmap", service_id, operator_id, location_id, get_slots_version(service_id, MIN_RESERVATION_DATETIME))
+    not_modified_response = get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
+
+    available_slots_count = count_available_slots(MIN_RESERVATION_DATETIME, RESERVATION_DATETIME_LIMIT, service_id, operator_id, location_id)
+
+    days = {}
+    day = MIN_RESERVATION_DATETIME.date()
+    while day < RESERVATION_DATETIME_LIMIT.date():
+        day_iso = day.isoformat()
+        days[day_iso] = available_slots_count.get(day_iso, 0)
+        day += timedelta(days=1)
+
+    return add_etag(jsonify({
+                "datetime_from_filter": MIN_RESERVATION_DATETIME.isoformat(),
+                "datetime_to_filter": RESERVATION_DATETIME_LIMIT.isoformat(),
+                "days": days,
+            }), etag), 200
+
+# restituisce i primi slot liberi dell'esame a partire dalla data indicata (di default dal primo giorno prenotabile)
+# con filtri opzionali per operatore, laboratorio e fascia oraria (time_from e time_to nel formato HH:MM)
+@bp.route('/api/v1/services/<service_id>/next-available-slots', methods=['GET'])
+@jwt_required()
+def get_service_next_available_slots(service_id):
+
+    MIN_RESERVATION_DATETIME, RESERVATION_DATETIME_LIMIT = get_reservation_limits()
+
+    try:
+        service_id = UUID(service_id)
+        operator_id = request.args.get('operator_id', type=UUID)
+        location_id = request.args.get('location_id', type=UUID)
+        time_from = request.args.get('time_from', type=time.fromisoformat)
+        time_to = request.args.get('time_to', type=time.fromisoformat)
+        limit = request.args.get('limit', default=1, type=int)
+        datetime_from_filter = request.args.get('datetime_from_filter', default=MIN_RESERVATION_DATETIME, type=parse_datetime)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify({"error": "Invalid data"}), 400
+
+    if limit < 1 or limit > MAX_NEXT_AVAILABLE_SLOTS:
+        return jsonify({"error": "Invalid data"}), 400
+
+    # la ricerca resta entro i limiti della finestra di prenotazione
+    datetime_from_filter = min(max(datetime_from_filter, MIN_RESERVATION_DATETIME), RESERVATION_DATETIME_LIMIT)
+
+    next_slots = find_next_available_slots(limit, datetime_from_filter, RESERVATION_DATETIME_LIMIT, service_id, operator_id, location_id, time_from, time_to)
+
+    return jsonify({
+                "slots": [next_slot.to_dict() for next_slot in next_slots],
             }), 200
 
+# restituisce i contatori della cache degli slot del processo corrente (solo per gli amministratori)
+@bp.route('/api/v1/available-slots/cache', methods=['GET'])
+@jwt_required()
+def get_available_slots_cache_stats():
+
+    current_user = get_jwt_identity()
+    account = Account.query.get(current_user)
+    if not account or not account.is_admin:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    return jsonify(get_slot_cache_stats()), 200
+
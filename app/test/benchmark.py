@@ -0,0 +1,212 @@
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from statistics import median
+from flask import current_app
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, func
+from app.extensions import db
+from app.models.model import Account, Patient, Operator, Location, Service, Availability, LocationClosure, OperatorAbsence, Appointment
+from app.functions import generate_available_slots, rebuild_slot_table
+from app.functions.slot_cache import clear_slot_cache
+from app.functions.slot_dimensions import clear_slot_dimensions
+from app.test.test_data import (
+    clear_all_tables,
+    insert_patients_operators,
+    insert_locations,
+    insert_services,
+    insert_availabilities,
+    insert_lab_closures,
+    insert_operator_absences,
+    insert_appointments
+)
+
+# benchmark del generatore di slot e degli endpoint che lo usano su dataset sintetici parametrizzati
+# per ogni caso vengono registrati tempo (mediana e minimo su più esecuzioni), picco di memoria e numero di query SQL
+# e il risultato viene salvato in un report JSON confrontabile tra commit diversi (vedi benchmark_slots.py)
+
+BENCHMARK_PROFILES = {
+    "small": {
+        "patients": 10, "operators": 10, "locations": 10, "services": 10, "availabilities": 50,
+        "lab_closures": 3, "operator_absences": 3, "appointments": 500, "availability_days": 90
+    },
+    "medium": {
+        "patients": 200, "operators": 100, "locations": 20, "services": 30, "availabilities": 1000,
+        "lab_closures": 50, "operator_absences": 100, "appointments": 100_000, "availability_days": 365
+    },
+    "production": {
+        "patients": 1000, "operators": 500, "locations": 50, "services": 100, "availabilities": 5000,
+        "lab_closures": 200, "operator_absences": 500, "appointments": 1_000_000, "availability_days": 365
+    }
+}
+BENCHMARK_RUNS = 5
+
+# svuota il database e inserisce il dataset del profilo con gli helper di test_data
+def seed_benchmark_data(profile):
+    clear_all_tables()
+    with db.session.begin_nested():
+        insert_patients_operators(profile["patients"], profile["operators"], repeat_names=True)
+        insert_locations(profile["locations"], repeat_names=True)
+        insert_services(profile["services"], repeat_names=True)
+        insert_availabilities(profile["availabilities"], max_days=profile["availability_days"])
+        insert_lab_closures(profile["lab_closures"])
+        insert_operator_absences(profile["operator_absences"])
+        insert_appointments(profile["appointments"], bulk=True)
+    db.session.commit()
+
+    # gli appuntamenti sono inseriti in blocco senza eventi: cache e tabella degli slot vanno riallineate
+    clear_slot_cache()
+    clear_slot_dimensions()
+    rebuild_slot_table()
+
+# conta le righe delle tabelle coinvolte nella generazione degli slot
+def get_dataset_counts():
+    return {
+        model.__tablename__: db.session.query(func.count()).select_from(model).scalar()
+        for model in (Patient, Operator, Location, Service, Availability, LocationClosure, OperatorAbsence, Appointment)
+    }
+
+# esegue la funzione contando le query inviate al database
+def run_counting_queries(function):
+    queries = []
+    def on_before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", on_before_cursor_execute)
+    try:
+        result = function()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", on_before_cursor_execute)
+    return result, len(queries)
+
+# misura un caso: i tempi sono presi su esecuzioni senza tracemalloc, picco di memoria e query su un'esecuzione aggiuntiva
+def measure_benchmark_case(name, params, function, result_size, runs = BENCHMARK_RUNS):
+    timings = []
+    for _ in range(runs):
+        db.session.expire_all()
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    db.session.expire_all()
+    tracemalloc.start()
+    try:
+        result, sql_queries = run_counting_queries(function)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    current_app.logger.info("Benchmark %s %s: %.1f ms", name, params, median(timings))
+    return {
+        "name": name,
+        "params": params,
+        "runs": runs,
+        "wall_ms_median": round(median(timings), 3),
+        "wall_ms_min": round(min(timings), 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+        "sql_queries": sql_queries,
+        "result_size": result_size(result)
+    }
+
+# sceglie come riferimento l'esame con più disponibilità attive e una sua disponibilità per i filtri di operatore e laboratorio
+def get_benchmark_availability():
+    service_id = db.session.query(Availability.service_id).filter(Availability.enabled == True).group_by(Availability.service_id).order_by(func.count().desc()).limit(1).scalar()
+    if service_id is None:
+        return None
+    return Availability.query.filter(Availability.enabled == True, Availability.service_id == service_id).first()
+
+def run_benchmark_suite(runs = BENCHMARK_RUNS):
+    availability = get_benchmark_availability()
+    if availability is None:
+        current_app.logger.error("No availabilities available, skipping benchmark.")
+        return []
+
+    service_id = availability.service_id
+    operator_id = availability.operator_id
+    location_id = availability.location_id
+    datetime_from_filter = datetime.combine((datetime.now() + timedelta(days=1)).date(), datetime.min.time())
+    month_datetime_to_filter = datetime_from_filter + timedelta(days=31)
+    year_datetime_to_filter = datetime_from_filter + timedelta(days=365)
+
+    results = []
+
+    # generatore: combinazioni di filtri su un mese e sull'intera finestra
+    generator_cases = [
+        ("service, month", dict(service_id=service_id, datetime_to_filter=month_datetime_to_filter)),
+        ("service + operator, month", dict(service_id=service_id, operator_id=operator_id, datetime_to_filter=month_datetime_to_filter)),
+        ("service + location, month", dict(service_id=service_id, location_id=location_id, datetime_to_filter=month_datetime_to_filter)),
+        ("service, year", dict(service_id=service_id, datetime_to_filter=year_datetime_to_filter)),
+        ("all services, month", dict(datetime_to_filter=month_datetime_to_filter))
+    ]
+    for case_name, filters in generator_cases:
+        results.append(measure_benchmark_case(
+            "generate_available_slots",
+            case_name,
+            lambda filters=filters: generate_available_slots(datetime_from_filter=datetime_from_filter, **filters),
+            lambda result: sum(len(slots) for slots in result.values()),
+            runs
+        ))
+
+    # endpoint HTTP: le richieste passano dal client di test di Flask con un token valido
+    account = Account.query.filter_by(is_admin=True).first()
+    headers = {"Authorization": f"Bearer {create_access_token(identity=str(account.account_id) if account else 'benchmark')}"}
+    client = current_app.test_client()
+    endpoint_cases = [
+        ("services", "/api/v1/services"),
+        ("service", f"/api/v1/services/{service_id}"),
+        ("available-slots", f"/api/v1/services/{service_id}/available-slots"),
+        ("available-slots", f"/api/v1/services/{service_id}/available-slots?operator_id={operator_id}"),
+        ("available-slots", f"/api/v1/services/{service_id}/available-slots?location_id={location_id}"),
+        ("available-slots", f"/api/v1/services/{service_id}/available-slots?stream=true"),
+        ("available-slots/heatmap", f"/api/v1/services/{service_id}/available-slots/heatmap"),
+        ("available-slots/heatmap", f"/api/v1/services/{service_id}/available-slots/heatmap?location_id={location_id}"),
+        ("next-available-slots", f"/api/v1/services/{service_id}/next-available-slots"),
+        ("next-available-slots", f"/api/v1/services/{service_id}/next-available-slots?limit=20&time_from=14:00")
+    ]
+    for case_name, url in endpoint_cases:
+        results.append(measure_benchmark_case(
+            case_name,
+            url,
+            lambda url=url: client.get(url, headers=headers).get_data(),
+            len,
+            runs
+        ))
+
+    return results
+
+# restituisce il commit corrente se il progetto è un repository git
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def build_benchmark_report(profile_name, results):
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "profile": profile_name,
+        "slot_engine": current_app.config.get("SLOT_ENGINE"),
+        "slot_cache_size": current_app.config.get("SLOT_CACHE_SIZE"),
+        "dataset": get_dataset_counts(),
+        "results": results
+    }
+
+def write_benchmark_report(report, path):
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2, default=str)
+
+# confronta due report caso per caso e restituisce righe (caso, parametri, ms precedenti, ms attuali, rapporto)
+def compare_benchmark_reports(previous_report, report):
+    previous_results = {(result["name"], result["params"]): result for result in previous_report["results"]}
+    comparison = []
+    for result in report["results"]:
+        previous_result = previous_results.get((result["name"], result["params"]))
+        if previous_result is None:
+            continue
+        ratio = result["wall_ms_median"] / previous_result["wall_ms_median"] if previous_result["wall_ms_median"] else None
+        comparison.append((result["name"], result["params"], previous_result["wall_ms_median"], result["wall_ms_median"], ratio))
+    return comparison
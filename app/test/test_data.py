@@ -1,10 +1,18 @@
 from flask import current_app
-from app.models.model import db, Account, Location, Patient, Availability, Operator, Service, LocationClosure, OperatorAbsence, Appointment
-from app.functions import generate_available_slots
+from app.models.model import db, Account, Location, Patient, Availability, Operator, Service, LocationClosure, OperatorAbsence, Appointment, Slot, SlotHold, MailOutbox
+from app.functions import generate_available_slots, iter_available_slots, count_available_slots, rebuild_slot_table
+from app.functions.generate_available_slots import generate_uncached_available_slots
+from app.functions.slot_table import get_slot_table_build_window
+from app.functions.slot_dimensions import clear_slot_dimensions
+from app.functions.slot_cache import clear_slot_cache
+from app.functions.service_search import clear_service_search_index
+from app.functions.service_facets import clear_service_facets
+from app.functions.etags import clear_catalogue_versions
 import uuid
 from datetime import date, time, datetime, timedelta
 import random
 from werkzeug.security import generate_password_hash
+from sqlalchemy import insert
 
 NUMBER_OF_PATIENTS = 10
 NUMBER_OF_OPERATORS = 10
@@ -17,10 +25,18 @@ NUMBER_OF_APPOINTMENTS = 50
 
 NUMBER_OF_TESTS = 1
 
+# motori di generazione confrontati con il generatore python (SLOT_ENGINE)
+SLOT_ENGINES = ("numpy", "table", "sql")
+
+BULK_INSERT_BATCH_SIZE = 10000
+
 def clear_all_tables():
     try:
         # cancella tutte le righe delle tabelle in ordine inverso per evitare violazioni di chiave esterna
         with db.session.begin_nested():
+            MailOutbox.query.delete()
+            SlotHold.query.delete()
+            Slot.query.delete()
             Appointment.query.delete()
             OperatorAbsence.query.delete()
             LocationClosure.query.delete()
@@ -31,6 +47,13 @@ def clear_all_tables():
             Location.query.delete()
             Account.query.delete()
         db.session.commit()
+        # le cancellazioni massive non generano eventi: le cache dei campi descrittivi e dei risultati degli slot,
+        # l'indice di ricerca, i filtri e le versioni del catalogo degli esami vanno svuotati
+        clear_slot_dimensions()
+        clear_slot_cache()
+        clear_service_search_index()
+        clear_service_facets()
+        clear_catalogue_versions()
     except Exception as e:
         current_app.logger.error("Error truncating tables: %s", e)
         return
@@ -48,7 +71,8 @@ from datetime import datetime
 import random
 from flask import current_app
 
-def insert_patients_operators(numberof_patients=1, numberof_operators=1):
+# con repeat_names l'elenco dei nomi viene ripetuto (con un numero progressivo nello username) per generare dataset più grandi
+def insert_patients_operators(numberof_patients=1, numberof_operators=1, repeat_names=False):
     
     FIRST_NAME_LAST_NAME_DICT = {
         "Alessio": "Arancioni",
@@ -70,6 +94,7 @@ def insert_patients_operators(numberof_patients=1, numberof_operators=1):
     }
 
     MAX_ACCOUNTS = len(FIRST_NAME_LAST_NAME_DICT)
+    NAME_LIST = list(FIRST_NAME_LAST_NAME_DICT.items())
 
     try:
         created_operators = 0
@@ -77,16 +102,17 @@ def insert_patients_operators(numberof_patients=1, numberof_operators=1):
         created_accounts = 0
         numberof_accounts = numberof_patients + numberof_operators
 
-        for first_name, last_name in FIRST_NAME_LAST_NAME_DICT.items():
-                if created_accounts >= numberof_accounts or created_accounts >= MAX_ACCOUNTS:
+        for account_number in range(max(numberof_accounts, MAX_ACCOUNTS) if repeat_names else MAX_ACCOUNTS):
+                if created_accounts >= numberof_accounts or (created_accounts >= MAX_ACCOUNTS and not repeat_names):
                     return 
 
                 # Creazione account
-                first_name = first_name
+                first_name, last_name = NAME_LIST[account_number % MAX_ACCOUNTS]
+                username_suffix = account_number // MAX_ACCOUNTS or ""
                 account_uuid = uuid.uuid4()
                 account = Account(
                     account_id=account_uuid,
-                    username= f"{first_name.lower()}.{last_name.lower()}",
+                    username= f"{first_name.lower()}.{last_name.lower()}{username_suffix}",
                     password_hash="hashed_password",
                     enabled=True,
                     is_operator= True if created_operators < numberof_operators else False
@@ -115,7 +141,7 @@ def insert_patients_operators(numberof_patients=1, numberof_operators=1):
                         is_default=True,
                         first_name=first_name,
                         last_name=last_name,
-                        email=f"{first_name.lower()}.{last_name.lower()}@gmail.com",
+                        email=f"{first_name.lower()}.{last_name.lower()}{username_suffix}@gmail.com",
                         tel_number="+391234567890",
                         fiscal_code="FISCALCODE123456",
                         birth_date=datetime(
@@ -134,13 +160,13 @@ def insert_patients_operators(numberof_patients=1, numberof_operators=1):
         current_app.logger.error("Error inserting patients and operators: %s", e)
         return
 
-def insert_locations(numberof_locations=1):
+def insert_locations(numberof_locations=1, repeat_names=False):
     
     LOCATION_LIST = ["L'Acquila","Chieti","Pescara","Catanzaro","Firenze","Teramo","Bari","Palermo","Genova","Catania","Brescia","Cosenza","Taranto","Prato","Modena"]
     MAX_LOCATIONS = len(LOCATION_LIST)
     try:
         created_locations = 0
-        while created_locations < numberof_locations and created_locations < MAX_LOCATIONS:
+        while created_locations < numberof_locations and (created_locations < MAX_LOCATIONS or repeat_names):
             lab_uuid = uuid.uuid4()
             lab_name = f"Laboratorio {random.choice(LOCATION_LIST)}"
             lab_address = f"Via {random.choice(LOCATION_LIST)} {random.randint(1, 100)}"
@@ -158,7 +184,8 @@ def insert_locations(numberof_locations=1):
         current_app.logger.error("Error inserting locations: %s", e)
         return
     
-def insert_services(numberof_services=1):
+# con repeat_names i nomi vengono ripetuti aggiungendo un numero progressivo (il nome dell'esame è univoco)
+def insert_services(numberof_services=1, repeat_names=False):
 
     SERVICE_NAME_LIST = ["Visita Oculistica", "Visita Otorinolaringoiatrica", "Visita Cardiologica", "Visita Dermatologica", "Visita Ginecologica", "Visita Ortopedica", "Visita Pediatria", "Visita Psicologica", "Visita Urologica", "Visita Neurologica", "Visita Endocrinologica"]
     MAX_SERVICES = len(SERVICE_NAME_LIST)
@@ -166,11 +193,13 @@ def insert_services(numberof_services=1):
         
         created_services = 0
         for i in range(numberof_services):
-            if created_services >= MAX_SERVICES:
+            if created_services >= MAX_SERVICES and not repeat_names:
                 break
             
             service_uuid = uuid.uuid4()
-            service_name = SERVICE_NAME_LIST[i]
+            service_name = SERVICE_NAME_LIST[i % MAX_SERVICES]
+            if i >= MAX_SERVICES:
+                service_name = f"{service_name} {i // MAX_SERVICES}"
             
             service = Service(
                 service_id=service_uuid,
@@ -184,7 +213,8 @@ def insert_services(numberof_services=1):
         current_app.logger.error("Error inserting service types: %s", e)
         return
     
-def insert_availabilities(numberof_availabilities=1):
+# max_days indica la durata massima in giorni di ciascuna disponibilità
+def insert_availabilities(numberof_availabilities=1, max_days=30):
     SLOT_DURATION_LIST = [15, 30, 45, 60]
     PAUSE_DURATION_LIST = [0, 5, 10, 15]
     AVAILABILITY_START_LIST = [time(8, 0), time(9, 0), time(10, 0), time(11, 0)]
@@ -198,7 +228,7 @@ def insert_availabilities(numberof_availabilities=1):
         
         while created_availabilities < numberof_availabilities:
             available_from_date = datetime.today()
-            available_to_date = available_from_date + timedelta(days=random.randint(1, 30)) + timedelta(hours=random.randint(1, 23))
+            available_to_date = available_from_date + timedelta(days=random.randint(1, max_days)) + timedelta(hours=random.randint(1, 23))
             available_from_time = random.choice(AVAILABILITY_START_LIST)
             available_to_time = (datetime.combine(date.today(), available_from_time) + timedelta(hours=random.randint(4, 10))).time()
             weekday_available = generate_random_datetime(available_from_date, available_to_date).weekday()
@@ -282,7 +312,9 @@ def insert_operator_absences(numberof_operator_absences=1):
         current_app.logger.error("Error inserting operator absences: %s", e)
         return
 
-def insert_appointments(numberof_appointments=1, max_not_founds=10):
+# con bulk gli slot liberi vengono generati una sola volta e ne viene prenotato un campione casuale con inserimenti massivi
+# gli inserimenti massivi non generano eventi: dopo il caricamento vanno svuotate le cache e ricostruita la tabella degli slot
+def insert_appointments(numberof_appointments=1, max_not_founds=10, bulk=False):
     try:
         
         patients = Patient.query.all()
@@ -292,6 +324,10 @@ def insert_appointments(numberof_appointments=1, max_not_founds=10):
             current_app.logger.warning("No patients or services available, skipping appointments generation.")
             return
         
+        if bulk:
+            insert_sampled_appointments(numberof_appointments, patients)
+            return
+
         created_appointments = 0
         not_found = 0
         datetime_from_filter = datetime.now()
@@ -324,14 +360,14 @@ def insert_appointments(numberof_appointments=1, max_not_founds=10):
             slots_in_that_date = grouped_slots[random_date_str]
             random_slot = random.choice(slots_in_that_date)
 
-            appointment_date = datetime.strptime(random_slot["appointment_date"], "%Y-%m-%d").date()
+            appointment_date = datetime.strptime(random_slot.appointment_date, "%Y-%m-%d").date()
 
-            time_start = datetime.strptime(random_slot["appointment_time_start"], "%H:%M").time()
-            time_end   = datetime.strptime(random_slot["appointment_time_end"],   "%H:%M").time()
+            time_start = datetime.strptime(random_slot.appointment_time_start, "%H:%M").time()
+            time_end   = datetime.strptime(random_slot.appointment_time_end,   "%H:%M").time()
 
             appointment = Appointment(
                 appointment_id=uuid.uuid4(),
-                availability_id=random_slot["availability_id"],
+                availability_id=random_slot.availability_id,
                 appointment_date=appointment_date,
                 appointment_time_start=time_start,
                 appointment_time_end=time_end,
@@ -345,6 +381,37 @@ def insert_appointments(numberof_appointments=1, max_not_founds=10):
         current_app.logger.error("Error inserting appointments: %s", e)
         return
 
+# prenota un campione casuale di tutti gli slot liberi futuri scorrendoli data per data e inserendoli a blocchi
+def insert_sampled_appointments(numberof_appointments, patients):
+    datetime_from_filter = datetime.now()
+    available_slots_count = sum(count_available_slots(datetime_from_filter).values())
+    selected_positions = set(random.sample(range(available_slots_count), min(numberof_appointments, available_slots_count)))
+    if len(selected_positions) < numberof_appointments:
+        current_app.logger.warning("Only %d free slots available for %d appointments", available_slots_count, numberof_appointments)
+
+    appointments = []
+    position = 0
+    for _, slots in iter_available_slots(datetime_from_filter):
+        for slot in slots:
+            if position in selected_positions:
+                patient = random.choice(patients)
+                appointments.append({
+                    "appointment_id": uuid.uuid4(),
+                    "availability_id": slot.availability_id,
+                    "appointment_date": date.fromisoformat(slot.appointment_date),
+                    "appointment_time_start": time.fromisoformat(slot.appointment_time_start),
+                    "appointment_time_end": time.fromisoformat(slot.appointment_time_end),
+                    "account_id": patient.account_id,
+                    "patient_id": patient.patient_id,
+                    "rejected": False
+                })
+                if len(appointments) >= BULK_INSERT_BATCH_SIZE:
+                    db.session.execute(insert(Appointment), appointments)
+                    appointments = []
+            position += 1
+    if appointments:
+        db.session.execute(insert(Appointment), appointments)
+
 def test_generated_appointments():
     try:
         appointments = Appointment.query.all()
@@ -359,19 +426,45 @@ def test_generated_appointments():
             current_app.logger.error("No availabilities available, skipping test.")
             return False
 
-        all_generable_slots = generate_available_slots(
+        # raggruppa gli appuntamenti per data per confrontarli con gli slot generati data per data senza tenere in memoria tutti gli slot
+        appointments_by_date = {}
+        for appointment in appointments:
+            appointments_by_date.setdefault(appointment.appointment_date.isoformat(), []).append(appointment)
+
+        generated_appointment_ids = set()
+        generable_slots_count = 0
+        for appointment_date_iso, slots in iter_available_slots(
             exclude_location_closure_slots=False,
             exclude_operator_absence_slots=False,
             exclude_booked_slots=False
-        )
-
-        available_slots = generate_available_slots(
+        ):
+            generable_slots_count += len(slots)
+            for appointment in appointments_by_date.get(appointment_date_iso, []):
+                if any(
+                    slot.appointment_time_start == appointment.appointment_time_start.strftime("%H:%M") and
+                    slot.appointment_time_end == appointment.appointment_time_end.strftime("%H:%M")
+                    for slot in slots
+                ):
+                    generated_appointment_ids.add(appointment.appointment_id)
+
+        booked_available_appointment_ids = set()
+        available_slots_count = 0
+        for appointment_date_iso, slots in iter_available_slots(
             exclude_booked_slots=True,
             exclude_location_closure_slots=True,
             exclude_operator_absence_slots=True
-        )
-
-        if not all_generable_slots:
+        ):
+            available_slots_count += len(slots)
+            for appointment in appointments_by_date.get(appointment_date_iso, []):
+                if any(
+                    slot.appointment_time_start == appointment.appointment_time_start.strftime("%H:%M") and
+                    slot.appointment_time_end == appointment.appointment_time_end.strftime("%H:%M") and
+                    slot.availability_id == appointment.availability_id
+                    for slot in slots
+                ):
+                    booked_available_appointment_ids.add(appointment.appointment_id)
+
+        if not generable_slots_count:
             current_app.logger.error("Error generating slots")
             return False
 
@@ -408,35 +501,47 @@ def test_generated_appointments():
                             f"appointment_id {appointment.appointment_id} overlap operator_absence_id {absence.absence_id}"
             
             # Verifica che lo slot sia stato generato correttamente
-            is_slot_into_slots_without_filter = any(
-                slot.get("appointment_date") == appointment.appointment_date.isoformat() and
-                slot.get("appointment_time_start") == appointment.appointment_time_start.strftime("%H:%M") and
-                slot.get("appointment_time_end") == appointment.appointment_time_end.strftime("%H:%M")
-                for slot in all_generable_slots.get(appointment.appointment_date.isoformat(), [])
-            )
-            
-            assert is_slot_into_slots_without_filter, f"appointment_id {appointment.appointment_id} failed consistency check with slot generator"
+            assert appointment.appointment_id in generated_appointment_ids, f"appointment_id {appointment.appointment_id} failed consistency check with slot generator"
 
             # Verifica che l'appuntamento non sia presente tra gli slot disponibili
-            is_bookable_slot_already_booked = any(
-                slot.get("appointment_date") == appointment.appointment_date.isoformat() and
-                slot.get("appointment_time_start") == appointment.appointment_time_start.strftime("%H:%M") and
-                slot.get("appointment_time_end") == appointment.appointment_time_end.strftime("%H:%M") and
-                slot.get("availability_id") == appointment.availability_id
-                for slot in available_slots.get(appointment.appointment_date.isoformat(), [])
-            )
+            assert appointment.appointment_id not in booked_available_appointment_ids, f"appointment_id {appointment.appointment_id} failed consistency check with booked slots"       
 
-            assert not is_bookable_slot_already_booked, f"appointment_id {appointment.appointment_id} failed consistency check with booked slots"       
+        # Verifica che tutti i motori restituiscano gli stessi slot nello stesso ordine del generatore python
+        for slot_engine, engine_slots, python_slots in compare_slot_engines():
+            assert engine_slots == python_slots, f"slot engine {slot_engine} failed consistency check with python generator"
     
     except Exception as e:
         current_app.logger.error("Error testing slot generator: %s", e)
         return False
     
     current_app.logger.info("Test test_slot_generator passed.")
-    current_app.logger.info("Total generalble %s", sum(len(slots) for slots in all_generable_slots.values()))
-    current_app.logger.info("Available slots %s", sum(len(slots) for slots in available_slots.values()))
+    current_app.logger.info("Total generalble %s", generable_slots_count)
+    current_app.logger.info("Available slots %s", available_slots_count)
     return True
 
+# genera gli slot della finestra della tabella degli slot con ogni motore e restituisce (motore, slot del motore, slot python)
+# la tabella viene ricostruita prima del confronto, il motore sql senza PostgreSQL usa il generatore python
+def compare_slot_engines():
+    first_date, last_date = get_slot_table_build_window()
+    datetime_from_filter = datetime.combine(first_date, time(0, 0))
+    datetime_to_filter = datetime.combine(last_date + timedelta(days=1), time(0, 0))
+    rebuild_slot_table()
+
+    def generate_engine_slots(slot_engine):
+        current_app.config["SLOT_ENGINE"] = slot_engine
+        availabilities_slots_dategroup = generate_uncached_available_slots(datetime_from_filter, datetime_to_filter)
+        return [
+            (appointment_date_iso, [slot.to_dict() for slot in availabilities_slots_dategroup[appointment_date_iso]])
+            for appointment_date_iso in sorted(availabilities_slots_dategroup)
+        ]
+
+    configured_slot_engine = current_app.config.get("SLOT_ENGINE", "python")
+    try:
+        python_slots = generate_engine_slots("python")
+        return [(slot_engine, generate_engine_slots(slot_engine), python_slots) for slot_engine in SLOT_ENGINES]
+    finally:
+        current_app.config["SLOT_ENGINE"] = configured_slot_engine
+
 def insert_demo_data():
 
     try:    
@@ -0,0 +1,91 @@
+import sys
+import time
+from datetime import datetime, timedelta
+from statistics import median
+from sqlalchemy import text
+from app.extensions import db
+from app import create_app
+from app.config import Config
+from app.models.model import Appointment, Patient
+from app.functions.generate_available_slots import get_enabled_availabilities, get_active_appointments
+
+# confronta la lettura degli appuntamenti attivi di tutta la finestra con quella limitata alle disponibilità candidate
+# gli appuntamenti di prova vengono inseriti in una transazione che viene annullata alla fine (richiede PostgreSQL)
+# uso: python benchmark_active_appointments.py [numero di appuntamenti]
+
+NUMBER_OF_APPOINTMENTS = 1_000_000
+NUMBER_OF_RUNS = 5
+
+# i dati demo e di test sono disattivati: con TEST_DATA create_app svuoterebbe tutte le tabelle
+class BenchmarkConfig(Config):
+    DEMO_DATA = False
+    TEST_DATA = False
+
+# inserisce gli appuntamenti con generate_series distribuendoli su tutte le disponibilità, un appuntamento su dieci è rejected
+def insert_benchmark_appointments(number_of_appointments, availability_ids, patient):
+    db.session.execute(text("""
+        INSERT INTO appointment (appointment_id, account_id, patient_id, availability_id, appointment_date, appointment_time_start, appointment_time_end, rejected)
+        SELECT
+            gen_random_uuid(),
+            CAST(:account_id AS uuid),
+            CAST(:patient_id AS uuid),
+            availability.ids[1 + i % cardinality(availability.ids)],
+            current_date + (i / cardinality(availability.ids) / 1440)::int,
+            time '00:00' + make_interval(mins => (i / cardinality(availability.ids) % 1440)::int),
+            time '00:01' + make_interval(mins => (i / cardinality(availability.ids) % 1440)::int),
+            i % 10 = 0
+        FROM generate_series(0, :number_of_appointments - 1) AS i, (SELECT CAST(:availability_ids AS uuid[]) AS ids) AS availability
+        ON CONFLICT DO NOTHING
+    """), {
+        "account_id": str(patient.account_id),
+        "patient_id": str(patient.patient_id),
+        "availability_ids": [str(availability_id) for availability_id in availability_ids],
+        "number_of_appointments": number_of_appointments
+    })
+    db.session.execute(text("ANALYZE appointment"))
+
+# esegue la funzione più volte e restituisce il tempo mediano in millisecondi e il numero di righe lette
+def measure(function):
+    timings = []
+    for _ in range(NUMBER_OF_RUNS):
+        start = time.perf_counter()
+        rows = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return median(timings), len(rows)
+
+def main():
+        number_of_appointments = int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_APPOINTMENTS
+        app = create_app(BenchmarkConfig)
+
+        with app.app_context():
+
+            availabilities = get_enabled_availabilities()
+            patient = Patient.query.first()
+            if not availabilities or not patient:
+                print("No availabilities or patients: insert demo data first")
+                return
+
+            try:
+                insert_benchmark_appointments(number_of_appointments, [availability.availability_id for availability in availabilities], patient)
+                from_datetime = datetime.now()
+                to_datetime = from_datetime + timedelta(days=14)
+                service_id = availabilities[0].service_id
+                candidate_ids = [availability.availability_id for availability in availabilities if availability.service_id == service_id]
+
+                # lettura precedente: tutti gli appuntamenti attivi della finestra come oggetti ORM
+                unscoped_ms, unscoped_rows = measure(lambda: Appointment.query.filter(
+                    Appointment.rejected == False,
+                    Appointment.appointment_date >= from_datetime.date(),
+                    Appointment.appointment_date <= to_datetime.date()
+                ).all())
+                # lettura attuale: solo le disponibilità candidate e solo i quattro campi della chiave dello slot
+                scoped_ms, scoped_rows = measure(lambda: get_active_appointments(from_datetime, to_datetime, candidate_ids))
+
+                print(f"Appointments inserted: {number_of_appointments}, candidate availabilities: {len(candidate_ids)}/{len(availabilities)}")
+                print(f"All availabilities, full rows: {unscoped_ms:.1f} ms, {unscoped_rows} rows")
+                print(f"Candidate availabilities, key columns: {scoped_ms:.1f} ms, {scoped_rows} rows")
+            finally:
+                db.session.rollback()
+
+if __name__ == "__main__":
+    main()
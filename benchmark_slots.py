@@ -0,0 +1,61 @@
+import argparse
+import json
+from app import create_app
+from app.config import Config
+from app.test.benchmark import (
+    BENCHMARK_PROFILES,
+    BENCHMARK_RUNS,
+    seed_benchmark_data,
+    run_benchmark_suite,
+    build_benchmark_report,
+    write_benchmark_report,
+    compare_benchmark_reports
+)
+
+# esegue il benchmark del generatore di slot e degli endpoint e salva il report JSON
+# con --seed il database viene SVUOTATO e ripopolato con il profilo indicato (da usare solo su un database di prova)
+# esempio: python benchmark_slots.py --profile production --seed --output report.json --compare previous.json
+
+class BenchmarkConfig(Config):
+    DEMO_DATA = False
+    TEST_DATA = False
+    MAIL_OUTBOX_WORKERS = 0
+
+def main():
+        parser = argparse.ArgumentParser(description="Slot generator benchmark")
+        parser.add_argument("--profile", choices=BENCHMARK_PROFILES.keys(), default="small")
+        parser.add_argument("--seed", action="store_true", help="clear the database and insert the profile dataset")
+        parser.add_argument("--runs", type=int, default=BENCHMARK_RUNS)
+        parser.add_argument("--engine", choices=["python", "numpy", "table", "sql"], default=None)
+        parser.add_argument("--cache", action="store_true", help="keep the slot result cache enabled")
+        parser.add_argument("--output", default="benchmark_report.json")
+        parser.add_argument("--compare", default=None, help="previous report to compare with")
+        args = parser.parse_args()
+
+        app = create_app(BenchmarkConfig)
+
+        with app.app_context():
+
+            if args.engine:
+                app.config["SLOT_ENGINE"] = args.engine
+            # di default la cache dei risultati è disattivata per misurare il costo della generazione
+            if not args.cache:
+                app.config["SLOT_CACHE_SIZE"] = 0
+            if args.seed:
+                seed_benchmark_data(BENCHMARK_PROFILES[args.profile])
+
+            report = build_benchmark_report(args.profile, run_benchmark_suite(args.runs))
+            write_benchmark_report(report, args.output)
+            print("Benchmark report written to", args.output)
+
+            for result in report["results"]:
+                print(f"{result['name']:<26} {result['wall_ms_median']:>10.1f} ms {result['peak_memory_kb']:>10.1f} KB {result['sql_queries']:>4} queries  {result['params']}")
+
+            if args.compare:
+                with open(args.compare) as previous_report_file:
+                    previous_report = json.load(previous_report_file)
+                for name, params, previous_ms, current_ms, ratio in compare_benchmark_reports(previous_report, report):
+                    print(f"{name:<26} {previous_ms:>10.1f} ms -> {current_ms:>10.1f} ms  x{ratio:.2f}  {params}" if ratio else f"{name:<26} {params}: no previous timing")
+
+if __name__ == "__main__":
+    main()
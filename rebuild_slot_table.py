@@ -0,0 +1,22 @@
+from app.extensions import db
+from app import create_app
+from app.config import Config
+from app.functions import rebuild_slot_table
+
+# ricostruisce la tabella degli slot materializzati: da eseguire per il ripristino e ogni giorno per spostare in avanti la finestra
+# i dati demo e di test sono disattivati: con TEST_DATA create_app svuoterebbe tutte le tabelle
+
+class RebuildSlotTableConfig(Config):
+    DEMO_DATA = False
+    TEST_DATA = False
+
+def main():
+        app = create_app(RebuildSlotTableConfig)
+
+        with app.app_context():
+        
+            slots_count = rebuild_slot_table()
+            print("Rebuilt slot table with", slots_count, "slots")
+
+if __name__ == "__main__":
+    main()